@@ -0,0 +1,211 @@
+"""Streaming bulk import of CSV/XLSX files into model rows.
+
+An importer reads the file row by row (``iter_rows``), validates rows a batch
+at a time so that foreign keys (project codes, usernames...) are resolved
+with one query per batch, and inserts the valid rows with ``bulk_create``.
+The whole import runs in one transaction: by default any invalid row rolls
+everything back, so a file can be fixed and imported again without creating
+duplicates; ``partial=True`` keeps the valid rows instead. Every problem is
+reported with its row number in an ``ImportReport``.
+
+Subclasses declare ``model``, ``columns`` (field -> accepted header names)
+and ``required``, and implement ``prepare_batch`` and ``build``.
+"""
+import codecs
+import csv
+import datetime
+import io
+import os
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse
+
+from .xlsx import XlsxError, XlsxReader
+
+DEFAULT_BATCH_SIZE = 1000
+# 1900 date system: serial 1 is 1900-01-01, with Excel's phantom 1900-02-29
+EXCEL_EPOCH = datetime.date(1899, 12, 30)
+DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y%m%d')
+# bytes examined to tell UTF-8 CSV files from GBK ones saved by Excel
+_SNIFF_BYTES = 64 * 1024
+
+
+class ImportFileError(ValueError):
+    """The file as a whole cannot be read (format, encoding or header)."""
+
+
+class RowError(NamedTuple):
+    row: int
+    column: str
+    message: str
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.errors: List[RowError] = []
+        self.committed = False
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def add_error(self, row: int, column: str, message: str) -> None:
+        self.errors.append(RowError(row, column, message))
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _csv_encoding(fh) -> str:
+    head = fh.read(_SNIFF_BYTES)
+    fh.seek(0)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return 'gb18030'
+    return 'utf-8-sig'
+
+
+def iter_rows(fh, filename: str) -> Iterator[list]:
+    """Yield the rows of a .csv or .xlsx file (binary file object ``fh``) as lists of cell values."""
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext == '.xlsx':
+        try:
+            with XlsxReader(fh) as reader:
+                yield from reader.iter_rows()
+        except XlsxError as exc:
+            raise ImportFileError(str(exc))
+    elif ext in ('.csv', '.txt'):
+        text = io.TextIOWrapper(fh, encoding=_csv_encoding(fh), newline='')
+        try:
+            yield from csv.reader(text)
+        except (UnicodeDecodeError, csv.Error) as exc:
+            raise ImportFileError('CSV 文件无法解析：%s' % exc)
+        finally:
+            text.detach()
+    else:
+        raise ImportFileError('仅支持 .csv 或 .xlsx 文件')
+
+
+def cell_text(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def parse_date(value) -> Optional[datetime.date]:
+    """Parse ``value`` as a date (ISO-like text or an Excel serial number); '' -> None."""
+    if value in (None, ''):
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if 0 < value < 2958466:
+            return EXCEL_EPOCH + datetime.timedelta(days=int(value))
+        raise ValueError(value)
+    text = str(value).strip()
+    if not text:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text.split(' ')[0], fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(value)
+
+
+class BulkImporter:
+    model = None
+    # field -> accepted header names (first one is used in messages and templates)
+    columns: Dict[str, Sequence[str]] = {}
+    required: Sequence[str] = ()
+
+    def __init__(self, user_id=None, batch_size=None, partial=False, dry_run=False):
+        self.user_id = user_id
+        self.batch_size = batch_size or getattr(settings, 'IMPORT_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+        self.partial = partial
+        self.dry_run = dry_run
+
+    def header_names(self) -> List[str]:
+        return [names[0] for names in self.columns.values()]
+
+    def map_header(self, header: list) -> Dict[str, int]:
+        lookup = {}
+        for field, names in self.columns.items():
+            for name in names:
+                lookup[name.lower()] = field
+        mapping = {}
+        for index, cell in enumerate(header):
+            field = lookup.get(cell_text(cell).lower())
+            if field and field not in mapping:
+                mapping[field] = index
+        missing = [self.columns[field][0] for field in self.required if field not in mapping]
+        if missing:
+            raise ImportFileError('缺少必需的列：%s' % '、'.join(missing))
+        return mapping
+
+    def prepare_batch(self, records: List[dict]) -> None:
+        """Look up whatever the batch refers to (one query per kind of reference)."""
+
+    def build(self, record: dict, report: ImportReport, line: int):
+        """Return an unsaved model instance for ``record``, or None after reporting its errors."""
+        raise NotImplementedError
+
+    def finish(self, objects: list) -> None:
+        """Called after each batch is inserted (e.g. to refresh denormalized data)."""
+
+    def _flush(self, batch, report):
+        records = [record for _line, record in batch]
+        self.prepare_batch(records)
+        objects = []
+        for line, record in batch:
+            obj = self.build(record, report, line)
+            if obj is not None:
+                objects.append(obj)
+        if objects and not self.dry_run:
+            self.model.objects.bulk_create(objects, batch_size=self.batch_size)
+            self.finish(objects)
+        report.created += len(objects)
+
+    def run(self, fh, filename: str) -> ImportReport:
+        """Import the file; the report tells what was (or, on rollback, would have been) created."""
+        report = ImportReport()
+        rows = iter_rows(fh, filename)
+        header = next(rows, None)
+        if header is None:
+            raise ImportFileError('文件为空')
+        mapping = self.map_header(header)
+        try:
+            with transaction.atomic():
+                batch = []
+                for line, row in enumerate(rows, start=2):
+                    record = {field: row[index] if index < len(row) else None for field, index in mapping.items()}
+                    if not any(cell_text(value) for value in record.values()):
+                        continue  # blank line
+                    report.rows += 1
+                    batch.append((line, record))
+                    if len(batch) >= self.batch_size:
+                        self._flush(batch, report)
+                        batch = []
+                if batch:
+                    self._flush(batch, report)
+                if self.dry_run or (report.errors and not self.partial):
+                    raise _Rollback
+        except _Rollback:
+            return report
+        report.committed = True
+        return report
+
+
+def template_response(importer: BulkImporter, filename: str) -> HttpResponse:
+    """An empty CSV with the importer's column headers (with a BOM so Excel reads it as UTF-8)."""
+    response = HttpResponse(content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    response.write('\ufeff')
+    csv.writer(response).writerow(importer.header_names())
+    return response
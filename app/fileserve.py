@@ -0,0 +1,235 @@
+"""Serve files from disk with HTTP validators and byte-range support.
+
+``serve_file`` answers conditional requests (``If-None-Match`` /
+``If-Modified-Since``) with ``304`` and ``Range`` requests with ``206``
+(``multipart/byteranges`` for several ranges), so PDF viewers can fetch pages
+progressively and reloads of an unchanged file cost no body transfer. Files
+served here sit behind a login, so responses are marked ``private`` and must
+be revalidated before reuse.
+
+``deliver_file`` is what views call once their permission checks pass: with
+``FILE_DELIVERY_BACKEND`` set to ``nginx`` or ``apache`` it only emits an
+``X-Accel-Redirect`` / ``X-Sendfile`` header and the front-end server streams
+the bytes, so no Python worker is held for the transfer. ``python`` (the
+default, for development) streams through ``serve_file``. Short-lived signed
+tokens let embedded iframes and downloads skip the session lookup entirely.
+"""
+import mimetypes
+import os
+import re
+import uuid
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core import signing
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+STREAM_CHUNK_SIZE = 64 * 1024
+# More ranges than this is treated as abuse and answered with the whole file.
+MAX_RANGES = 16
+CACHE_CONTROL = 'private, no-cache'
+
+_RANGE_RE = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def make_etag(st) -> str:
+    # files are replaced, never rewritten in place, so inode and size identify
+    # the content; mtime is not used because the blob store refreshes it when
+    # an identical upload is published
+    return '"%x-%x"' % (st.st_ino, st.st_size)
+
+
+def content_disposition(filename: str, as_attachment: bool = False) -> str:
+    disposition = 'attachment' if as_attachment else 'inline'
+    try:
+        filename.encode('ascii')
+        return '%s; filename="%s"' % (disposition, filename.replace('\\', '\\\\').replace('"', r'\"'))
+    except UnicodeEncodeError:
+        return "%s; filename*=utf-8''%s" % (disposition, quote(filename))
+
+
+def parse_range_header(header: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """Parse ``Range: bytes=...`` into sorted, merged inclusive ``(start, end)`` pairs.
+
+    Returns None when the header is absent, malformed or should be ignored,
+    and an empty list when no range is satisfiable.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    specs = header[len('bytes='):].split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        match = _RANGE_RE.match(spec)
+        if not match:
+            return None
+        first, last = match.groups()
+        if first == '' and last == '':
+            return None
+        if first == '':
+            # suffix range: the last N bytes
+            length = int(last)
+            if length == 0 or size == 0:
+                continue
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+            end = min(int(last), size - 1) if last else size - 1
+        ranges.append((start, end))
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _read_range(path: str, start: int, end: int):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = fh.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _multipart(path: str, ranges, size: int, content_type: str, boundary: str):
+    for start, end in ranges:
+        yield (
+            '--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n'
+            % (boundary, content_type, start, end, size)
+        ).encode('ascii')
+        for chunk in _read_range(path, start, end):
+            yield chunk
+        yield b'\r\n'
+    yield ('--%s--\r\n' % boundary).encode('ascii')
+
+
+def _not_modified(request, etag: str, mtime: float) -> bool:
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        tags = parse_etags(if_none_match)
+        return '*' in tags or etag in tags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def _if_range_matches(request, etag: str, mtime: float) -> bool:
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(mtime) <= since
+
+
+def _set_validators(response, etag: str, mtime: float) -> None:
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    response['Cache-Control'] = CACHE_CONTROL
+    response['Vary'] = 'Cookie'
+
+
+def serve_file(request, path: str, filename: Optional[str] = None, as_attachment: bool = False,
+               content_type: Optional[str] = None):
+    """Return a response for ``path`` honouring validators and ``Range`` headers."""
+    st = os.stat(path)
+    size, mtime = st.st_size, st.st_mtime
+    etag = make_etag(st)
+    filename = filename or os.path.basename(path)
+    content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    if request.method in ('GET', 'HEAD') and _not_modified(request, etag, mtime):
+        response = HttpResponseNotModified()
+        _set_validators(response, etag, mtime)
+        return response
+
+    ranges = None
+    if request.method == 'GET' and _if_range_matches(request, etag, mtime):
+        ranges = parse_range_header(request.META.get('HTTP_RANGE', ''), size)
+
+    if ranges is None:
+        response = FileResponse(open(path, 'rb'), as_attachment=as_attachment, filename=filename,
+                                content_type=content_type)
+    elif not ranges:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        response = StreamingHttpResponse(_read_range(path, start, end), status=206, content_type=content_type)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Disposition'] = content_disposition(filename, as_attachment)
+    else:
+        boundary = uuid.uuid4().hex
+        response = StreamingHttpResponse(
+            _multipart(path, ranges, size, content_type, boundary), status=206,
+            content_type='multipart/byteranges; boundary=%s' % boundary,
+        )
+        response['Content-Disposition'] = content_disposition(filename, as_attachment)
+    response['Accept-Ranges'] = 'bytes'
+    _set_validators(response, etag, mtime)
+    return response
+
+
+SIGNING_SALT = 'app.fileserve.signed-file'
+
+
+def _internal_uri(path: str) -> Optional[str]:
+    """Map ``path`` under MEDIA_ROOT onto the front-end server's internal location."""
+    root = os.path.realpath(str(settings.MEDIA_ROOT))
+    real = os.path.realpath(path)
+    if os.path.commonpath([root, real]) != root:
+        return None
+    prefix = getattr(settings, 'FILE_DELIVERY_INTERNAL_PREFIX', '/protected-media/')
+    relative = os.path.relpath(real, root).replace(os.sep, '/')
+    return prefix.rstrip('/') + '/' + quote(relative)
+
+
+def deliver_file(request, path: str, filename: Optional[str] = None, as_attachment: bool = False,
+                 content_type: Optional[str] = None):
+    """Hand ``path`` to the configured delivery backend after the caller has authorised access."""
+    backend = getattr(settings, 'FILE_DELIVERY_BACKEND', 'python')
+    filename = filename or os.path.basename(path)
+    content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = None
+    if backend == 'nginx':
+        uri = _internal_uri(path)
+        if uri:
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = uri
+    elif backend == 'apache':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = os.path.realpath(path)
+    if response is None:
+        return serve_file(request, path, filename=filename, as_attachment=as_attachment, content_type=content_type)
+    # the front-end server adds validators and handles Range for the file itself
+    response['Content-Disposition'] = content_disposition(filename, as_attachment)
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+def sign_file_token(kind: str, pk: int, download: bool = False) -> str:
+    return signing.TimestampSigner(salt=SIGNING_SALT).sign('%s:%d:%d' % (kind, pk, int(download)))
+
+
+def unsign_file_token(token: str, max_age: Optional[int] = None) -> Tuple[str, int, bool]:
+    """Return ``(kind, pk, download)``; raises ``signing.BadSignature`` (or ``SignatureExpired``)."""
+    if max_age is None:
+        max_age = getattr(settings, 'SIGNED_FILE_URL_MAX_AGE', 300)
+    value = signing.TimestampSigner(salt=SIGNING_SALT).unsign(token, max_age=max_age)
+    kind, pk, download = value.split(':')
+    return kind, int(pk), download == '1'
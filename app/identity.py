@@ -0,0 +1,84 @@
+"""Resolved identity of the logged-in user.
+
+Views that need the user's department or permission flags call
+``get_identity(request)`` instead of querying ``UserProfile`` themselves. The
+result is memoized on the request and cached across requests (keyed by user
+id); ``app.signals`` drops cached entries when a profile, department or
+permission group changes. The cache must be shared by all web processes (see
+``CACHES``), or the other processes would keep serving the old flags.
+"""
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import UserProfile
+
+CACHE_KEY = 'identity:v1:%s'
+
+
+class Identity(NamedTuple):
+    user_id: int
+    department_id: Optional[int] = None
+    department_name: Optional[str] = None
+    permission_code: str = 'member'
+    can_manage_projects: bool = False
+    can_manage_tasks: bool = False
+    can_manage_users: bool = False
+    can_manage_permissions: bool = False
+    can_view_all_tasks: bool = False
+    can_edit_all_tasks: bool = False
+
+
+def cache_key(user_id) -> str:
+    return CACHE_KEY % user_id
+
+
+def load_identity(user_id: int) -> Identity:
+    profile = (
+        UserProfile.objects
+        .select_related('department', 'permission_group')
+        .filter(user_id=user_id)
+        .first()
+    )
+    if profile is None:
+        return Identity(user_id=user_id)
+    group = profile.permission_group
+    department = profile.department
+    return Identity(
+        user_id=user_id,
+        department_id=profile.department_id,
+        department_name=department.name if department else None,
+        permission_code=group.code,
+        can_manage_projects=bool(group.can_manage_projects),
+        can_manage_tasks=bool(group.can_manage_tasks),
+        can_manage_users=bool(group.can_manage_users),
+        can_manage_permissions=bool(group.can_manage_permissions),
+        can_view_all_tasks=bool(group.can_view_all_tasks or group.can_manage_tasks),
+        can_edit_all_tasks=bool(group.can_edit_all_tasks or group.can_manage_tasks),
+    )
+
+
+def get_identity(request) -> Optional[Identity]:
+    """Return the identity of the session user (None when logged out), at most one lookup per request."""
+    user_id = request.session.get('user_id')
+    if not user_id:
+        return None
+    cached = getattr(request, '_identity', None)
+    if cached is not None and cached.user_id == user_id:
+        return cached
+    key = cache_key(user_id)
+    values = cache.get(key)
+    if values is not None:
+        identity = Identity(*values)
+    else:
+        identity = load_identity(user_id)
+        cache.set(key, tuple(identity), getattr(settings, 'IDENTITY_CACHE_TIMEOUT', 300))
+    request._identity = identity
+    return identity
+
+
+def invalidate_identities(user_ids) -> None:
+    keys = [cache_key(user_id) for user_id in user_ids]
+    if keys:
+        cache.delete_many(keys)
@@ -0,0 +1,71 @@
+"""import_records
+
+Management command to bulk import projects or tasks from a CSV or XLSX file
+(the same format as the upload pages; see ``app.bulk_import``). Rows are
+validated in batches and inserted with ``bulk_create`` in one transaction;
+by default any invalid row aborts the whole import. Every problem is printed
+with its row number, or written to ``--errors`` as CSV.
+"""
+import csv
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.bulk_import import ImportFileError
+from app.models import AppUser
+from projects.importers import ProjectImporter
+from tasks.importers import TaskImporter
+
+IMPORTERS = {
+    'projects': ProjectImporter,
+    'tasks': TaskImporter,
+}
+
+
+class Command(BaseCommand):
+    help = 'Bulk import projects or tasks from a CSV/XLSX file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS), help='What the file contains')
+        parser.add_argument('path', help='.csv or .xlsx file; the first row is the header')
+        parser.add_argument('--user', help='Username recorded as creator (and default project owner)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows validated and inserted per batch')
+        parser.add_argument('--partial', action='store_true', help='Import the valid rows even if some rows are invalid')
+        parser.add_argument('--dry-run', action='store_true', help='Validate only; nothing is written')
+        parser.add_argument('--errors', help='Write the row errors to this CSV file instead of the console')
+
+    def handle(self, *args, **options):
+        user_id = None
+        if options.get('user'):
+            user_id = AppUser.objects.filter(username=options['user']).values_list('id', flat=True).first()
+            if user_id is None:
+                raise CommandError('Unknown user %s' % options['user'])
+        importer = IMPORTERS[options['kind']](
+            user_id=user_id, batch_size=options.get('batch_size'),
+            partial=options.get('partial'), dry_run=options.get('dry_run'),
+        )
+        started = time.time()
+        try:
+            with open(options['path'], 'rb') as fh:
+                report = importer.run(fh, os.path.basename(options['path']))
+        except (OSError, ImportFileError) as exc:
+            raise CommandError(str(exc))
+        if options.get('errors'):
+            with open(options['errors'], 'w', newline='', encoding='utf-8-sig') as fh:
+                writer = csv.writer(fh)
+                writer.writerow(['row', 'column', 'message'])
+                writer.writerows(report.errors)
+        else:
+            for error in report.errors:
+                self.stdout.write(self.style.WARNING('row %d [%s]: %s' % error))
+        elapsed = time.time() - started
+        if report.committed:
+            self.stdout.write(self.style.SUCCESS('Imported %d of %d row(s), %d error(s) in %.1fs' % (
+                report.created, report.rows, len(report.errors), elapsed)))
+        elif options.get('dry_run'):
+            self.stdout.write('Dry run: %d of %d row(s) valid, %d error(s) in %.1fs' % (
+                report.created, report.rows, len(report.errors), elapsed))
+        else:
+            raise CommandError('%d error(s) in %d row(s); nothing imported (use --partial to skip invalid rows)' % (
+                len(report.errors), report.rows))
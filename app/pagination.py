@@ -0,0 +1,140 @@
+"""Keyset (cursor) pagination for list views.
+
+Instead of ``OFFSET`` the next page is selected with a ``WHERE`` on the sort
+key of the last row shown, e.g. ``updated_at < t OR (updated_at = t AND id > n)``,
+so every page costs one index range scan no matter how deep it is. The sort
+key must be unique (end it with ``id``). Cursors are opaque URL-safe tokens;
+a malformed cursor simply yields the first page.
+"""
+import base64
+import binascii
+import datetime
+import json
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+from urllib.parse import urlencode
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 20
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder rounds to milliseconds; a cursor needs the exact value
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    raw = json.dumps(list(values), cls=_CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: Optional[str], size: int) -> Optional[List[Any]]:
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def _field_name(order: str) -> str:
+    return order.lstrip('-')
+
+
+def _reverse(order: str) -> str:
+    return order[1:] if order.startswith('-') else '-' + order
+
+
+def _after(ordering: Sequence[str], values: Sequence[Any]) -> Q:
+    """``Q`` selecting rows that sort strictly after ``values`` under ``ordering``."""
+    condition = Q()
+    equal = {}
+    for order, value in zip(ordering, values):
+        lookup = '%s__%s' % (_field_name(order), 'lt' if order.startswith('-') else 'gt')
+        condition |= Q(**equal, **{lookup: value})
+        equal[_field_name(order)] = value
+    return condition
+
+
+def _key(row, ordering: Sequence[str]) -> List[Any]:
+    if isinstance(row, dict):
+        return [row[_field_name(order)] for order in ordering]
+    return [getattr(row, _field_name(order)) for order in ordering]
+
+
+class KeysetPage:
+    def __init__(self, items, ordering, has_next, has_previous):
+        self.items = items
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = encode_cursor(_key(items[-1], ordering)) if items and has_next else None
+        self.previous_cursor = encode_cursor(_key(items[0], ordering)) if items and has_previous else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_paginate(queryset, ordering: Sequence[str], after: Optional[str] = None,
+                    before: Optional[str] = None, per_page: int = DEFAULT_PAGE_SIZE) -> KeysetPage:
+    """Return the page following cursor ``after`` (or preceding ``before``) of ``queryset``.
+
+    ``ordering`` lists the sort fields like ``order_by`` does; they must be
+    selected by the queryset (model fields or annotations).
+    """
+    ordering = list(ordering)
+    after_values = decode_cursor(after, len(ordering))
+    before_values = None if after_values else decode_cursor(before, len(ordering))
+    if before_values is not None:
+        backwards = [_reverse(order) for order in ordering]
+        rows = list(queryset.filter(_after(backwards, before_values)).order_by(*backwards)[:per_page + 1])
+        has_previous = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        return KeysetPage(rows, ordering, has_next=True, has_previous=has_previous)
+    if after_values is not None:
+        queryset = queryset.filter(_after(ordering, after_values))
+    rows = list(queryset.order_by(*ordering)[:per_page + 1])
+    return KeysetPage(rows[:per_page], ordering, has_next=len(rows) > per_page,
+                      has_previous=after_values is not None)
+
+
+def keyset_iterate(queryset, ordering: Sequence[str], chunk_size: int = 1000) -> Iterator[Any]:
+    """Yield every row of ``queryset`` in ``ordering``, fetched ``chunk_size`` rows per query.
+
+    Each chunk is a keyset range query continuing after the last row of the
+    previous one, so memory stays flat on every backend (``iterator()`` on
+    MySQL still buffers the whole result client-side) and no query has to
+    skip rows like ``OFFSET`` does.
+    """
+    ordering = list(ordering)
+    queryset = queryset.order_by(*ordering)
+    last = None
+    while True:
+        chunk = queryset.filter(_after(ordering, last)) if last is not None else queryset
+        rows = list(chunk[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last = _key(rows[-1], ordering)
+
+
+def page_querystring(params, **changes) -> str:
+    """Return ``params`` (e.g. ``request.GET``) re-encoded with ``changes`` applied; None drops a key."""
+    query: Dict[str, Any] = {key: value for key, value in params.items() if value not in ('', None)}
+    for key, value in changes.items():
+        if value is None:
+            query.pop(key, None)
+        else:
+            query[key] = value
+    return urlencode(query)
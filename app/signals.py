@@ -0,0 +1,24 @@
+"""Drop cached identities when the data they were built from changes."""
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from projects.models import Department
+
+from .identity import invalidate_identities
+from .models import PermissionGroup, UserProfile
+
+
+@receiver([post_save, post_delete], sender=UserProfile, dispatch_uid='identity_profile_changed')
+def profile_changed(sender, instance, **kwargs):
+    invalidate_identities([instance.user_id])
+
+
+# pre_delete: by post_delete the profiles have already been detached (SET_NULL)
+@receiver([post_save, pre_delete], sender=Department, dispatch_uid='identity_department_changed')
+def department_changed(sender, instance, **kwargs):
+    invalidate_identities(UserProfile.objects.filter(department_id=instance.pk).values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=PermissionGroup, dispatch_uid='identity_group_changed')
+def permission_group_changed(sender, instance, **kwargs):
+    invalidate_identities(UserProfile.objects.filter(permission_group_id=instance.pk).values_list('user_id', flat=True))
@@ -0,0 +1,19 @@
+from django import template
+from django.urls import reverse
+
+from app.fileserve import sign_file_token
+from knowledge.thumbnails import is_document as _is_document
+
+register = template.Library()
+
+
+@register.simple_tag
+def signed_file_url(kind, pk, download=False):
+    """Short-lived URL for an attachment the current page has already authorised."""
+    return reverse('signed_file', args=[sign_file_token(kind, pk, download)])
+
+
+@register.filter
+def is_document(name):
+    """True for PDF/Office file names, i.e. files that get a first-page thumbnail."""
+    return _is_document(str(name or ''))
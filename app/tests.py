@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+
+from django.test import RequestFactory, SimpleTestCase
+
+from .fileserve import make_etag, parse_range_header, serve_file
+
+
+class ParseRangeHeaderTests(SimpleTestCase):
+    def test_absent_or_other_unit_is_ignored(self):
+        self.assertIsNone(parse_range_header('', 100))
+        self.assertIsNone(parse_range_header('items=0-5', 100))
+
+    def test_single_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-9', 100), [(0, 9)])
+        self.assertEqual(parse_range_header('bytes=90-', 100), [(90, 99)])
+        self.assertEqual(parse_range_header('bytes=-5', 100), [(95, 99)])
+        self.assertEqual(parse_range_header('bytes=95-200', 100), [(95, 99)])
+
+    def test_suffix_longer_than_file_is_whole_file(self):
+        self.assertEqual(parse_range_header('bytes=-500', 100), [(0, 99)])
+
+    def test_overlapping_and_adjacent_ranges_are_merged(self):
+        self.assertEqual(parse_range_header('bytes=50-59, 0-9, 10-19, 55-70', 100), [(0, 19), (50, 70)])
+
+    def test_malformed_ranges_are_ignored(self):
+        self.assertIsNone(parse_range_header('bytes=-', 100))
+        self.assertIsNone(parse_range_header('bytes=9-0', 100))
+        self.assertIsNone(parse_range_header('bytes=a-b', 100))
+
+    def test_too_many_ranges_are_ignored(self):
+        self.assertIsNone(parse_range_header('bytes=' + ','.join('%d-%d' % (i, i) for i in range(0, 40, 2)), 100))
+
+    def test_unsatisfiable_ranges(self):
+        self.assertEqual(parse_range_header('bytes=100-', 100), [])
+        self.assertEqual(parse_range_header('bytes=-0', 100), [])
+
+    def test_empty_file_has_no_satisfiable_range(self):
+        self.assertEqual(parse_range_header('bytes=-5', 0), [])
+        self.assertEqual(parse_range_header('bytes=0-', 0), [])
+
+
+class ServeFileTests(SimpleTestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'doc.pdf')
+        with open(self.path, 'wb') as fh:
+            fh.write(b'0123456789')
+        self.factory = RequestFactory()
+
+    def test_etag_survives_a_touch(self):
+        etag = make_etag(os.stat(self.path))
+        os.utime(self.path, (1, 1))
+        self.assertEqual(make_etag(os.stat(self.path)), etag)
+
+    def test_range_and_if_range(self):
+        etag = make_etag(os.stat(self.path))
+        response = serve_file(self.factory.get('/', HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE=etag), self.path)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(b''.join(response.streaming_content), b'234')
+
+    def test_if_none_match(self):
+        etag = make_etag(os.stat(self.path))
+        response = serve_file(self.factory.get('/', HTTP_IF_NONE_MATCH=etag), self.path)
+        self.assertEqual(response.status_code, 304)
+
+    def test_range_of_empty_file(self):
+        empty = os.path.join(self.dir, 'empty.pdf')
+        open(empty, 'wb').close()
+        response = serve_file(self.factory.get('/', HTTP_RANGE='bytes=-5'), empty)
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */0')
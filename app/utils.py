@@ -1,3 +1,4 @@
+import hashlib
 from typing import Dict, Any
 
 
@@ -14,3 +15,25 @@ def build_base_context(request) -> Dict[str, Any]:
         'can_edit_all_tasks': session.get('can_edit_all_tasks', False),
         'department_id': session.get('department_id'),
     }
+
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def sha256_of_file(path: str) -> str:
+    """Hex SHA-256 of a file on disk, read in 1 MB chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def ensure_content_sha256(instance, field: str = 'file') -> str:
+    """Return ``instance.content_sha256``, hashing the file once and persisting it if missing."""
+    if instance.content_sha256:
+        return instance.content_sha256
+    value = sha256_of_file(getattr(instance, field).path)
+    type(instance).objects.filter(pk=instance.pk).update(content_sha256=value)
+    instance.content_sha256 = value
+    return value
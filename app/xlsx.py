@@ -0,0 +1,274 @@
+"""Minimal streaming reader and writer for .xlsx workbooks (standard library only).
+
+Sheets are parsed with ``iterparse`` and every ``<row>`` element is cleared
+once yielded, so memory stays flat however many rows a sheet has. Only the
+shared-string table is held in memory, as cells refer to it by index.
+Cell styles are ignored: dates come back as Excel serial numbers.
+
+``iter_xlsx`` goes the other way: it writes a one-sheet workbook as a stream
+of zip chunks (inline strings, no shared-string table), so a response can
+send rows as they are read.
+"""
+import datetime
+import decimal
+import posixpath
+import re
+import zipfile
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+from xml.sax.saxutils import escape
+from xml.etree.ElementTree import iterparse
+
+NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+NS_PKG_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+_M = '{%s}' % NS_MAIN
+_CELL_REF_RE = re.compile(r'^([A-Z]+)')
+
+
+class XlsxError(ValueError):
+    """Raised for files that are not readable .xlsx workbooks."""
+
+
+def column_index(ref: str) -> int:
+    """``'A1'`` -> 0, ``'AB7'`` -> 27."""
+    match = _CELL_REF_RE.match(ref or '')
+    if not match:
+        return -1
+    index = 0
+    for ch in match.group(1):
+        index = index * 26 + (ord(ch) - 64)
+    return index - 1
+
+
+def _text_of(elem) -> str:
+    # <si>/<is> hold either one <t> or several rich-text runs <r><t>
+    return ''.join(t.text or '' for t in elem.iter(_M + 't'))
+
+
+def _shared_strings(zf) -> List[str]:
+    try:
+        fh = zf.open('xl/sharedStrings.xml')
+    except KeyError:
+        return []
+    strings = []
+    with fh:
+        for _event, elem in iterparse(fh):
+            if elem.tag == _M + 'si':
+                strings.append(_text_of(elem))
+                elem.clear()
+    return strings
+
+
+def _sheet_targets(zf) -> Dict[str, str]:
+    """Return ``{sheet name: zip member}`` in workbook order."""
+    rels = {}
+    with zf.open('xl/_rels/workbook.xml.rels') as fh:
+        for _event, elem in iterparse(fh):
+            if elem.tag == '{%s}Relationship' % NS_PKG_REL:
+                target = elem.get('Target', '')
+                if target.startswith('/'):
+                    target = target.lstrip('/')
+                else:
+                    target = posixpath.normpath(posixpath.join('xl', target))
+                rels[elem.get('Id')] = target
+    sheets = {}
+    with zf.open('xl/workbook.xml') as fh:
+        for _event, elem in iterparse(fh):
+            if elem.tag == _M + 'sheet':
+                sheets[elem.get('name')] = rels.get(elem.get('{%s}id' % NS_REL))
+    return sheets
+
+
+def _cell_value(cell, shared: List[str]):
+    kind = cell.get('t', 'n')
+    if kind == 'inlineStr':
+        inline = cell.find(_M + 'is')
+        return _text_of(inline) if inline is not None else ''
+    value = cell.find(_M + 'v')
+    if value is None or value.text is None:
+        return None
+    raw = value.text
+    if kind == 's':
+        try:
+            return shared[int(raw)]
+        except (ValueError, IndexError):
+            return ''
+    if kind == 'b':
+        return raw == '1'
+    if kind in ('str', 'e'):
+        return raw
+    try:
+        number = float(raw)
+    except ValueError:
+        return raw
+    return int(number) if number.is_integer() else number
+
+
+class XlsxReader:
+    """Open a workbook and iterate its sheets row by row.
+
+    Usable as a context manager; ``source`` is a path or a binary file object.
+    """
+
+    def __init__(self, source):
+        try:
+            self._zip = zipfile.ZipFile(source)
+            self._sheets = _sheet_targets(self._zip)
+        except (zipfile.BadZipFile, KeyError) as exc:
+            raise XlsxError('Not an .xlsx workbook: %s' % exc)
+        self._shared = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        self._zip.close()
+
+    @property
+    def sheet_names(self) -> List[str]:
+        return list(self._sheets)
+
+    def iter_rows(self, sheet: Optional[str] = None) -> Iterator[list]:
+        """Yield each row of ``sheet`` (default: the first) as a list of cell values.
+
+        Missing cells inside a row are ``None``; rows without any cell are skipped.
+        """
+        if self._shared is None:
+            self._shared = _shared_strings(self._zip)
+        name = sheet if sheet is not None else next(iter(self._sheets), None)
+        member = self._sheets.get(name)
+        if not member:
+            raise XlsxError('No such sheet: %s' % name)
+        with self._zip.open(member) as fh:
+            sheet_data = None
+            for event, elem in iterparse(fh, events=('start', 'end')):
+                if event == 'start':
+                    if elem.tag == _M + 'sheetData':
+                        sheet_data = elem
+                    continue
+                if elem.tag != _M + 'row':
+                    continue
+                row = []
+                for cell in elem.iter(_M + 'c'):
+                    index = column_index(cell.get('r', ''))
+                    if index < 0:
+                        index = len(row)
+                    if index >= len(row):
+                        row.extend([None] * (index - len(row) + 1))
+                    row[index] = _cell_value(cell, self._shared)
+                # drop parsed rows from the tree so memory does not grow with the sheet
+                if sheet_data is not None:
+                    sheet_data.clear()
+                else:
+                    elem.clear()
+                if row:
+                    yield row
+
+
+# -- writer ------------------------------------------------------------------
+
+# characters XML 1.0 does not allow, even escaped
+_ILLEGAL_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+# bytes of sheet XML gathered before they are compressed and handed out
+_FLUSH_BYTES = 64 * 1024
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="%s">'
+    '<Relationship Id="rId1" Type="%s/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+) % (NS_PKG_REL, NS_REL)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="%s" xmlns:r="%s"><sheets><sheet name="%%s" sheetId="1" r:id="rId1"/></sheets></workbook>'
+) % (NS_MAIN, NS_REL)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="%s">'
+    '<Relationship Id="rId1" Type="%s/worksheet" Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+) % (NS_PKG_REL, NS_REL)
+
+
+class _Chunks:
+    """Write-only file object collecting what ``ZipFile`` writes until it is drained."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def _cell_xml(value) -> str:
+    if value is None or value == '':
+        return '<c/>'
+    if isinstance(value, bool):
+        return '<c t="b"><v>%d</v></c>' % value
+    if isinstance(value, (int, float, decimal.Decimal)):
+        return '<c><v>%s</v></c>' % value
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        # text keeps the writer style-free; Excel still recognises ISO dates when sorting/filtering
+        value = value.strftime('%Y-%m-%d %H:%M:%S' if isinstance(value, datetime.datetime) else '%Y-%m-%d')
+    text = _ILLEGAL_XML_RE.sub('', str(value))
+    return '<c t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % escape(text)
+
+
+def _row_xml(cells: Sequence) -> str:
+    return '<row>%s</row>' % ''.join(_cell_xml(value) for value in cells)
+
+
+def iter_xlsx(rows: Iterable[Sequence], sheet_name: str = 'Sheet1') -> Iterator[bytes]:
+    """Yield the bytes of a one-sheet .xlsx workbook holding ``rows`` (header first).
+
+    Rows are consumed lazily and output is produced every ``_FLUSH_BYTES`` of
+    sheet XML, so memory does not depend on the number of rows.
+    """
+    sink = _Chunks()
+    sheet_name = escape(_ILLEGAL_XML_RE.sub('', sheet_name))[:31] or 'Sheet1'
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        zf.writestr('_rels/.rels', _ROOT_RELS)
+        zf.writestr('xl/workbook.xml', _WORKBOOK % sheet_name)
+        zf.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+        yield sink.drain()
+        with zf.open('xl/worksheets/sheet1.xml', 'w') as fh:
+            fh.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                      '<worksheet xmlns="%s"><sheetData>' % NS_MAIN).encode('utf-8'))
+            pending, size = [], 0
+            for cells in rows:
+                xml = _row_xml(cells)
+                pending.append(xml)
+                size += len(xml)
+                if size >= _FLUSH_BYTES:
+                    fh.write(''.join(pending).encode('utf-8'))
+                    pending, size = [], 0
+                    data = sink.drain()
+                    if data:
+                        yield data
+            fh.write((''.join(pending) + '</sheetData></worksheet>').encode('utf-8'))
+    yield sink.drain()
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class AttachmentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'attachments'
\ No newline at end of file
+    name = 'attachments'
+
+    def ready(self):
+        from . import signals  # noqa: F401
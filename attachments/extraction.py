@@ -0,0 +1,286 @@
+"""Plain-text extraction from uploaded files, so their contents can be searched.
+
+Each distinct file (by SHA-256) is extracted once into an ``ExtractedText``
+row and tokenized into ``ExtractedTextToken`` rows with the same tokenizer as
+knowledge item search. Readers stream their input (XML via ``iterparse``,
+spreadsheets row by row, PDFs through ``pdftotext``) and stop at
+``TEXT_EXTRACT_MAX_CHARS``, so a huge spreadsheet costs bounded memory.
+
+Formats: docx, pptx, xlsx (standard library), pdf (PyMuPDF or poppler's
+``pdftotext``), plain text, and legacy doc/xls/ppt through their PDF preview
+once the preview worker has produced one.
+"""
+import io
+import logging
+import os
+import re
+import shutil
+import subprocess
+import zipfile
+import zlib
+from collections import Counter
+from xml.etree.ElementTree import ParseError, iterparse
+
+from django.conf import settings
+from django.db import transaction
+
+from app.utils import ensure_content_sha256
+from app.xlsx import XlsxError, XlsxReader
+from knowledge.search import MAX_TOKEN_REPEAT, index_tokens
+
+from .models import ExtractedText, ExtractedTextToken
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:  # optional; fall back to pdftotext
+    fitz = None
+
+logger = logging.getLogger(__name__)
+
+# Bump when extraction output changes; older rows are re-extracted by extract_text.
+EXTRACTOR_VERSION = 'text-2'  # text-2: Latin word prefixes are indexed
+TEXT_EXTS = {'.txt', '.csv', '.md', '.log'}
+# Tokenize long texts slice by slice so the token list never holds the whole text.
+TOKENIZE_SLICE = 64 * 1024
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_A = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+_SLIDE_RE = re.compile(r'^ppt/slides/slide(\d+)\.xml$')
+
+
+def max_chars():
+    return getattr(settings, 'TEXT_EXTRACT_MAX_CHARS', 1000000)
+
+
+class _Full(Exception):
+    pass
+
+
+class ExtractorUnavailable(RuntimeError):
+    """The tool needed for this format is not installed; nothing is recorded so a later run retries."""
+
+
+class TextBuffer:
+    """Collects text up to ``limit`` characters; ``write`` raises ``_Full`` past it."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.parts = []
+        self.size = 0
+        self.truncated = False
+
+    def write(self, text):
+        if not text:
+            return
+        room = self.limit - self.size
+        if len(text) > room:
+            self.parts.append(text[:room])
+            self.size = self.limit
+            self.truncated = True
+            raise _Full()
+        self.parts.append(text)
+        self.size += len(text)
+
+    def getvalue(self):
+        return ''.join(self.parts)
+
+
+def _ooxml_paragraphs(fh, buf, text_tag, paragraph_tag):
+    for _event, elem in iterparse(fh):
+        if elem.tag == text_tag:
+            buf.write(elem.text)
+        elif elem.tag == paragraph_tag:
+            buf.write('\n')
+            elem.clear()
+
+
+def _extract_docx(path, buf):
+    with zipfile.ZipFile(path) as zf:
+        members = zf.namelist()
+        names = ['word/document.xml'] + sorted(
+            name for name in members if re.match(r'^word/(header|footer|footnotes|endnotes)\d*\.xml$', name)
+        )
+        for name in names:
+            if name not in members:
+                continue
+            with zf.open(name) as fh:
+                _ooxml_paragraphs(fh, buf, _W + 't', _W + 'p')
+
+
+def _extract_pptx(path, buf):
+    with zipfile.ZipFile(path) as zf:
+        slides = sorted(
+            (int(m.group(1)), name) for name in zf.namelist() for m in [_SLIDE_RE.match(name)] if m
+        )
+        for _number, name in slides:
+            with zf.open(name) as fh:
+                _ooxml_paragraphs(fh, buf, _A + 't', _A + 'p')
+            buf.write('\n')
+
+
+def _extract_xlsx(path, buf):
+    with XlsxReader(path) as reader:
+        for sheet in reader.sheet_names:
+            buf.write(sheet + '\n')
+            for row in reader.iter_rows(sheet):
+                buf.write('\t'.join('' if value is None else str(value) for value in row) + '\n')
+
+
+def _extract_pdf(path, buf):
+    if fitz is not None:
+        doc = fitz.open(path)
+        try:
+            for page in doc:
+                buf.write(page.get_text())
+        finally:
+            doc.close()
+        return
+    pdftotext = shutil.which('pdftotext')
+    if not pdftotext:
+        raise ExtractorUnavailable('pdftotext not installed')
+    proc = subprocess.Popen([pdftotext, '-enc', 'UTF-8', '-q', path, '-'], stdout=subprocess.PIPE)
+    try:
+        for line in io.TextIOWrapper(proc.stdout, encoding='utf-8', errors='replace'):
+            buf.write(line)
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+
+def _extract_plain(path, buf):
+    with open(path, 'rb') as fh:
+        head = fh.read(4096)
+    encoding = 'utf-8'
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as exc:
+        # a multi-byte character cut at the end of the sample is not an error
+        if exc.start < len(head) - 4:
+            encoding = 'gb18030'
+    with open(path, encoding=encoding, errors='replace') as fh:
+        for chunk in iter(lambda: fh.read(TOKENIZE_SLICE), ''):
+            buf.write(chunk)
+
+
+EXTRACTORS = {
+    '.docx': _extract_docx,
+    '.pptx': _extract_pptx,
+    '.xlsx': _extract_xlsx,
+    '.pdf': _extract_pdf,
+}
+EXTRACTORS.update({ext: _extract_plain for ext in TEXT_EXTS})
+LEGACY_OFFICE_EXTS = {'.doc', '.xls', '.ppt'}
+
+
+def can_extract(name):
+    ext = os.path.splitext(name or '')[1].lower()
+    return ext in EXTRACTORS or ext in LEGACY_OFFICE_EXTS
+
+
+def extract_file(path, ext=None):
+    """Return ``(text, truncated)`` for the file at ``path``; raises on unreadable input."""
+    ext = (ext or os.path.splitext(path)[1]).lower()
+    extractor = EXTRACTORS.get(ext)
+    if extractor is None:
+        raise ValueError('No text extractor for %s' % ext)
+    buf = TextBuffer(max_chars())
+    try:
+        extractor(path, buf)
+    except _Full:
+        pass
+    return buf.getvalue(), buf.truncated
+
+
+def text_token_weights(text):
+    counts = Counter()
+    for start in range(0, len(text), TOKENIZE_SLICE):
+        counts.update(index_tokens(text[start:start + TOKENIZE_SLICE]))
+    return {token: min(count, MAX_TOKEN_REPEAT) for token, count in counts.items()}
+
+
+def store_text(content_sha256, text, truncated=False, error=''):
+    """Save extracted text for ``content_sha256`` and rebuild its token rows."""
+    data = zlib.compress(text.encode('utf-8'), 6) if text else b''
+    with transaction.atomic():
+        row, _created = ExtractedText.objects.update_or_create(
+            content_sha256=content_sha256,
+            defaults={
+                'extractor_version': EXTRACTOR_VERSION,
+                'data': data,
+                'char_count': len(text),
+                'truncated': truncated,
+                'error': error[:255],
+            },
+        )
+        ExtractedTextToken.objects.filter(text=row).delete()
+        ExtractedTextToken.objects.bulk_create(
+            [ExtractedTextToken(text=row, token=token, weight=weight)
+             for token, weight in text_token_weights(text).items()],
+            batch_size=1000,
+        )
+    return row
+
+
+def _source_path(attachment):
+    """File to read text from: the upload itself, or the PDF preview of a legacy Office file."""
+    fpath = attachment.file.path
+    ext = os.path.splitext(fpath)[1].lower()
+    if ext in LEGACY_OFFICE_EXTS:
+        from knowledge.previews import find_preview
+        return find_preview(attachment), '.pdf'
+    return fpath, ext
+
+
+def extract_attachment_text(attachment, force=False):
+    """Extract and index the text of ``attachment`` unless its content was already done.
+
+    Works for any model with ``file`` and ``content_sha256`` fields. Returns
+    the ``ExtractedText`` row, or None when the file type is not supported,
+    (legacy Office) its PDF preview does not exist yet, or the file could not
+    be read this time.
+    """
+    try:
+        fpath = attachment.file.path
+    except Exception:
+        return None
+    if not can_extract(fpath) or not os.path.exists(fpath):
+        return None
+    content_hash = ensure_content_sha256(attachment)
+    if not force:
+        existing = ExtractedText.objects.filter(
+            content_sha256=content_hash, extractor_version=EXTRACTOR_VERSION,
+        ).only('id').first()
+        if existing:
+            return existing
+    source, ext = _source_path(attachment)
+    if not source:
+        return None
+    try:
+        text, truncated = extract_file(source, ext)
+        error = ''
+    except ExtractorUnavailable as exc:
+        logger.warning('Cannot extract text from %s: %s', fpath, exc)
+        return None
+    except OSError as exc:
+        # I/O trouble (storage hiccup, file being replaced) says nothing about
+        # the content: record nothing so the next run retries
+        logger.warning('Could not read %s for text extraction: %s', fpath, exc)
+        return None
+    except (zipfile.BadZipFile, XlsxError, ParseError, KeyError, ValueError) as exc:
+        logger.warning('Text extraction failed for %s: %s', fpath, exc)
+        text, truncated, error = '', False, str(exc) or exc.__class__.__name__
+    # unreadable content is stored too, so it is not retried until the extractor changes
+    return store_text(content_hash, text, truncated=truncated, error=error)
+
+
+def extract_after_upload(attachment):
+    """Index a fresh upload right away if it is small; larger files wait for ``manage.py extract_text``."""
+    try:
+        if attachment.file.size > getattr(settings, 'TEXT_EXTRACT_INLINE_MAX_BYTES', 2 * 1024 * 1024):
+            return None
+        return extract_attachment_text(attachment)
+    except Exception:
+        logger.exception('Text extraction failed for uploaded attachment %s', attachment.pk)
+        return None
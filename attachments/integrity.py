@@ -0,0 +1,220 @@
+"""Consistency check of the media tree against the attachment tables.
+
+``check_media`` lists the upload directories and the preview cache with a
+pool of ``os.scandir`` workers (one directory per task) and cross-references
+what it finds with ``Attachment`` and ``KnowledgeAttachment`` rows in bulk,
+one query per batch of names. It reports
+
+* missing files: rows whose file is not on disk;
+* orphans: upload files no row refers to (older than ``ORPHAN_MIN_AGE``);
+* stale previews: ``.preview.pdf`` files whose upload is gone, and preview
+  cache entries of content no attachment has any more;
+* checksum mismatches (``verify=True``): files whose SHA-256 differs from
+  the one recorded on the row.
+
+``reclaim`` frees orphans through the purge queue (which re-checks every
+reference before deleting) and removes stale previews.
+"""
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, List, NamedTuple, Tuple
+
+from app.pagination import keyset_iterate
+from app.utils import sha256_of_file
+from knowledge import preview_cache
+from knowledge.previews import LEGACY_PREVIEW_SUFFIX
+
+from .purge import FILE_MODELS, ORPHAN_MIN_AGE, UPLOAD_DIRS, purge_files, queue_unreferenced, referenced_names
+from .storage import BLOB_PREFIX, blob_storage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+DEFAULT_BATCH_SIZE = 1000
+
+
+class MediaFile(NamedTuple):
+    path: str
+    size: int
+    mtime: float
+
+
+class RowFile(NamedTuple):
+    model: str
+    pk: int
+    name: str
+
+
+class MediaReport:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.rows = 0
+        self.missing: List[RowFile] = []
+        self.orphans: List[MediaFile] = []
+        self.stale_previews: List[MediaFile] = []
+        self.mismatched: List[Tuple[RowFile, str]] = []
+
+    @property
+    def ok(self) -> bool:
+        return not (self.missing or self.orphans or self.stale_previews or self.mismatched)
+
+    def reclaimable_bytes(self) -> int:
+        return sum(f.size for f in self.orphans) + sum(f.size for f in self.stale_previews)
+
+
+def _scan_dir(path):
+    files, dirs = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        st = entry.stat(follow_symlinks=False)
+                        files.append(MediaFile(entry.path, st.st_size, st.st_mtime))
+                except OSError:
+                    continue
+    except FileNotFoundError:
+        pass
+    except OSError:
+        logger.warning('Could not list %s', path, exc_info=True)
+    return files, dirs
+
+
+def scan_tree(roots: Iterable[str], workers: int = DEFAULT_WORKERS, skip: Iterable[str] = ()) -> Iterator[MediaFile]:
+    """Yield every file under ``roots``; directories are listed concurrently by ``workers`` threads."""
+    skip = set(skip)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_scan_dir, root) for root in roots}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                pending.update(pool.submit(_scan_dir, path) for path in dirs if path not in skip)
+                yield from files
+
+
+def _media_name(path):
+    return os.path.relpath(path, blob_storage.path('')).replace(os.sep, '/')
+
+
+def _find_orphans(report, names, now):
+    live = referenced_names([name for name, _file in names])
+    report.orphans.extend(
+        media_file for name, media_file in names
+        if name not in live and now - media_file.mtime >= ORPHAN_MIN_AGE
+    )
+
+
+def _scan_uploads(report, workers, batch_size, now):
+    """Walk the upload directories; returns the set of file names found."""
+    on_disk = set()
+    legacy_previews = []
+    batch = []
+    roots = [blob_storage.path(top) for top in UPLOAD_DIRS]
+    # blobs/tmp holds uploads still being written
+    for media_file in scan_tree(roots, workers, skip=[blob_storage.path(BLOB_PREFIX + '/tmp')]):
+        name = _media_name(media_file.path)
+        report.files += 1
+        report.bytes += media_file.size
+        if name.endswith(LEGACY_PREVIEW_SUFFIX):
+            legacy_previews.append((name, media_file))
+            continue
+        on_disk.add(name)
+        batch.append((name, media_file))
+        if len(batch) >= batch_size:
+            _find_orphans(report, batch, now)
+            batch = []
+    if batch:
+        _find_orphans(report, batch, now)
+    # a preview whose upload is still there goes away with it (purge removes both)
+    report.stale_previews.extend(
+        media_file for name, media_file in legacy_previews
+        if name[:-len(LEGACY_PREVIEW_SUFFIX)] not in on_disk
+    )
+    return on_disk
+
+
+def _check_rows(report, on_disk, batch_size):
+    """Find rows without a file; returns ``(live content hashes, rows to verify)``."""
+    hashes = set()
+    to_verify = {}
+    upload_prefixes = tuple(top + '/' for top in UPLOAD_DIRS)
+    for model in FILE_MODELS:
+        label = model._meta.label
+        rows = model.objects.exclude(file='').values('id', 'file', 'content_sha256')
+        for row in keyset_iterate(rows, ('id',), batch_size):
+            report.rows += 1
+            name = row['file']
+            if row['content_sha256']:
+                hashes.add(row['content_sha256'])
+            present = name in on_disk if name.startswith(upload_prefixes) else os.path.exists(blob_storage.path(name))
+            if not present:
+                report.missing.append(RowFile(label, row['id'], name))
+            elif row['content_sha256'] and name not in to_verify:
+                to_verify[name] = (RowFile(label, row['id'], name), row['content_sha256'])
+    return hashes, list(to_verify.values())
+
+
+def _check_preview_cache(report, hashes, workers, now):
+    versions = (preview_cache.CONVERTER_VERSION,) + tuple(preview_cache.REUSABLE_VERSIONS)
+    live_keys = {preview_cache.cache_key(h, version) for h in hashes for version in versions}
+    for media_file in scan_tree([preview_cache.cache_root()], workers):
+        if now - media_file.mtime < ORPHAN_MIN_AGE:
+            continue  # may be being written or just stored
+        key = os.path.basename(media_file.path).split('.', 1)[0]
+        # leftover .tmp files of interrupted writes are stale as well
+        if key not in live_keys or media_file.path.endswith('.tmp'):
+            report.stale_previews.append(media_file)
+
+
+def _verify(report, to_verify, workers):
+    def digest(item):
+        row, _expected = item
+        try:
+            return sha256_of_file(blob_storage.path(row.name))
+        except OSError:
+            return None
+
+    # hashing releases the GIL, so threads keep several disks/cores busy
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for (row, expected), actual in zip(to_verify, pool.map(digest, to_verify)):
+            if actual is None:
+                report.missing.append(row)
+            elif actual != expected:
+                report.mismatched.append((row, actual))
+
+
+def check_media(workers=DEFAULT_WORKERS, verify=False, batch_size=DEFAULT_BATCH_SIZE) -> MediaReport:
+    report = MediaReport()
+    now = time.time()
+    on_disk = _scan_uploads(report, workers, batch_size, now)
+    hashes, to_verify = _check_rows(report, on_disk, batch_size)
+    _check_preview_cache(report, hashes, workers, now)
+    if verify:
+        _verify(report, to_verify, workers)
+    return report
+
+
+def reclaim(report, batch_size=DEFAULT_BATCH_SIZE):
+    """Free the orphans and stale previews of ``report``; returns ``(files removed, bytes freed)``."""
+    names = [_media_name(media_file.path) for media_file in report.orphans]
+    for start in range(0, len(names), batch_size):
+        queue_unreferenced(names[start:start + batch_size])
+    handled, freed = purge_files(batch_size)
+    removed = 0
+    for media_file in report.stale_previews:
+        try:
+            os.remove(media_file.path)
+        except FileNotFoundError:
+            continue
+        except OSError:
+            logger.warning('Could not remove %s', media_file.path, exc_info=True)
+            continue
+        removed += 1
+        freed += media_file.size
+    return handled + removed, freed
@@ -0,0 +1,66 @@
+"""check_media
+
+Management command to check the media tree against the attachment tables:
+files missing for rows, orphaned upload files, stale previews and (with
+``--verify``) checksum mismatches. Directories are listed by parallel
+``os.scandir`` workers and rows are matched in bulk. Nothing is changed
+unless ``--reclaim`` is given; ``--reclaim --dry-run`` shows what would be
+removed. Orphans are removed through the purge queue, which re-checks every
+reference first. Fails (exit status 1) when rows have missing or corrupted
+files, so cron can alert on it.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from attachments.integrity import DEFAULT_BATCH_SIZE, DEFAULT_WORKERS, check_media, reclaim
+
+
+class Command(BaseCommand):
+    help = 'Report missing, orphaned and stale media files; optionally reclaim orphans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Parallel directory/hash workers')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Names matched per query')
+        parser.add_argument('--verify', action='store_true', help='Also re-hash files and compare with the rows')
+        parser.add_argument('--reclaim', action='store_true', help='Remove orphaned files and stale previews')
+        parser.add_argument('--dry-run', action='store_true', help='With --reclaim: only report what would be removed')
+        parser.add_argument('--limit', type=int, default=20, help='Entries listed per category (0: all)')
+
+    def _list(self, title, entries, fmt):
+        if not entries:
+            return
+        self.stdout.write(self.style.WARNING('%s: %d' % (title, len(entries))))
+        limit = self.limit or len(entries)
+        for entry in entries[:limit]:
+            self.stdout.write('  ' + fmt(entry))
+        if len(entries) > limit:
+            self.stdout.write('  ... %d more' % (len(entries) - limit))
+
+    def handle(self, *args, **options):
+        self.limit = options.get('limit')
+        batch_size = options.get('batch_size') or DEFAULT_BATCH_SIZE
+        started = time.time()
+        report = check_media(workers=options.get('workers') or DEFAULT_WORKERS,
+                             verify=options.get('verify'), batch_size=batch_size)
+        self.stdout.write('Scanned %d file(s) (%.1f MB) and %d row(s) in %.1fs' % (
+            report.files, report.bytes / 1024 ** 2, report.rows, time.time() - started))
+        self._list('Missing files', report.missing, lambda row: '%s #%s %s' % row)
+        self._list('Orphaned files', report.orphans, lambda f: '%s (%d bytes)' % (f.path, f.size))
+        self._list('Stale previews', report.stale_previews, lambda f: '%s (%d bytes)' % (f.path, f.size))
+        self._list('Checksum mismatches', report.mismatched,
+                   lambda item: '%s #%s %s (now %s)' % (item[0] + (item[1],)))
+        if report.ok:
+            self.stdout.write(self.style.SUCCESS('Media tree is consistent'))
+            return
+        reclaimable = report.reclaimable_bytes() / 1024 ** 2
+        if options.get('reclaim') and not options.get('dry_run'):
+            removed, freed = reclaim(report, batch_size)
+            self.stdout.write(self.style.SUCCESS('Removed %d file(s), %.1f MB freed' % (removed, freed / 1024 ** 2)))
+        elif options.get('reclaim'):
+            self.stdout.write('Dry run: would remove %d file(s), %.1f MB' % (
+                len(report.orphans) + len(report.stale_previews), reclaimable))
+        else:
+            self.stdout.write('%.1f MB reclaimable with --reclaim' % reclaimable)
+        if report.missing or report.mismatched:
+            raise CommandError('%d missing and %d corrupted file(s)' % (len(report.missing), len(report.mismatched)))
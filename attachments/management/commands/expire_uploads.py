@@ -0,0 +1,22 @@
+"""expire_uploads
+
+Management command to delete chunked uploads that were abandoned (not resumed
+within CHUNKED_UPLOAD_EXPIRE_HOURS) together with their partial files.
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from attachments.uploads import expire_uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned chunked uploads and their partial files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, help='Age threshold (default: CHUNKED_UPLOAD_EXPIRE_HOURS)')
+
+    def handle(self, *args, **options):
+        max_age = timedelta(hours=options['hours']) if options.get('hours') is not None else None
+        count = expire_uploads(max_age)
+        self.stdout.write(self.style.SUCCESS('Removed %d abandoned upload(s)' % count))
@@ -0,0 +1,71 @@
+"""extract_text
+
+Management command to extract searchable text from knowledge and project
+attachments. Incremental: files whose content was already extracted by the
+current extractor version are skipped, so it is cheap to run from cron.
+Legacy .doc/.xls/.ppt files are picked up once their PDF preview exists.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from attachments.extraction import EXTRACTORS, EXTRACTOR_VERSION, LEGACY_OFFICE_EXTS, extract_attachment_text
+from attachments.models import Attachment, ExtractedText
+from knowledge.models import KnowledgeAttachment
+
+MODELS = {
+    'knowledge': KnowledgeAttachment,
+    'attachment': Attachment,
+}
+
+
+class Command(BaseCommand):
+    help = 'Extract and index the text of uploaded attachments (docx/xlsx/pptx/pdf/txt)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=['all'] + sorted(MODELS), default='all',
+                            help='Which attachments to process')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Rows fetched per database round trip')
+        parser.add_argument('--limit', type=int, default=0, help='Stop after this many extractions (0 = unlimited)')
+        parser.add_argument('--force', action='store_true', help='Re-extract files that were already processed')
+
+    def _queryset(self, model, force):
+        ext_q = Q()
+        for ext in sorted(set(EXTRACTORS) | LEGACY_OFFICE_EXTS):
+            ext_q |= Q(file__iendswith=ext)
+        qs = model.objects.filter(ext_q)
+        if not force:
+            done = ExtractedText.objects.filter(extractor_version=EXTRACTOR_VERSION).values('content_sha256')
+            qs = qs.exclude(content_sha256__in=done)
+        return qs.order_by('pk').only('id', 'file', 'content_sha256')
+
+    def handle(self, *args, **options):
+        chunk_size = options.get('chunk_size') or 200
+        limit = options.get('limit') or 0
+        force = options.get('force')
+        names = sorted(MODELS) if options['model'] == 'all' else [options['model']]
+        started = time.time()
+        extracted = skipped = failed = 0
+        seen = set()
+        for name in names:
+            for att in self._queryset(MODELS[name], force).iterator(chunk_size=chunk_size):
+                if limit and extracted >= limit:
+                    break
+                if att.content_sha256 and att.content_sha256 in seen:
+                    skipped += 1
+                    continue
+                row = extract_attachment_text(att, force=force)
+                seen.add(att.content_sha256)
+                if row is None:
+                    skipped += 1
+                elif row.error:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING('[%s %d] %s' % (name, att.pk, row.error)))
+                else:
+                    extracted += 1
+                    if extracted % 100 == 0:
+                        self.stdout.write('Extracted %d file(s)...' % extracted)
+        self.stdout.write(self.style.SUCCESS(
+            'Extracted %d, failed %d, skipped %d in %.1fs' % (extracted, failed, skipped, time.time() - started)
+        ))
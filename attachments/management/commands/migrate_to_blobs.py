@@ -0,0 +1,121 @@
+"""migrate_to_blobs
+
+Management command to move attachment files saved under the old dated paths
+(``attachments/%Y/%m/%d/...``, ``knowledge/%Y/%m/%d/...``) into the
+content-addressed store. Rows are repointed at ``blobs/<aa>/<bb>/<sha256><ext>``
+and counted in ``StoredBlob``; identical files collapse into one blob. The
+original file name is kept on the row. An old file is removed once no row
+refers to it any more, and a ``.preview.pdf`` left next to it is adopted into
+the preview cache. Safe to interrupt and re-run: finished rows are skipped.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.utils import sha256_of_file
+from attachments.models import Attachment
+from attachments.storage import BLOB_PREFIX, acquire_file, blob_name, blob_storage, lock_blob
+from knowledge.models import KnowledgeAttachment
+from knowledge.preview_pdf import lookup_preview, store_preview
+from knowledge.previews import legacy_preview_path
+
+MODELS = {
+    'knowledge': (KnowledgeAttachment, 'filename'),
+    'attachment': (Attachment, 'original_filename'),
+}
+
+
+def _still_referenced(name):
+    return any(model.objects.filter(file=name).exists() for model, _field in MODELS.values())
+
+
+def _place(src, dest):
+    """Make ``dest`` a copy of ``src`` without doubling disk use where the filesystem allows."""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = dest + '.tmp'
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dest)
+
+
+class Command(BaseCommand):
+    help = 'Move attachment files into the content-addressed (deduplicated) store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=['all'] + sorted(MODELS), default='all',
+                            help='Which attachments to process')
+        parser.add_argument('--chunk-size', type=int, default=200, help='Rows fetched per database round trip')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would move without changing anything')
+
+    def handle(self, *args, **options):
+        chunk_size = options.get('chunk_size') or 200
+        dry_run = options.get('dry_run')
+        names = sorted(MODELS) if options['model'] == 'all' else [options['model']]
+        started = time.time()
+        moved = missing = 0
+        saved_bytes = 0
+        seen = set()
+        for name in names:
+            model, name_field = MODELS[name]
+            qs = (
+                model.objects.exclude(file='').exclude(file__startswith=BLOB_PREFIX + '/')
+                .order_by('pk').only('id', 'file', 'content_sha256', name_field)
+            )
+            for att in qs.iterator(chunk_size=chunk_size):
+                old = att.file.name
+                src = blob_storage.path(old)
+                if not os.path.exists(src):
+                    missing += 1
+                    self.stdout.write(self.style.WARNING('[%s %d] missing file %s' % (name, att.pk, old)))
+                    continue
+                content_sha256 = att.content_sha256 or sha256_of_file(src)
+                new = blob_name(content_sha256, old)
+                dest = blob_storage.path(new)
+                if new in seen or os.path.exists(dest):
+                    saved_bytes += os.path.getsize(src)
+                seen.add(new)
+                moved += 1
+                if dry_run:
+                    continue
+                with transaction.atomic():
+                    # placed and referenced under the blob's lock, like uploads
+                    lock_blob(new)
+                    if not os.path.exists(dest):
+                        _place(src, dest)
+                    model.objects.filter(pk=att.pk).update(
+                        file=new,
+                        content_sha256=content_sha256,
+                        **{name_field: getattr(att, name_field) or os.path.basename(old)[:255]}
+                    )
+                    acquire_file(new)
+                self._retire(old, src, content_sha256)
+                if moved % 100 == 0:
+                    self.stdout.write('Moved %d file(s)...' % moved)
+        self.stdout.write(self.style.SUCCESS(
+            '%s %d file(s), %.1f MB deduplicated, %d missing in %.1fs' % (
+                'Would move' if dry_run else 'Moved', moved, saved_bytes / 1024 ** 2, missing, time.time() - started,
+            )
+        ))
+
+    def _retire(self, old, src, content_sha256):
+        """Remove the old copy (and adopt its sidecar preview) once no row points at it."""
+        if _still_referenced(old):
+            return
+        sidecar = legacy_preview_path(src)
+        if os.path.exists(sidecar):
+            if lookup_preview(content_sha256):
+                os.remove(sidecar)
+            else:
+                # stored with its page counts, or the cache would not serve it
+                workdir = tempfile.mkdtemp(prefix='preview-adopt-')
+                try:
+                    store_preview(content_sha256, sidecar, workdir)
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+        os.remove(src)
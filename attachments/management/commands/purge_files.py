@@ -0,0 +1,32 @@
+"""purge_files
+
+Management command to remove files queued for deletion when their attachments,
+knowledge items or projects were deleted, together with their preview
+siblings. Run it periodically (e.g. from cron). ``--orphans`` first queues
+upload files that no row refers to, such as files left behind by deletions
+made before the queue existed.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from attachments.purge import purge_files, queue_orphans
+
+
+class Command(BaseCommand):
+    help = 'Remove files of deleted attachments in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Queued files handled per batch')
+        parser.add_argument('--orphans', action='store_true',
+                            help='Also queue upload files that no attachment refers to')
+
+    def handle(self, *args, **options):
+        batch_size = options.get('batch_size') or 500
+        started = time.time()
+        if options.get('orphans'):
+            self.stdout.write('Queued %d orphaned file(s)' % queue_orphans(batch_size))
+        handled, freed = purge_files(batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            'Purged %d queued file(s), %.1f MB freed in %.1fs' % (handled, freed / 1024 ** 2, time.time() - started)
+        ))
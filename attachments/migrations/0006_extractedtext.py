@@ -0,0 +1,50 @@
+# Generated by Django 3.2.20 on 2026-10-17 22:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attachments', '0005_attachment_content_sha256'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractedText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_sha256', models.CharField(max_length=64, unique=True)),
+                ('extractor_version', models.CharField(max_length=32)),
+                ('data', models.BinaryField(blank=True)),
+                ('char_count', models.PositiveIntegerField(default=0)),
+                ('truncated', models.BooleanField(default=False)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'attachment_texts',
+            },
+        ),
+        migrations.CreateModel(
+            name='ExtractedTextToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32)),
+                ('weight', models.PositiveIntegerField(default=1)),
+                ('text', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tokens', to='attachments.extractedtext')),
+            ],
+            options={
+                'db_table': 'attachment_text_tokens',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='extractedtexttoken',
+            index=models.Index(fields=['token', 'text'], name='attachment_token_text_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='extractedtexttoken',
+            unique_together={('text', 'token')},
+        ),
+    ]
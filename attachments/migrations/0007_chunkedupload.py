@@ -0,0 +1,33 @@
+# Generated by Django 3.2.20 on 2026-10-17 22:09
+
+import attachments.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_userprofile'),
+        ('attachments', '0006_extractedtext'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChunkedUpload',
+            fields=[
+                ('id', models.CharField(default=attachments.models._new_upload_id, editable=False, max_length=32, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('received', models.BigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('uploading', '上传中'), ('complete', '已完成')], default='uploading', max_length=20)),
+                ('content_sha256', models.CharField(blank=True, max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.appuser')),
+            ],
+            options={
+                'db_table': 'chunked_uploads',
+            },
+        ),
+    ]
@@ -1,10 +1,14 @@
+import uuid
+import zlib
 from pathlib import Path
 
 from django.core.files.storage import FileSystemStorage
-from django.db import models
+from django.db import models, transaction
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 
+from .storage import blob_storage
+
 
 class UnicodeFileSystemStorage(FileSystemStorage):
     """Preserve original filename (including 中文字符) when saving attachments."""
@@ -14,26 +18,37 @@ class UnicodeFileSystemStorage(FileSystemStorage):
         return Path(name).name
 
 
+# 旧上传路径仍由此存储类解析（见迁移 0004）；新文件按内容哈希存放，见 attachments.storage。
 attachment_storage = UnicodeFileSystemStorage()
 
 class Attachment(models.Model):
     name = models.CharField(max_length=128, default='')
-    file = models.FileField(upload_to='attachments/%Y/%m/%d/', storage=attachment_storage)
+    file = models.FileField(upload_to='attachments/%Y/%m/%d/', storage=blob_storage, max_length=255)
+    # Name the file was uploaded under; the stored file is named by its content hash.
+    original_filename = models.CharField(max_length=255, blank=True)
     uploaded_by = models.ForeignKey('app.AppUser', on_delete=models.CASCADE)
     project = models.ForeignKey('projects.Project', on_delete=models.CASCADE, null=True, blank=True)
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
     created_at = models.DateTimeField(auto_now_add=True)
+    # SHA-256 of the file content; keys cached thumbnails. Filled lazily.
+    content_sha256 = models.CharField(max_length=64, blank=True, db_index=True)
 
     def __str__(self):
         return self.name or self.file.name
 
+    def save(self, *args, **kwargs):
+        # the stored blob stays locked against purging until its reference is
+        # counted; project counters are updated in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
     @property
     def file_basename(self) -> str:
         if not self.file:
             return ''
-        return Path(self.file.name).name
+        return self.original_filename or Path(self.file.name).name
 
     @property
     def file_extension(self) -> str:
@@ -42,4 +57,105 @@ class Attachment(models.Model):
         return Path(self.file.name).suffix.lstrip('.')
 
     class Meta:
-        db_table = 'attachments'
\ No newline at end of file
+        db_table = 'attachments'
+
+
+class StoredBlob(models.Model):
+    """Reference count of a file in the content-addressed store (see attachments.storage)."""
+    name = models.CharField(max_length=255, unique=True)
+    content_sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'stored_blobs'
+
+    def __str__(self):
+        return f"{self.name} (x{self.ref_count})"
+
+class FilePurge(models.Model):
+    """A stored file no row refers to any more, waiting for ``manage.py purge_files``."""
+    name = models.CharField(max_length=255)
+    content_sha256 = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'file_purge_queue'
+
+    def __str__(self):
+        return self.name
+
+
+class ExtractedText(models.Model):
+    """Plain text pulled out of an uploaded file, shared by every upload with the same content.
+
+    Keyed by the file's SHA-256, so a file is extracted once no matter how
+    many attachments point at it. The text is stored zlib-compressed.
+    """
+    content_sha256 = models.CharField(max_length=64, unique=True)
+    extractor_version = models.CharField(max_length=32)
+    data = models.BinaryField(blank=True)
+    char_count = models.PositiveIntegerField(default=0)
+    truncated = models.BooleanField(default=False)
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'attachment_texts'
+
+    def __str__(self):
+        return f"{self.content_sha256[:12]} ({self.char_count} chars)"
+
+    @property
+    def text(self) -> str:
+        if not self.data:
+            return ''
+        return zlib.decompress(bytes(self.data)).decode('utf-8')
+
+
+class ExtractedTextToken(models.Model):
+    """Search index row for extracted text, mirroring knowledge.KnowledgeSearchToken."""
+    text = models.ForeignKey(ExtractedText, related_name='tokens', on_delete=models.CASCADE)
+    token = models.CharField(max_length=32)
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        db_table = 'attachment_text_tokens'
+        unique_together = [('text', 'token')]
+        indexes = [
+            models.Index(fields=['token', 'text'], name='attachment_token_text_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.token} -> {self.text_id}"
+
+
+def _new_upload_id():
+    return uuid.uuid4().hex
+
+
+class ChunkedUpload(models.Model):
+    """A file being uploaded in chunks (see attachments.uploads); removed once claimed by an attachment."""
+    STATUS_UPLOADING = 'uploading'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (STATUS_UPLOADING, '上传中'),
+        (STATUS_COMPLETE, '已完成'),
+    ]
+
+    id = models.CharField(primary_key=True, max_length=32, default=_new_upload_id, editable=False)
+    user = models.ForeignKey('app.AppUser', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_UPLOADING)
+    content_sha256 = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'chunked_uploads'
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
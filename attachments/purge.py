@@ -0,0 +1,175 @@
+"""Batched removal of files queued by deletions (``FilePurge`` rows).
+
+Deleting an attachment, a knowledge item or a project only records the files
+that lost their last reference; ``manage.py purge_files`` removes them later,
+a batch at a time, together with their derived files: the legacy
+``.preview.pdf`` written next to an upload, and the cached preview, thumbnail
+and extracted text of content no attachment has any more.
+
+A queued blob is skipped if it was referenced again (``StoredBlob`` row) or
+re-uploaded (storage touches its mtime) after it was queued. Each file is
+re-checked and removed with its queue row locked, the lock an upload of the
+same content takes before it reuses the file.
+"""
+import logging
+import os
+import time
+
+from django.db import transaction
+
+from knowledge import preview_cache
+from knowledge.models import KnowledgeAttachment
+from knowledge.html_preview import HTML_SUFFIX, NO_HTML_SUFFIX
+from knowledge.preview_pdf import META_SUFFIX
+from knowledge.previews import LEGACY_PREVIEW_SUFFIX, legacy_preview_path
+from knowledge.thumbnails import THUMB_SUFFIX
+
+from .models import Attachment, ExtractedText, FilePurge, StoredBlob
+from .storage import BLOB_PREFIX, blob_storage, sha256_from_name
+
+logger = logging.getLogger(__name__)
+
+FILE_MODELS = (Attachment, KnowledgeAttachment)
+# Directories (under MEDIA_ROOT) holding uploaded files, scanned for orphans.
+UPLOAD_DIRS = (BLOB_PREFIX, 'attachments', 'knowledge')
+# Unreferenced files younger than this may belong to an upload still being saved.
+ORPHAN_MIN_AGE = 3600
+
+
+def referenced_names(names):
+    """The subset of upload file ``names`` some row (or blob reference count) still refers to."""
+    live = set(StoredBlob.objects.filter(name__in=names).values_list('name', flat=True))
+    for model in FILE_MODELS:
+        live.update(model.objects.filter(file__in=names).values_list('file', flat=True))
+    return live
+
+
+def _used_hashes(hashes):
+    used = set()
+    for model in FILE_MODELS:
+        used.update(model.objects.filter(content_sha256__in=hashes).values_list('content_sha256', flat=True))
+    return used
+
+
+def _remove(path):
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except FileNotFoundError:
+        return 0
+    except OSError:
+        logger.warning('Could not remove %s', path, exc_info=True)
+        return 0
+    return size
+
+
+def _purge_file(row):
+    """Remove the file of queued ``row`` unless it is wanted again; returns bytes freed or None.
+
+    Runs with the queue row locked: an upload publishing the same blob
+    (``attachments.storage.lock_blob``) waits for the removal and writes the
+    file again, or has already cancelled the row.
+    """
+    with transaction.atomic():
+        if FilePurge.objects.select_for_update().filter(pk=row.pk).first() is None:
+            return None  # cancelled by an upload of the same content
+        if referenced_names([row.name]):
+            return None
+        path = blob_storage.path(row.name)
+        try:
+            if os.path.getmtime(path) > row.created_at.timestamp():
+                return None  # same content uploaded again since it was queued
+        except OSError:
+            pass
+        freed = _remove(path) + _remove(legacy_preview_path(path))
+        FilePurge.objects.filter(pk=row.pk).delete()
+    return freed
+
+
+def purge_batch(batch_size=500):
+    """Process up to ``batch_size`` queued files; returns ``(rows handled, bytes freed)``."""
+    rows = list(FilePurge.objects.order_by('id')[:batch_size])
+    if not rows:
+        return 0, 0
+    names = {row.name for row in rows}
+    live = referenced_names(names)
+    freed = 0
+    dead_hashes = set()
+    for row in rows:
+        if row.name in live:
+            continue
+        size = _purge_file(row)
+        if size is None:
+            continue
+        freed += size
+        if row.content_sha256:
+            dead_hashes.add(row.content_sha256)
+    dead_hashes -= _used_hashes(dead_hashes)
+    for content_sha256 in dead_hashes:
+        freed += _remove(preview_cache.entry_path(content_sha256))
+        freed += _remove(preview_cache.entry_path(content_sha256, THUMB_SUFFIX))
+        freed += _remove(preview_cache.entry_path(content_sha256, META_SUFFIX))
+        freed += _remove(preview_cache.entry_path(content_sha256, HTML_SUFFIX))
+        freed += _remove(preview_cache.entry_path(content_sha256, NO_HTML_SUFFIX))
+    with transaction.atomic():
+        if dead_hashes:
+            ExtractedText.objects.filter(content_sha256__in=dead_hashes).delete()
+        FilePurge.objects.filter(id__in=[row.id for row in rows]).delete()
+    return len(rows), freed
+
+
+def purge_files(batch_size=500):
+    """Drain the queue; returns ``(rows handled, bytes freed)``."""
+    handled = freed = 0
+    while True:
+        count, size = purge_batch(batch_size)
+        if not count:
+            return handled, freed
+        handled += count
+        freed += size
+
+
+def _iter_upload_files(now):
+    for top in UPLOAD_DIRS:
+        root = blob_storage.path(top)
+        for dirpath, dirnames, filenames in os.walk(root):
+            if top == BLOB_PREFIX and dirpath == root and 'tmp' in dirnames:
+                dirnames.remove('tmp')  # uploads being written
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    if now - os.path.getmtime(path) < ORPHAN_MIN_AGE:
+                        continue
+                except OSError:
+                    continue
+                if filename.endswith(LEGACY_PREVIEW_SUFFIX):
+                    # removed with its upload; only queued itself when the upload is gone
+                    if os.path.exists(path[:-len(LEGACY_PREVIEW_SUFFIX)]):
+                        continue
+                yield os.path.relpath(path, blob_storage.path('')).replace(os.sep, '/')
+
+
+def queue_orphans(batch_size=500):
+    """Queue upload files no row refers to, e.g. left behind by deletions before the queue existed."""
+    queued = 0
+    batch = []
+    for name in _iter_upload_files(time.time()):
+        batch.append(name)
+        if len(batch) >= batch_size:
+            queued += queue_unreferenced(batch)
+            batch = []
+    if batch:
+        queued += queue_unreferenced(batch)
+    return queued
+
+
+def queue_unreferenced(names):
+    """Queue the ``names`` no row refers to (and not queued yet); returns how many were queued."""
+    live = referenced_names(names)
+    queued = set(FilePurge.objects.filter(name__in=names).values_list('name', flat=True))
+    rows = [
+        FilePurge(name=name, content_sha256=sha256_from_name(name) or '')
+        for name in names if name not in live and name not in queued
+    ]
+    FilePurge.objects.bulk_create(rows)
+    return len(rows)
@@ -0,0 +1,43 @@
+"""Search over project attachments by name and by the text extracted from them.
+
+Extracted text is indexed per file content (``ExtractedTextToken``, see
+attachments.extraction) with the knowledge search tokenizer, so a query is an
+indexed token lookup joined to ``Attachment.content_sha256``. Names are
+short and matched directly.
+"""
+from django.db.models import Count, Q, Sum
+
+from knowledge.search import SEARCH_RESULT_LIMIT, query_tokens
+
+from .models import ExtractedTextToken
+
+
+def matching_text_hashes(hashes, query, limit=SEARCH_RESULT_LIMIT):
+    """Content hashes among ``hashes`` (a values queryset) whose text contains every query token, best first."""
+    terms = query_tokens(query)
+    if not terms:
+        return []
+    rows = (
+        ExtractedTextToken.objects
+        .filter(token__in=terms, text__content_sha256__in=hashes)
+        .values('text__content_sha256')
+        .annotate(score=Sum('weight'), hits=Count('token'))
+        .filter(hits__gte=len(terms))
+        .order_by('-score')[:limit]
+    )
+    return [row['text__content_sha256'] for row in rows]
+
+
+def search_attachments(queryset, query, limit=SEARCH_RESULT_LIMIT):
+    """Restrict ``queryset`` to attachments whose name or file text matches ``query``.
+
+    Returns ``(queryset, capped)``; ``capped`` is True when more than
+    ``limit`` files matched by text and only the best ``limit`` are kept.
+    The queryset keeps its ordering.
+    """
+    hashes = matching_text_hashes(queryset.exclude(content_sha256='').values('content_sha256'), query, limit + 1)
+    capped = len(hashes) > limit
+    matches = Q(name__icontains=query) | Q(original_filename__icontains=query)
+    if hashes:
+        matches |= Q(content_sha256__in=hashes[:limit])
+    return queryset.filter(matches), capped
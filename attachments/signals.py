@@ -0,0 +1,59 @@
+"""Reference counting for stored files; the receivers are shared with knowledge.KnowledgeAttachment.
+
+Deleting a row never touches the disk: unreferenced files are queued and
+removed later by ``manage.py purge_files`` (attachments.purge).
+"""
+import os
+
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .models import Attachment
+from .storage import acquire_file, release_file, sha256_from_name
+
+
+# Field holding the name a file was uploaded under, per model.
+ORIGINAL_NAME_FIELDS = ('original_filename', 'filename')
+
+
+def file_pre_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    name = instance.file.name if instance.file else ''
+    if instance.file and not instance.file._committed:
+        # fresh upload: keep its name before storage renames it to the content hash
+        for field in ORIGINAL_NAME_FIELDS:
+            if hasattr(instance, field) and not getattr(instance, field):
+                setattr(instance, field, os.path.basename(name)[:255])
+                break
+    instance._replaced_file = None
+    if instance.pk:
+        previous = sender.objects.filter(pk=instance.pk).values_list('file', flat=True).first()
+        if previous != name:
+            instance._replaced_file = previous
+
+
+def file_post_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    replaced = getattr(instance, '_replaced_file', None)
+    instance._replaced_file = None
+    if replaced:
+        release_file(replaced)
+    if instance.file and (created or replaced is not None):
+        acquire_file(instance.file.name, instance.file.storage)
+        content_sha256 = sha256_from_name(instance.file.name)
+        if content_sha256 and instance.content_sha256 != content_sha256:
+            # the blob name is the content hash; no need to read the file again
+            sender.objects.filter(pk=instance.pk).update(content_sha256=content_sha256)
+            instance.content_sha256 = content_sha256
+
+
+def file_post_delete(sender, instance, **kwargs):
+    # also runs for rows removed by cascades (deleted projects and knowledge items)
+    if instance.file:
+        release_file(instance.file.name, instance.content_sha256)
+
+
+pre_save.connect(file_pre_save, sender=Attachment, dispatch_uid='attachment_file_pre_save')
+post_save.connect(file_post_save, sender=Attachment, dispatch_uid='attachment_file_post_save')
+post_delete.connect(file_post_delete, sender=Attachment, dispatch_uid='attachment_file_post_delete')
@@ -0,0 +1,164 @@
+"""Content-addressable storage for uploaded files.
+
+Every file is stored once under ``blobs/<aa>/<bb>/<sha256><ext>``, however many
+attachments (project or knowledge) point at it. The original file name is
+kept on the attachment row (``Attachment.original_filename`` /
+``KnowledgeAttachment.filename``), not in the path, and is what downloads use.
+
+``StoredBlob`` counts the rows referencing each blob: model signals call
+``acquire_file`` when an attachment is created and ``release_file`` when one is
+deleted (including cascades). When the last reference goes, the file is queued
+for deletion (``FilePurge``, see attachments.purge) in the same transaction.
+Files saved before this storage existed keep their old paths, are not counted,
+and are queued directly on delete; ``manage.py migrate_to_blobs`` moves them
+into the blob store.
+
+Publishing a blob and removing it are serialised by row locks (``lock_blob``
+and ``attachments.purge``), so a purge never deletes a file that an upload
+of the same content has just reused.
+"""
+import hashlib
+import os
+import re
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+BLOB_PREFIX = 'blobs'
+HASH_CHUNK_SIZE = 1024 * 1024
+_BLOB_NAME_RE = re.compile(r'^%s/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[0-9a-z]{1,10})?$' % BLOB_PREFIX)
+_EXT_RE = re.compile(r'^\.[0-9a-z]{1,10}$')
+
+
+def blob_name(content_sha256, original_name=''):
+    """Storage name of the blob holding ``content_sha256``; keeps the (lower-cased) extension."""
+    ext = os.path.splitext(original_name or '')[1].lower()
+    if not _EXT_RE.match(ext):
+        ext = ''
+    return '%s/%s/%s/%s%s' % (BLOB_PREFIX, content_sha256[:2], content_sha256[2:4], content_sha256, ext)
+
+
+def sha256_from_name(name):
+    """Content hash encoded in a blob name, or None for files outside the blob store."""
+    match = _BLOB_NAME_RE.match(name or '')
+    return match.group(1) if match else None
+
+
+def is_blob_name(name):
+    return sha256_from_name(name) is not None
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """``FileSystemStorage`` that names files by content hash, so identical uploads share one file."""
+
+    def get_available_name(self, name, max_length=None):
+        # the final name is decided in _save; identical content is meant to collide
+        return name
+
+    def _publish(self, tmp_path, name):
+        full = self.path(name)
+        with transaction.atomic():
+            # checked under the blob's lock: a purge of this name has either
+            # finished (the file is gone and is written again) or is cancelled
+            lock_blob(name)
+            if os.path.exists(full):
+                os.remove(tmp_path)
+                # a fresh mtime tells the purger the blob is wanted again (attachments.purge)
+                os.utime(full)
+            else:
+                os.makedirs(os.path.dirname(full), exist_ok=True)
+                os.replace(tmp_path, full)
+                if self.file_permissions_mode is not None:
+                    os.chmod(full, self.file_permissions_mode)
+        return name
+
+    def _save(self, name, content):
+        tmp_dir = self.path(os.path.join(BLOB_PREFIX, 'tmp'))
+        os.makedirs(tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(tmp_dir, uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        try:
+            if hasattr(content, 'seek'):
+                content.seek(0)
+            with open(tmp_path, 'wb') as fh:
+                for chunk in content.chunks(HASH_CHUNK_SIZE):
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode('utf-8')
+                    digest.update(chunk)
+                    fh.write(chunk)
+            return self._publish(tmp_path, blob_name(digest.hexdigest(), name))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def adopt(self, path, original_name, content_sha256):
+        """Move an already hashed file at ``path`` (same filesystem) into the store; returns its name."""
+        return self._publish(path, blob_name(content_sha256, original_name))
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def lock_blob(name):
+    """Lock blob ``name`` against purging until the current transaction ends.
+
+    Queued purges of ``name`` are cancelled (their rows are deleted, which
+    waits for a purge holding one of them), and the ``StoredBlob`` row, if
+    any, is locked so its last reference cannot be released meanwhile.
+    Publishing a file and counting the reference to it (``acquire_file``)
+    must happen in one transaction for the lock to cover both; model saves
+    and ``claim_upload`` callers do so.
+    """
+    from .models import FilePurge, StoredBlob
+
+    FilePurge.objects.filter(name=name).delete()
+    StoredBlob.objects.select_for_update().filter(name=name).first()
+
+
+def acquire_file(name, storage=None):
+    """Count one more reference to blob ``name`` (no-op for files outside the blob store)."""
+    from .models import StoredBlob
+
+    content_sha256 = sha256_from_name(name)
+    if not content_sha256:
+        return
+    storage = storage or blob_storage
+    with transaction.atomic():
+        blob, created = StoredBlob.objects.select_for_update().get_or_create(
+            name=name,
+            defaults={'content_sha256': content_sha256, 'size': _size(storage, name), 'ref_count': 1},
+        )
+        if not created:
+            StoredBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+
+
+def release_file(name, content_sha256=''):
+    """Drop one reference to ``name``; once nothing refers to it the file is queued for purging.
+
+    Files outside the blob store have a single owner and are queued directly.
+    The queue row is written in the caller's transaction, so a rolled back
+    delete leaves the file alone.
+    """
+    from .models import FilePurge, StoredBlob
+
+    if not name:
+        return
+    blob_sha256 = sha256_from_name(name)
+    if blob_sha256:
+        with transaction.atomic():
+            StoredBlob.objects.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+            deleted, _rows = StoredBlob.objects.filter(name=name, ref_count__lte=0).delete()
+        if not deleted:
+            return
+    FilePurge.objects.create(name=name, content_sha256=blob_sha256 or content_sha256 or '')
+
+
+def _size(storage, name):
+    try:
+        return storage.size(name)
+    except OSError:
+        return 0
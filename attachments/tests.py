@@ -0,0 +1,16 @@
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase
+
+from . import views
+
+
+class AttachmentExportTests(SimpleTestCase):
+    def test_export_fetches_export_sized_chunks(self):
+        request = RequestFactory().get('/attachments/export/')
+        request.session = {'user_id': 1}
+        with self.settings(EXPORT_CHUNK_SIZE=123, CHUNKED_UPLOAD_CHUNK_BYTES=8 * 1024 ** 2), \
+                mock.patch.object(views, 'keyset_iterate', return_value=iter(())) as iterate:
+            response = views.attachment_export(request)
+            b''.join(response.streaming_content)
+        self.assertEqual(iterate.call_args[0][2], 123)
@@ -0,0 +1,198 @@
+"""Chunked, resumable uploads for large attachments.
+
+A client opens an upload (file name and size), then sends the file as ordered
+chunks, each tagged with its byte offset. Chunks are streamed straight onto a
+``.part`` file under ``CHUNKED_UPLOAD_DIR``; after an interruption the client
+asks for the received byte count and continues from there. Once complete, the
+upload is claimed by a form submission: the ``.part`` file is renamed into the
+attachment's storage location (same filesystem, so no second copy is made), or
+dropped if the content-addressed store already holds the same bytes.
+
+SHA-256 is computed as chunks arrive. The running hash object lives in the
+worker process; if a chunk lands on another worker the hash is instead
+computed with a single read of the assembled file when the upload completes.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from app.utils import sha256_of_file
+
+from .models import ChunkedUpload
+
+STREAM_CHUNK_SIZE = 64 * 1024
+# Running hashes kept per process (one per upload in progress).
+MAX_HASHERS = 64
+
+
+class UploadError(Exception):
+    """Rejected upload request; ``status`` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+
+
+def upload_dir():
+    return str(getattr(settings, 'CHUNKED_UPLOAD_DIR', os.path.join(str(settings.MEDIA_ROOT), '.uploads')))
+
+
+def max_upload_bytes():
+    return getattr(settings, 'CHUNKED_UPLOAD_MAX_BYTES', 2 * 1024 ** 3)
+
+
+def upload_chunk_bytes():
+    return getattr(settings, 'CHUNKED_UPLOAD_CHUNK_BYTES', 8 * 1024 ** 2)
+
+
+def part_path(upload):
+    return os.path.join(upload_dir(), upload.pk + '.part')
+
+
+def _take_hasher(upload_id, offset):
+    """Return the running hash of ``upload_id`` if it already covers exactly ``offset`` bytes."""
+    with _hashers_lock:
+        entry = _hashers.pop(upload_id, None)
+    if entry is None:
+        return hashlib.sha256() if offset == 0 else None
+    hashed, hasher = entry
+    return hasher if hashed == offset else None
+
+
+def _keep_hasher(upload_id, offset, hasher):
+    with _hashers_lock:
+        _hashers[upload_id] = (offset, hasher)
+        while len(_hashers) > MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def start_upload(user_id, filename, size):
+    filename = os.path.basename((filename or '').replace('\\', '/')).strip()
+    if not filename:
+        raise UploadError('缺少文件名')
+    if size < 0 or size > max_upload_bytes():
+        raise UploadError('文件大小超出限制', status=413)
+    upload = ChunkedUpload.objects.create(user_id=user_id, filename=filename[:255], size=size)
+    os.makedirs(upload_dir(), exist_ok=True)
+    open(part_path(upload), 'wb').close()
+    if size == 0:
+        _complete(upload, hashlib.sha256())
+    return upload
+
+
+def get_upload(upload_id, user_id):
+    upload = ChunkedUpload.objects.filter(pk=upload_id, user_id=user_id).first()
+    if upload is None:
+        raise UploadError('上传不存在或已过期', status=404)
+    return upload
+
+
+def write_chunk(upload, offset, stream, length):
+    """Append ``length`` bytes read from ``stream`` at ``offset``; returns the updated upload.
+
+    Chunks must arrive in order: a chunk for any offset other than the
+    number of bytes received so far is rejected with 409 and the client
+    resumes from ``upload.received``. The upload row stays locked while the
+    chunk is written, so a concurrent request for the same upload waits and
+    then sees the new offset instead of writing into the same part file.
+    """
+    if length <= 0 or length > upload_chunk_bytes() or offset + length > upload.size:
+        raise UploadError('分片大小无效', status=413)
+    with transaction.atomic():
+        upload = ChunkedUpload.objects.select_for_update().filter(pk=upload.pk).first()
+        if upload is None:
+            raise UploadError('上传不存在或已过期', status=404)
+        if upload.status != ChunkedUpload.STATUS_UPLOADING:
+            raise UploadError('上传已完成', status=409)
+        if offset != upload.received:
+            raise UploadError('偏移量不匹配', status=409)
+        hasher = _take_hasher(upload.pk, offset)
+        written = 0
+        with open(part_path(upload), 'r+b') as fh:
+            fh.seek(offset)
+            while written < length:
+                data = stream.read(min(STREAM_CHUNK_SIZE, length - written))
+                if not data:
+                    break
+                fh.write(data)
+                if hasher is not None:
+                    hasher.update(data)
+                written += len(data)
+            # a failed or short chunk leaves garbage past ``received``; drop it
+            fh.truncate(offset + written)
+        if written != length:
+            raise UploadError('分片数据不完整', status=400)
+        upload.received = offset + length
+        ChunkedUpload.objects.filter(pk=upload.pk).update(received=upload.received, updated_at=timezone.now())
+        if upload.received == upload.size:
+            _complete(upload, hasher)
+    if upload.status == ChunkedUpload.STATUS_UPLOADING and hasher is not None:
+        _keep_hasher(upload.pk, upload.received, hasher)
+    return upload
+
+
+def _complete(upload, hasher):
+    digest = hasher.hexdigest() if hasher is not None else sha256_of_file(part_path(upload))
+    upload.content_sha256 = digest
+    upload.status = ChunkedUpload.STATUS_COMPLETE
+    ChunkedUpload.objects.filter(pk=upload.pk).update(content_sha256=digest, status=upload.status)
+
+
+def claim_upload(upload_id, user_id, instance, field_name='file'):
+    """Move a completed upload into ``instance.<field_name>`` and set its content hash.
+
+    The caller saves ``instance``, in the same transaction as this call so
+    the blob stays locked against purging until the reference is counted
+    (see ``attachments.storage.lock_blob``). Raises ``UploadError`` if the
+    upload is unknown, belongs to someone else or is not complete.
+    """
+    with transaction.atomic():
+        upload = (
+            ChunkedUpload.objects.select_for_update()
+            .filter(pk=upload_id, user_id=user_id, status=ChunkedUpload.STATUS_COMPLETE)
+            .first()
+        )
+        if upload is None:
+            raise UploadError('上传不存在或未完成', status=404)
+        field = instance._meta.get_field(field_name)
+        storage = field.storage
+        if hasattr(storage, 'adopt'):
+            # content-addressed storage: the hash is known, so the part file becomes the blob
+            name = storage.adopt(part_path(upload), upload.filename, upload.content_sha256)
+        else:
+            name = storage.get_available_name(field.generate_filename(instance, upload.filename),
+                                              max_length=field.max_length)
+            dest = storage.path(name)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(part_path(upload), dest)
+        setattr(instance, field_name, name)
+        if hasattr(instance, 'content_sha256'):
+            instance.content_sha256 = upload.content_sha256
+        upload.delete()
+    return upload
+
+
+def expire_uploads(max_age=None):
+    """Delete uploads untouched for ``max_age`` (default ``CHUNKED_UPLOAD_EXPIRE_HOURS``) and their parts."""
+    if max_age is None:
+        max_age = timedelta(hours=getattr(settings, 'CHUNKED_UPLOAD_EXPIRE_HOURS', 24))
+    stale = ChunkedUpload.objects.filter(updated_at__lt=timezone.now() - max_age)
+    count = 0
+    for upload in stale.iterator():
+        try:
+            os.remove(part_path(upload))
+        except FileNotFoundError:
+            pass
+        upload.delete()
+        count += 1
+    return count
@@ -3,7 +3,13 @@ from . import views
 
 urlpatterns = [
     path('', views.attachment_list, name='attachment_list'),
+    path('export/', views.attachment_export, name='attachment_export'),
     path('project/<int:project_id>/', views.project_attachment_list, name='attachment_project_list'),
     path('project/<int:project_id>/upload/', views.project_attachment_upload, name='attachment_project_upload'),
     path('project/<int:project_id>/<int:pk>/delete/', views.project_attachment_delete, name='attachment_project_delete'),
+    path('<int:pk>/download/', views.attachment_download, name='attachment_download'),
+    path('<int:pk>/thumbnail/', views.attachment_thumbnail, name='attachment_thumbnail'),
+    path('signed/<str:token>/', views.signed_file, name='signed_file'),
+    path('uploads/', views.upload_start, name='upload_start'),
+    path('uploads/<str:upload_id>/', views.upload_chunk, name='upload_chunk'),
 ]
\ No newline at end of file
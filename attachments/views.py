@@ -1,10 +1,36 @@
+import os
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
+from django.core import signing
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.http import Http404, JsonResponse
+from django.views.decorators.clickjacking import xframe_options_exempt
+from django.views.decorators.http import require_http_methods, require_POST
 
-from .models import Attachment
+from .models import Attachment, StoredBlob
 from projects.models import Project
+from app.export import chunk_size, export_format, export_response
 from app.models import AppUser
+from app.pagination import keyset_iterate
+from app.fileserve import deliver_file, unsign_file_token
 from app.utils import build_base_context
+from knowledge.jobs import enqueue_thumbnail
+from knowledge.models import PreviewJob
+from knowledge.thumbnails import cached_thumbnail, is_document, pending_thumbnail_response
+from knowledge.search import SEARCH_RESULT_LIMIT
+from .extraction import extract_after_upload
+from .search import search_attachments
+from .uploads import UploadError, claim_upload, get_upload, start_upload, upload_chunk_bytes, write_chunk
+
+
+def _search(request, attachments):
+    """Apply the ``?q=`` filter (name or file content); returns ``(attachments, capped)``."""
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return attachments, False
+    return search_attachments(attachments, query)
 
 
 def attachment_list(request):
@@ -13,13 +39,51 @@ def attachment_list(request):
         return redirect('login')
     session_ctx = build_base_context(request)
     attachments = Attachment.objects.select_related('uploaded_by', 'project').order_by('-created_at')
+    attachments, search_capped = _search(request, attachments)
     context = {
         **session_ctx,
         'attachments': attachments,
+        'q': request.GET.get('q', '').strip(),
+        'search_capped': search_capped,
+        'search_limit': SEARCH_RESULT_LIMIT,
     }
     return render(request, 'attachments/list.html', context)
 
 
+ATTACHMENT_EXPORT_COLUMNS = (
+    ('id', 'ID'),
+    ('name', '附件名称'),
+    ('original_filename', '文件名'),
+    ('size', '大小（字节）'),
+    ('content_sha256', 'SHA-256'),
+    ('project__code', '项目编码'),
+    ('project__name', '项目名称'),
+    ('uploaded_by__username', '上传者'),
+    ('created_at', '上传时间'),
+    ('file', '存储路径'),
+)
+
+
+def attachment_export(request):
+    """Inventory of all attachments (or one project's, with ?project=) as a streamed CSV/XLSX file."""
+    user_id = request.session.get('user_id')
+    if not user_id:
+        return redirect('login')
+    attachments = Attachment.objects.annotate(
+        # one indexed lookup per row; sizes are recorded for content-addressed files
+        size=Subquery(StoredBlob.objects.filter(name=OuterRef('file')).values('size')[:1]),
+    )
+    if request.GET.get('project', '').isdigit():
+        attachments = attachments.filter(project_id=request.GET['project'])
+    attachments = attachments.values(*(field for field, _label in ATTACHMENT_EXPORT_COLUMNS))
+    rows = (
+        [row[field] for field, _label in ATTACHMENT_EXPORT_COLUMNS]
+        for row in keyset_iterate(attachments, ('-created_at', '-id'), chunk_size())
+    )
+    header = [label for _field, label in ATTACHMENT_EXPORT_COLUMNS]
+    return export_response(export_format(request), 'attachments', header, rows, sheet_name='附件')
+
+
 def project_attachment_list(request, project_id):
     user_id = request.session.get('user_id')
     if not user_id:
@@ -27,10 +91,14 @@ def project_attachment_list(request, project_id):
     project = get_object_or_404(Project, pk=project_id)
     session_ctx = build_base_context(request)
     attachments = Attachment.objects.filter(project=project).select_related('uploaded_by').order_by('-created_at')
+    attachments, search_capped = _search(request, attachments)
     context = {
         **session_ctx,
         'project': project,
         'attachments': attachments,
+        'q': request.GET.get('q', '').strip(),
+        'search_capped': search_capped,
+        'search_limit': SEARCH_RESULT_LIMIT,
     }
     return render(request, 'attachments/projects/list.html', context)
 
@@ -49,20 +117,34 @@ def project_attachment_upload(request, project_id):
         name = (request.POST.get('name') or '').strip()
         name_value = name
         file_obj = request.FILES.get('file')
+        upload_id = request.POST.get('upload_ids')
         if not name:
             messages.error(request, '请填写附件名称')
-        elif not file_obj:
+        elif not file_obj and not upload_id:
             messages.error(request, '请选择要上传的文件')
         else:
-            Attachment.objects.create(
+            attachment = Attachment(
                 name=name,
-                file=file_obj,
                 uploaded_by=AppUser.objects.get(pk=user_id),
                 project=project,
                 content_object=project,
             )
-            messages.success(request, '项目文件上传成功')
-            return redirect('attachment_project_list', project_id=project.id)
+            try:
+                # one transaction, so the blob stays locked until it is referenced
+                with transaction.atomic():
+                    if upload_id:
+                        # file already sent in chunks; move it into place
+                        upload = claim_upload(upload_id, user_id, attachment)
+                        attachment.original_filename = upload.filename
+                    else:
+                        attachment.file = file_obj
+                    attachment.save()
+            except UploadError as exc:
+                messages.error(request, str(exc))
+            else:
+                extract_after_upload(attachment)
+                messages.success(request, '项目文件上传成功')
+                return redirect('attachment_project_list', project_id=project.id)
     return render(request, 'attachments/projects/upload.html', {
         **session_ctx,
         'project': project,
@@ -81,12 +163,122 @@ def project_attachment_delete(request, project_id, pk):
         return redirect('attachment_project_list', project_id=project.id)
     attachment = get_object_or_404(Attachment, pk=pk, project=project)
     if request.method == 'POST':
-        storage = attachment.file.storage
-        file_path = attachment.file.name
+        # the stored file goes with its last reference (attachments.signals)
         attachment.delete()
-        if storage.exists(file_path):
-            storage.delete(file_path)
         messages.success(request, '附件已删除')
     else:
         messages.error(request, '非法请求')
-    return redirect('attachment_project_list', project_id=project.id)
\ No newline at end of file
+    return redirect('attachment_project_list', project_id=project.id)
+
+
+def _upload_json(upload):
+    return {
+        'id': upload.pk,
+        'filename': upload.filename,
+        'size': upload.size,
+        'received': upload.received,
+        'status': upload.status,
+        'chunk_size': upload_chunk_bytes(),
+    }
+
+
+@require_POST
+def upload_start(request):
+    """Open a chunked upload: POST ``filename`` and ``size``; answers with the upload id."""
+    user_id = request.session.get('user_id')
+    if not user_id:
+        return JsonResponse({'error': '请先登录'}, status=401)
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'error': '文件大小无效'}, status=400)
+    try:
+        upload = start_upload(user_id, request.POST.get('filename'), size)
+    except UploadError as exc:
+        return JsonResponse({'error': str(exc)}, status=exc.status)
+    return JsonResponse(_upload_json(upload), status=201)
+
+
+@require_http_methods(['GET', 'PUT'])
+def upload_chunk(request, upload_id):
+    """GET: bytes received so far (to resume). PUT ``?offset=N``: raw chunk body written at N."""
+    user_id = request.session.get('user_id')
+    if not user_id:
+        return JsonResponse({'error': '请先登录'}, status=401)
+    try:
+        upload = get_upload(upload_id, user_id)
+        if request.method == 'PUT':
+            try:
+                offset = int(request.GET.get('offset', ''))
+                length = int(request.META.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                raise UploadError('偏移量无效')
+            # stream the body; request.body would buffer the chunk in memory
+            upload = write_chunk(upload, offset, request, length)
+    except UploadError as exc:
+        data = {'error': str(exc)}
+        if exc.status == 409:
+            # tell the client where to resume
+            data.update(_upload_json(get_upload(upload_id, user_id)))
+        return JsonResponse(data, status=exc.status)
+    return JsonResponse(_upload_json(upload))
+
+
+def _attachment_file_response(request, attachment, download=True):
+    try:
+        fpath = attachment.file.path
+    except Exception:
+        raise Http404('File not found')
+    if not os.path.exists(fpath):
+        raise Http404('File not found')
+    return deliver_file(request, fpath, filename=attachment.file_basename, as_attachment=download)
+
+
+def attachment_download(request, pk):
+    user_id = request.session.get('user_id')
+    if not user_id:
+        return redirect('login')
+    attachment = get_object_or_404(Attachment, pk=pk)
+    return _attachment_file_response(request, attachment)
+
+
+def attachment_thumbnail(request, pk):
+    """First-page thumbnail of a PDF attachment (Office files once a preview exists).
+
+    A miss queues a thumbnail job for the preview worker and answers with a
+    placeholder; 404 once that job failed.
+    """
+    user_id = request.session.get('user_id')
+    if not user_id:
+        return redirect('login')
+    attachment = get_object_or_404(Attachment, pk=pk)
+    if not is_document(attachment.file.name):
+        raise Http404('No thumbnail')
+    path = cached_thumbnail(attachment)
+    if path:
+        return deliver_file(request, path, filename=os.path.basename(path), content_type='image/png')
+    if enqueue_thumbnail(attachment).status == PreviewJob.STATUS_FAILED:
+        raise Http404('No thumbnail')
+    return pending_thumbnail_response()
+
+
+@xframe_options_exempt
+def signed_file(request, token):
+    """Serve a file from a short-lived signed URL minted after a permission check.
+
+    No session or permission lookup happens here, so embedded previews and
+    downloads cost one primary-key query before the transfer is handed off.
+    """
+    try:
+        kind, pk, download = unsign_file_token(token)
+    except signing.BadSignature:
+        raise Http404('Link expired')
+    # previews link to the original as "?download=1" (see knowledge.html_preview)
+    download = download or request.GET.get('download') == '1'
+    if kind == 'attachment':
+        return _attachment_file_response(request, get_object_or_404(Attachment, pk=pk), download=download)
+    if kind == 'knowledge':
+        from knowledge.models import KnowledgeAttachment
+        from knowledge.views import attachment_response
+        return attachment_response(request, get_object_or_404(KnowledgeAttachment, pk=pk), download=download)
+    raise Http404('Unknown file')
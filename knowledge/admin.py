@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import KnowledgeItem, KnowledgeAttachment
+from .models import KnowledgeItem, KnowledgeAttachment, KnowledgeTag, PreviewJob
 
 @admin.register(KnowledgeItem)
 class KnowledgeItemAdmin(admin.ModelAdmin):
@@ -7,7 +7,19 @@ class KnowledgeItemAdmin(admin.ModelAdmin):
     search_fields = ('title', 'body', 'tags')
 
 
+@admin.register(KnowledgeTag)
+class KnowledgeTagAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name')
+    search_fields = ('name',)
+
+
 @admin.register(KnowledgeAttachment)
 class KnowledgeAttachmentAdmin(admin.ModelAdmin):
     list_display = ('id', 'item', 'filename', 'uploaded_at')
     search_fields = ('filename',)
+
+
+@admin.register(PreviewJob)
+class PreviewJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'attachment', 'project_attachment', 'status', 'attempts', 'run_after', 'host', 'updated_at')
+    list_filter = ('kind', 'status')
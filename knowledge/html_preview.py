@@ -0,0 +1,287 @@
+"""Fast HTML previews of common .docx/.xlsx files, rendered without LibreOffice.
+
+The OOXML parts are streamed straight from the zip (``iterparse``; workbooks
+through ``app.xlsx``) into a self-contained HTML page: Word documents become
+paragraphs, headings and tables split into pages at explicit page breaks;
+workbooks become one table per sheet. Output is capped by
+``PREVIEW_HTML_MAX_ROWS`` / ``PREVIEW_HTML_MAX_COLS`` / ``PREVIEW_HTML_MAX_BLOCKS``
+with a notice linking to the full file, and cached in the preview cache under
+the content hash, like the PDF previews.
+
+Documents whose look depends on what is not rendered here (images, charts,
+embedded objects) raise ``Unsupported`` and keep using the PDF pipeline; an
+empty ``NO_HTML_SUFFIX`` entry remembers that for the content hash.
+
+Pages are rendered by the preview worker (``PreviewJob`` of kind ``html``);
+requests only look them up with ``cached_fast_preview``.
+"""
+import html
+import logging
+import os
+import re
+import tempfile
+import zipfile
+from xml.etree.ElementTree import ParseError, iterparse
+
+from django.conf import settings
+
+from app.utils import ensure_content_sha256
+from app.xlsx import XlsxError, XlsxReader
+from attachments.storage import sha256_from_name
+
+from . import preview_cache
+
+logger = logging.getLogger(__name__)
+
+# Bump when the rendered HTML changes; the version is part of the cache suffix.
+HTML_SUFFIX = '.fast-1.html'
+# marker: this content has no fast preview and uses the PDF pipeline
+NO_HTML_SUFFIX = '.fast-1.none'
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_HEADING_RE = re.compile(r'^(?:heading|标题)\s*([1-6])$', re.I)
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>文档预览</title>
+<style>
+body { margin: 0; background: #f3f4f6; font: 14px/1.6 "Microsoft YaHei", "PingFang SC", sans-serif; color: #1f2937; }
+.notice { padding: .5rem 1rem; background: #fff8e1; border-bottom: 1px solid #f0d58c; }
+.sheets { padding: .5rem 1rem; background: #fff; border-bottom: 1px solid #e5e7eb; }
+.sheets a { margin-right: 1rem; }
+.page { background: #fff; max-width: 860px; margin: 1rem auto; padding: 2rem 2.5rem; box-shadow: 0 1px 3px rgba(0,0,0,.12); }
+.sheet { background: #fff; margin: 1rem; padding: 1rem; overflow: auto; }
+table { border-collapse: collapse; margin: .5rem 0; }
+td, th { border: 1px solid #d1d5db; padding: 2px 6px; vertical-align: top; white-space: pre-wrap; }
+.sheet td { white-space: nowrap; }
+.sheet td.num { text-align: right; }
+p { margin: 0 0 .6em; white-space: pre-wrap; }
+</style></head><body>
+%(notice)s%(body)s
+</body></html>
+"""
+
+
+class Unsupported(Exception):
+    """The file needs the LibreOffice pipeline (unsupported content or unreadable)."""
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _notice(text):
+    # the page is shared by every attachment with this content, so the link stays relative
+    return ('<div class="notice">%s，<a href="?download=1" target="_top">下载完整文档</a></div>\n'
+            % html.escape(text))
+
+
+def _check_members(zf, forbidden_prefixes):
+    for name in zf.namelist():
+        # VML parts carry cell comments and legacy shapes, which the preview leaves out
+        if name.endswith(('.vml', '.vml.rels')):
+            continue
+        if name.startswith(forbidden_prefixes):
+            raise Unsupported('contains %s' % name)
+
+
+def _run_html(run):
+    text = []
+    for child in run:
+        if child.tag == _W + 't':
+            text.append(child.text or '')
+        elif child.tag == _W + 'tab':
+            text.append('\t')
+        elif child.tag in (_W + 'br', _W + 'cr') and child.get(_W + 'type') != 'page':
+            text.append('\n')
+    out = html.escape(''.join(text))
+    if not out:
+        return out
+    props = run.find(_W + 'rPr')
+    if props is not None:
+        if props.find(_W + 'b') is not None and props.find(_W + 'b').get(_W + 'val') not in ('0', 'false'):
+            out = '<b>%s</b>' % out
+        if props.find(_W + 'i') is not None and props.find(_W + 'i').get(_W + 'val') not in ('0', 'false'):
+            out = '<i>%s</i>' % out
+        if props.find(_W + 'u') is not None and props.find(_W + 'u').get(_W + 'val') not in (None, 'none'):
+            out = '<u>%s</u>' % out
+    return out
+
+
+def _paragraph_html(para):
+    runs = ''.join(_run_html(run) for run in para.iter(_W + 'r'))
+    style = para.find('%spPr/%spStyle' % (_W, _W))
+    match = _HEADING_RE.match(style.get(_W + 'val', '')) if style is not None else None
+    if match:
+        return '<h%s>%s</h%s>' % (match.group(1), runs, match.group(1))
+    return '<p>%s</p>' % (runs or '&nbsp;')
+
+
+def _has_page_break(para):
+    return any(br.get(_W + 'type') == 'page' for br in para.iter(_W + 'br')) or \
+        para.find('%spPr/%spageBreakBefore' % (_W, _W)) is not None
+
+
+def _table_html(table, max_cols):
+    rows = []
+    for tr in table.iter(_W + 'tr'):
+        cells = []
+        for tc in tr.findall(_W + 'tc')[:max_cols]:
+            span = tc.find('%stcPr/%sgridSpan' % (_W, _W))
+            colspan = ' colspan="%s"' % html.escape(span.get(_W + 'val', '')) if span is not None else ''
+            content = '<br>'.join(
+                ''.join(_run_html(run) for run in p.iter(_W + 'r')) for p in tc.iter(_W + 'p')
+            )
+            cells.append('<td%s>%s</td>' % (colspan, content))
+        rows.append('<tr>%s</tr>' % ''.join(cells))
+    return '<table>%s</table>' % ''.join(rows)
+
+
+def render_docx(path):
+    """Return the preview HTML of a Word document."""
+    max_blocks = _setting('PREVIEW_HTML_MAX_BLOCKS', 3000)
+    max_cols = _setting('PREVIEW_HTML_MAX_COLS', 50)
+    with zipfile.ZipFile(path) as zf:
+        _check_members(zf, ('word/media/', 'word/embeddings/', 'word/charts/', 'word/diagrams/'))
+        pages, blocks, count, truncated = [], [], 0, False
+        depth = 0
+        with zf.open('word/document.xml') as fh:
+            for event, elem in iterparse(fh, events=('start', 'end')):
+                # only top-level body children are rendered; nested paragraphs belong to tables
+                if elem.tag == _W + 'tbl':
+                    depth += 1 if event == 'start' else -1
+                if event == 'start' or depth:
+                    continue
+                if elem.tag == _W + 'p':
+                    if _has_page_break(elem) and blocks:
+                        pages.append(blocks)
+                        blocks = []
+                    blocks.append(_paragraph_html(elem))
+                elif elem.tag == _W + 'tbl':
+                    blocks.append(_table_html(elem, max_cols))
+                elif elem.tag in (_W + 'drawing', _W + 'object', _W + 'pict'):
+                    raise Unsupported('embedded graphics')
+                else:
+                    continue
+                elem.clear()
+                count += 1
+                if count >= max_blocks:
+                    truncated = True
+                    break
+        if blocks:
+            pages.append(blocks)
+    body = '\n'.join('<section class="page">%s</section>' % '\n'.join(page) for page in pages)
+    notice = _notice('预览仅显示前 %d 段' % max_blocks) if truncated else ''
+    return PAGE_TEMPLATE % {'notice': notice, 'body': body}
+
+
+def _cell_html(value):
+    if value is None:
+        return '<td></td>'
+    if isinstance(value, bool):
+        return '<td>%s</td>' % ('TRUE' if value else 'FALSE')
+    if isinstance(value, (int, float)):
+        return '<td class="num">%s</td>' % html.escape(str(value))
+    return '<td>%s</td>' % html.escape(str(value))
+
+
+def render_xlsx(path):
+    """Return the preview HTML of a workbook: one table per sheet, within the row/column budget."""
+    max_rows = _setting('PREVIEW_HTML_MAX_ROWS', 1000)
+    max_cols = _setting('PREVIEW_HTML_MAX_COLS', 50)
+    with zipfile.ZipFile(path) as zf:
+        _check_members(zf, ('xl/charts/', 'xl/drawings/', 'xl/embeddings/'))
+    sections, truncated = [], False
+    with XlsxReader(path) as reader:
+        names = reader.sheet_names
+        for index, sheet in enumerate(names):
+            rows = []
+            for row in reader.iter_rows(sheet):
+                if len(rows) >= max_rows:
+                    truncated = True
+                    break
+                if len(row) > max_cols:
+                    truncated = True
+                rows.append('<tr>%s</tr>' % ''.join(_cell_html(value) for value in row[:max_cols]))
+            sections.append('<section class="sheet" id="sheet-%d"><h3>%s</h3><table>%s</table></section>'
+                            % (index, html.escape(sheet), ''.join(rows)))
+    nav = ''
+    if len(names) > 1:
+        nav = '<nav class="sheets">%s</nav>\n' % ''.join(
+            '<a href="#sheet-%d">%s</a>' % (index, html.escape(sheet)) for index, sheet in enumerate(names)
+        )
+    notice = _notice('预览仅显示每个工作表的前 %d 行、%d 列' % (max_rows, max_cols)) if truncated else ''
+    return PAGE_TEMPLATE % {'notice': notice + nav, 'body': '\n'.join(sections)}
+
+
+RENDERERS = {
+    '.docx': render_docx,
+    '.xlsx': render_xlsx,
+}
+
+
+def _source(attachment):
+    """``(path, ext)`` of an attachment that may get a fast preview, or None."""
+    try:
+        fpath = attachment.file.path
+    except Exception:
+        return None
+    ext = os.path.splitext(fpath)[1].lower()
+    if ext not in RENDERERS or not os.path.exists(fpath):
+        return None
+    if os.path.getsize(fpath) > _setting('PREVIEW_HTML_MAX_SOURCE_BYTES', 20 * 1024 ** 2):
+        return None
+    return fpath, ext
+
+
+def cached_fast_preview(attachment):
+    """Look up the HTML preview of ``attachment`` without rendering anything.
+
+    Returns ``(path, pending)``: the cached page, or None and whether the
+    file is a candidate that has not been rendered yet (queue a ``html``
+    job for it). Files without a known content hash are left to the worker.
+    """
+    if _source(attachment) is None:
+        return None, False
+    content_hash = attachment.content_sha256 or sha256_from_name(attachment.file.name)
+    if not content_hash:
+        return None, True
+    cached = preview_cache.lookup(content_hash, suffix=HTML_SUFFIX)
+    if cached:
+        return cached, False
+    return None, not preview_cache.lookup(content_hash, suffix=NO_HTML_SUFFIX)
+
+
+def _store(content_hash, text, suffix):
+    fd, tmp = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+        fh.write(text)
+    return preview_cache.store(content_hash, tmp, suffix=suffix)
+
+
+def render_fast_preview(attachment):
+    """Render and cache the HTML preview of ``attachment``; runs in the preview worker.
+
+    Returns the cached page, or None when the file is not a candidate or
+    needs the PDF pipeline; the latter is remembered under the content hash
+    so the file is not parsed again.
+    """
+    source = _source(attachment)
+    if source is None:
+        return None
+    fpath, ext = source
+    content_hash = ensure_content_sha256(attachment)
+    cached = preview_cache.lookup(content_hash, suffix=HTML_SUFFIX)
+    if cached:
+        return cached
+    try:
+        page = RENDERERS[ext](fpath)
+    except Unsupported as exc:
+        logger.debug('No fast preview for %s: %s', fpath, exc)
+        page = None
+    except (zipfile.BadZipFile, XlsxError, ParseError, KeyError, ValueError):
+        logger.warning('Fast preview failed for %s', fpath, exc_info=True)
+        page = None
+    if page is None:
+        _store(content_hash, '', NO_HTML_SUFFIX)
+        return None
+    return _store(content_hash, page, HTML_SUFFIX)
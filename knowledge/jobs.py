@@ -0,0 +1,225 @@
+"""Database-backed queue for Office preview conversions, HTML previews and thumbnails.
+
+Uploads and page views only enqueue a ``PreviewJob``; ``manage.py
+preview_worker`` claims and runs them out of band. Jobs for the same
+attachment are coalesced, failures are retried with exponential backoff, and
+the number of jobs running on one host is capped.
+"""
+import logging
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from attachments.extraction import extract_attachment_text
+
+from .html_preview import render_fast_preview
+from .models import KnowledgeAttachment, PreviewJob, PreviewWorkerHost
+from .previews import find_preview, generate_preview, is_office_file
+from .thumbnails import thumbnail_for
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = (PreviewJob.STATUS_PENDING, PreviewJob.STATUS_RUNNING)
+# hosts whose PreviewWorkerHost row this process has made sure of
+_host_rows = set()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def current_host():
+    return socket.gethostname()[:128]
+
+
+def _target_filter(attachment):
+    """Job field pointing at ``attachment``: knowledge attachments and project attachments differ."""
+    if isinstance(attachment, KnowledgeAttachment):
+        return {'attachment_id': attachment.pk}
+    return {'project_attachment_id': attachment.pk}
+
+
+def enqueue_job(attachment, kind=PreviewJob.KIND_PREVIEW, delay=0):
+    """Queue ``kind`` work for ``attachment`` unless it is pending or running, or last failed for good.
+
+    Returns the new job, or the existing one (check its ``status``).
+    """
+    target = _target_filter(attachment)
+    latest = PreviewJob.objects.filter(kind=kind, **target).order_by('-id').first()
+    if latest and (latest.status in ACTIVE_STATUSES or latest.status == PreviewJob.STATUS_FAILED):
+        return latest
+    return PreviewJob.objects.create(kind=kind, run_after=timezone.now() + timedelta(seconds=delay), **target)
+
+
+def enqueue_preview(attachment, delay=0):
+    """Queue the Office -> PDF conversion of a knowledge attachment (see ``enqueue_job``)."""
+    return enqueue_job(attachment, PreviewJob.KIND_PREVIEW, delay=delay)
+
+
+def enqueue_thumbnail(attachment):
+    """Queue the first-page thumbnail of a knowledge or project attachment (see ``enqueue_job``)."""
+    return enqueue_job(attachment, PreviewJob.KIND_THUMBNAIL)
+
+
+def requeue_stale_jobs():
+    """Return jobs whose worker died mid-conversion to the pending state.
+
+    Jobs that already used ``PREVIEW_JOB_MAX_ATTEMPTS`` fail instead, so a
+    file that crashes the worker is not retried once per lease forever.
+    Returns how many jobs were requeued.
+    """
+    lease = _setting('PREVIEW_JOB_LEASE_SECONDS', 600)
+    cutoff = timezone.now() - timedelta(seconds=lease)
+    stale = PreviewJob.objects.filter(status=PreviewJob.STATUS_RUNNING, locked_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=_setting('PREVIEW_JOB_MAX_ATTEMPTS', 5)).update(
+        status=PreviewJob.STATUS_FAILED, locked_by='', host='', locked_at=None, last_error='worker died',
+    )
+    if failed:
+        logger.warning('Failed %d preview job(s) whose worker died on every attempt', failed)
+    return stale.update(status=PreviewJob.STATUS_PENDING, locked_by='', host='', locked_at=None)
+
+
+def _lock_kwargs():
+    if connection.features.has_select_for_update_skip_locked:
+        return {'skip_locked': True}
+    return {}
+
+
+def _ensure_host_row(host):
+    # outside the claim transaction, which should only take the row lock
+    if host not in _host_rows:
+        PreviewWorkerHost.objects.get_or_create(host=host)
+        _host_rows.add(host)
+
+
+def _lock_host(host):
+    """Lock the ``PreviewWorkerHost`` row of ``host`` until the transaction ends."""
+    # a locking read first: on MySQL a plain read before it would fix the
+    # transaction's snapshot before the lock is granted
+    PreviewWorkerHost.objects.select_for_update().filter(host=host).first()
+
+
+def claim_next_job(worker_id, host=None, max_per_host=None):
+    """Atomically mark the next due job as running for ``worker_id``.
+
+    Returns ``None`` when nothing is due or the host is at its concurrency cap.
+    Workers of one host take turns on the host's row lock, so the cap check
+    and the claim cannot interleave.
+    """
+    host = host or current_host()
+    if max_per_host is None:
+        max_per_host = _setting('PREVIEW_WORKER_MAX_PER_HOST', 2)
+    if max_per_host:
+        _ensure_host_row(host)
+    now = timezone.now()
+    with transaction.atomic():
+        if max_per_host:
+            _lock_host(host)
+            if PreviewJob.objects.filter(status=PreviewJob.STATUS_RUNNING, host=host).count() >= max_per_host:
+                return None
+        running = PreviewJob.objects.filter(status=PreviewJob.STATUS_RUNNING)
+        # NULLs are left out of the subqueries: NOT IN over a NULL matches nothing
+        busy = running.filter(attachment_id__isnull=False).values('attachment_id')
+        busy_project = running.filter(project_attachment_id__isnull=False).values('project_attachment_id')
+        job = (
+            PreviewJob.objects
+            .select_for_update(**_lock_kwargs())
+            .filter(status=PreviewJob.STATUS_PENDING, run_after__lte=now)
+            .exclude(attachment_id__in=busy)
+            .exclude(project_attachment_id__in=busy_project)
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        # the conditional update guards backends without row locks
+        claimed = PreviewJob.objects.filter(pk=job.pk, status=PreviewJob.STATUS_PENDING).update(
+            status=PreviewJob.STATUS_RUNNING, host=host, locked_by=worker_id, locked_at=now,
+            attempts=job.attempts + 1,
+        )
+        if not claimed:
+            return None
+        # coalesce duplicates queued for the same work into this run; they are
+        # removed so the attachment's latest job of this kind is the one that ran
+        PreviewJob.objects.filter(
+            kind=job.kind, attachment_id=job.attachment_id, project_attachment_id=job.project_attachment_id,
+            status=PreviewJob.STATUS_PENDING,
+        ).exclude(pk=job.pk).delete()
+    job.refresh_from_db()
+    return job
+
+
+def _retry_delay(attempts):
+    base = _setting('PREVIEW_JOB_RETRY_BASE_SECONDS', 30)
+    return min(base * (2 ** max(attempts - 1, 0)), 6 * 3600)
+
+
+def _run_preview(job):
+    result = generate_preview(job.attachment)
+    if result:
+        try:
+            # warm the list/detail thumbnail while the preview is fresh; legacy
+            # .doc/.xls/.ppt text can only be read from the preview
+            thumbnail_for(job.attachment)
+            extract_attachment_text(job.attachment)
+        except Exception:
+            logger.warning('Thumbnail/text for attachment %s failed', job.attachment_id, exc_info=True)
+    return result, 'no preview produced', False
+
+
+def _run_html(job):
+    if not render_fast_preview(job.attachment) and not find_preview(job.attachment):
+        # no fast preview for this file: the PDF pipeline takes over
+        enqueue_preview(job.attachment)
+    return True, '', False
+
+
+def _run_thumbnail(job):
+    target = job.target
+    result = thumbnail_for(target)
+    if result or not is_office_file(target.file.name):
+        return result, 'no thumbnail produced', False
+    # Office files are rendered from their PDF preview, and knowledge attachments
+    # queue the conversion instead (it renders the thumbnail too); project
+    # attachments get no conversion of their own, so retrying cannot help
+    return None, 'no PDF preview to render a thumbnail from', True
+
+
+JOB_RUNNERS = {
+    PreviewJob.KIND_PREVIEW: _run_preview,
+    PreviewJob.KIND_HTML: _run_html,
+    PreviewJob.KIND_THUMBNAIL: _run_thumbnail,
+}
+
+
+def run_job(job):
+    """Run one claimed job and record its outcome. Returns True on success."""
+    error, failure, permanent = '', '', False
+    try:
+        result, failure, permanent = JOB_RUNNERS[job.kind](job)
+    except Exception as exc:
+        logger.exception('Preview job %s failed', job.pk)
+        result, error = None, str(exc) or exc.__class__.__name__
+    if result:
+        PreviewJob.objects.filter(pk=job.pk).update(
+            status=PreviewJob.STATUS_DONE, locked_by='', host='', locked_at=None, last_error='',
+        )
+        return True
+    error = error or failure
+    max_attempts = _setting('PREVIEW_JOB_MAX_ATTEMPTS', 5)
+    if permanent or job.attempts >= max_attempts:
+        status, run_after = PreviewJob.STATUS_FAILED, job.run_after
+    else:
+        status, run_after = PreviewJob.STATUS_PENDING, timezone.now() + timedelta(seconds=_retry_delay(job.attempts))
+    PreviewJob.objects.filter(pk=job.pk).update(
+        status=status, run_after=run_after, locked_by='', host='', locked_at=None, last_error=error[:2000],
+    )
+    return False
+
+
+def worker_id(suffix=''):
+    return ('%s:%s%s' % (current_host(), os.getpid(), suffix))[:128]
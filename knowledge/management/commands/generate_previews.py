@@ -2,54 +2,248 @@
 
 Management command to find KnowledgeAttachment records for Office files that
 lack a preview and generate PDF previews using soffice.
+
+Attachments are streamed from the database in id order and converted by up to
+``--jobs`` worker processes. Progress is checkpointed to a manifest file so an
+interrupted backfill resumes after the last fully processed id. Failed ids are
+kept in the manifest; ``--retry-failed`` converts them again before resuming.
 """
-from django.core.management.base import BaseCommand
-from knowledge.models import KnowledgeAttachment
+import json
 import logging
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from knowledge.models import KnowledgeAttachment
+from knowledge.preview_pdf import lookup_preview
+from knowledge.previews import OFFICE_EXTS, generate_preview
+from knowledge.thumbnails import thumbnail_for
 
 logger = logging.getLogger(__name__)
 
 
+def _init_worker():
+    # spawned workers (Windows) start without Django configured; forked ones
+    # must not reuse the parent's database connection, nor close it: closing
+    # would end the session the parent still uses over the same socket
+    import django
+    django.setup()
+    for conn in connections.all():
+        conn.connection = None
+
+
+def _convert(attachment_id):
+    started = time.time()
+    try:
+        att = KnowledgeAttachment.objects.get(pk=attachment_id)
+        result = generate_preview(att)
+        error = '' if result else 'no preview produced'
+        if result:
+            thumbnail_for(att)
+    except Exception as exc:
+        logger.exception('Error generating preview for attachment %s', attachment_id)
+        result, error = None, str(exc)
+    return attachment_id, result, error, time.time() - started
+
+
+class Manifest:
+    """Resume point of a backfill: every id <= ``last_id`` has been handled."""
+
+    def __init__(self, path, filters):
+        self.path = path
+        self.filters = filters
+        self.last_id = 0
+        self.failed = {}
+        self.counts = {'created': 0, 'failed': 0, 'skipped': 0}
+
+    def load(self, out):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as fh:
+            data = json.load(fh)
+        if data.get('filters') != self.filters:
+            out.write('Manifest %s was written with different filters; starting over' % self.path)
+            return
+        self.last_id = data.get('last_id', 0)
+        self.failed = data.get('failed', {})
+        self.counts.update(data.get('counts', {}))
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump({
+                'filters': self.filters,
+                'last_id': self.last_id,
+                'failed': self.failed,
+                'counts': self.counts,
+                'updated_at': timezone.now().isoformat(),
+            }, fh, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.path)
+
+
 class Command(BaseCommand):
     help = 'Generate PDF previews for office attachments (doc/docx/xls/xlsx/ppt/pptx)'
 
     def add_arguments(self, parser):
         parser.add_argument('--limit', type=int, default=0, help='Limit number of conversions (0 = unlimited)')
+        parser.add_argument('--jobs', type=int, default=1, help='Number of parallel conversion processes')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rows fetched per database round trip')
+        parser.add_argument('--since', help='Only attachments uploaded on or after this date (YYYY-MM-DD)')
+        parser.add_argument('--ext', help='Comma separated extensions to include, e.g. docx,xlsx')
+        parser.add_argument('--manifest', help='Progress manifest path (default: MEDIA_ROOT/.generate_previews.json)')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing manifest and start from the first id')
+        parser.add_argument('--retry-failed', action='store_true',
+                            help='Convert the attachments that failed in earlier runs again before resuming')
 
-    def handle(self, *args, **options):
-        limit = options.get('limit') or 0
-        qs = KnowledgeAttachment.objects.all()
-        office_exts = ('.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx')
-        todo = []
-        for att in qs:
+    def _filters(self, options):
+        exts = sorted(OFFICE_EXTS)
+        if options.get('ext'):
+            wanted = {'.' + e.strip().lower().lstrip('.') for e in options['ext'].split(',') if e.strip()}
+            unknown = wanted - OFFICE_EXTS
+            if unknown:
+                raise CommandError('Unsupported extensions: %s' % ', '.join(sorted(unknown)))
+            exts = sorted(wanted)
+        since = None
+        if options.get('since'):
             try:
-                fpath = att.file.path
-            except Exception:
-                continue
-            if not fpath:
-                continue
-            if not os.path.exists(fpath):
-                continue
-            if not os.path.splitext(fpath)[1].lower() in office_exts:
-                continue
-            preview = fpath + '.preview.pdf'
-            if os.path.exists(preview):
+                since = datetime.strptime(options['since'], '%Y-%m-%d').date().isoformat()
+            except ValueError:
+                raise CommandError('--since must be YYYY-MM-DD')
+        return {'ext': exts, 'since': since}
+
+    def _queryset(self, filters, after_id):
+        ext_q = Q()
+        for ext in filters['ext']:
+            ext_q |= Q(file__iendswith=ext)
+        qs = KnowledgeAttachment.objects.filter(ext_q, pk__gt=after_id)
+        if filters['since']:
+            since = timezone.make_aware(datetime.strptime(filters['since'], '%Y-%m-%d'))
+            qs = qs.filter(uploaded_at__gte=since)
+        return qs.order_by('pk').only('id', 'file', 'content_sha256')
+
+    def _retries(self, filters, chunk_size, manifest):
+        """Yield the failed ids below the watermark again.
+
+        Ids that were deleted or have a preview by now are dropped from the manifest.
+        """
+        failed_ids = sorted(int(att_id) for att_id in manifest.failed if int(att_id) <= manifest.last_id)
+        for start in range(0, len(failed_ids), chunk_size):
+            chunk = failed_ids[start:start + chunk_size]
+            found = set()
+            for att in self._queryset(filters, 0).filter(pk__in=chunk):
+                found.add(att.pk)
+                if lookup_preview(att.content_sha256):
+                    manifest.failed.pop(str(att.pk), None)
+                    continue
+                yield att.pk, True, True
+            for att_id in set(chunk) - found:
+                manifest.failed.pop(str(att_id), None)
+
+    def _candidates(self, qs, chunk_size, manifest, retries=()):
+        """Yield ``(id, needed, retry)``; rows already in the preview cache are skipped."""
+        yield from retries
+        for att in qs.iterator(chunk_size=chunk_size):
+            if lookup_preview(att.content_sha256):
+                manifest.counts['skipped'] += 1
+                yield att.pk, False, False
                 continue
-            todo.append(att)
-            if limit and len(todo) >= limit:
-                break
+            yield att.pk, True, False
 
-        self.stdout.write('Found %d attachments to process' % len(todo))
-        for att in todo:
-            self.stdout.write('Processing: %s (id=%s)' % (getattr(att, 'filename', ''), att.pk))
-            try:
-                from knowledge.views import _maybe_generate_preview
-                res = _maybe_generate_preview(att)
-                if res:
-                    self.stdout.write(self.style.SUCCESS('Created preview: %s' % res))
-                else:
-                    self.stdout.write(self.style.WARNING('No preview created for: %s' % getattr(att, 'filename', '')))
-            except Exception as e:
-                logger.exception('Error generating preview for %s', getattr(att, 'filename', None))
-                self.stdout.write(self.style.ERROR('Error: %s' % str(e)))
+    def handle(self, *args, **options):
+        limit = options.get('limit') or 0
+        jobs = max(1, options.get('jobs') or 1)
+        chunk_size = options.get('chunk_size') or 500
+        filters = self._filters(options)
+        manifest_path = options.get('manifest') or os.path.join(str(settings.MEDIA_ROOT), '.generate_previews.json')
+        manifest = Manifest(manifest_path, filters)
+        if not options.get('restart'):
+            manifest.load(self.stdout)
+        if manifest.last_id:
+            self.stdout.write('Resuming after attachment id %d' % manifest.last_id)
+        os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+
+        qs = self._queryset(filters, manifest.last_id)
+        retries = self._retries(filters, chunk_size, manifest) if options.get('retry_failed') else ()
+        candidates = self._candidates(qs, chunk_size, manifest, retries)
+        started = time.time()
+        processed = 0
+        in_flight = {}
+        last_seen = manifest.last_id
+
+        def record(att_id, result, error, duration):
+            nonlocal processed
+            processed += 1
+            if result:
+                manifest.counts['created'] += 1
+                manifest.failed.pop(str(att_id), None)
+                self.stdout.write(self.style.SUCCESS('[%d] preview created in %.1fs: %s' % (att_id, duration, result)))
+            else:
+                manifest.counts['failed'] += 1
+                manifest.failed[str(att_id)] = error
+                self.stdout.write(self.style.WARNING('[%d] no preview: %s' % (att_id, error)))
+
+        def checkpoint():
+            # contiguous watermark: everything below the oldest in-flight id is
+            # done (retried ids are below the watermark already)
+            pending = [att_id for att_id, retry in in_flight.values() if not retry]
+            manifest.last_id = (min(pending) - 1) if pending else last_seen
+            manifest.save()
+
+        connections.close_all()
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) if jobs > 1 else None
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and len(in_flight) < jobs * 2 and not (limit and processed + len(in_flight) >= limit):
+                    try:
+                        att_id, needed, retry = next(candidates)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if not retry:
+                        last_seen = att_id
+                    if not needed:
+                        continue
+                    if executor is None:
+                        record(*_convert(att_id))
+                        checkpoint()
+                    else:
+                        in_flight[executor.submit(_convert, att_id)] = (att_id, retry)
+                if not in_flight:
+                    break
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.pop(future)
+                    record(*future.result())
+                checkpoint()
+            if limit and processed >= limit:
+                self.stdout.write('Stopped after --limit %d conversions' % limit)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Interrupted; progress saved to %s' % manifest_path))
+            for future in in_flight:
+                future.cancel()
+            raise
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            checkpoint()
+
+        elapsed = time.time() - started
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        self.stdout.write('')
+        self.stdout.write('Converted %d attachment(s) in %.1fs (%.2f docs/s, %d job(s))' % (processed, elapsed, rate, jobs))
+        self.stdout.write('Totals for this backfill: created=%(created)d failed=%(failed)d skipped=%(skipped)d' % manifest.counts)
+        if manifest.failed:
+            self.stdout.write(self.style.ERROR('%d attachment(s) currently failing:' % len(manifest.failed)))
+            for att_id, error in list(manifest.failed.items())[:20]:
+                self.stdout.write('  id=%s %s' % (att_id, error))
+        self.stdout.write('Manifest: %s' % manifest_path)
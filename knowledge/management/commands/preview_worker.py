@@ -0,0 +1,121 @@
+"""preview_worker
+
+Management command that runs queued Office -> PDF preview conversions and
+thumbnail renders (``PreviewJob`` rows) outside the web request. Run one or
+more per host, e.g. under systemd; the number of concurrent conversions per host is capped by
+``PREVIEW_WORKER_MAX_PER_HOST``. Every worker also returns jobs of crashed
+workers (running longer than ``PREVIEW_JOB_LEASE_SECONDS``) to the queue, at
+startup and then once a minute, and keeps the preview cache within its budget.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from knowledge import preview_cache
+from knowledge.jobs import claim_next_job, current_host, requeue_stale_jobs, run_job, worker_id
+from knowledge.previews import find_soffice
+from knowledge.soffice_pool import PoolUnavailable, get_pool
+
+REQUEUE_INTERVAL = 60
+# stores only evict what this process knows about; a periodic scan covers the rest
+CACHE_BUDGET_INTERVAL = 300
+
+
+class Command(BaseCommand):
+    help = 'Run queued Office preview conversions and thumbnail renders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=0,
+                            help='Conversion threads in this process (default: PREVIEW_WORKER_MAX_PER_HOST)')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due instead of polling forever')
+        parser.add_argument('--health-check', action='store_true',
+                            help='Start the soffice listener pool, report its health and exit')
+
+    def handle(self, *args, **options):
+        if options.get('health_check'):
+            return self._health_check()
+        max_per_host = getattr(settings, 'PREVIEW_WORKER_MAX_PER_HOST', 2)
+        threads = options.get('threads') or max_per_host or 1
+        self.poll_interval = options.get('poll_interval') or 2.0
+        self.once = options.get('once')
+        self.max_per_host = max_per_host
+        self.stop = threading.Event()
+        self.stdout.write('Preview worker on %s: %d thread(s), host cap %s' % (current_host(), threads, max_per_host or 'none'))
+        self._requeue()
+        self._enforce_cache_budget()
+        workers = [
+            threading.Thread(target=self._loop, args=(worker_id('/%d' % n),), daemon=True)
+            for n in range(threads)
+        ]
+        for t in workers:
+            t.start()
+        try:
+            while any(t.is_alive() for t in workers):
+                for t in workers:
+                    t.join(timeout=1)
+                if time.monotonic() - self.last_requeue >= REQUEUE_INTERVAL:
+                    self._requeue()
+                if time.monotonic() - self.last_budget_check >= CACHE_BUDGET_INTERVAL:
+                    self._enforce_cache_budget()
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping after running conversions finish...')
+            self.stop.set()
+            for t in workers:
+                t.join()
+
+    def _requeue(self):
+        self.last_requeue = time.monotonic()
+        try:
+            requeued = requeue_stale_jobs()
+        except Exception:
+            self.stderr.write('Could not requeue stale jobs')
+            return
+        finally:
+            connections.close_all()
+        if requeued:
+            self.stdout.write(self.style.WARNING('Requeued %d job(s) of crashed workers' % requeued))
+
+    def _enforce_cache_budget(self):
+        self.last_budget_check = time.monotonic()
+        try:
+            preview_cache.enforce_budget()
+        except Exception:
+            self.stderr.write('Could not enforce the preview cache budget')
+
+    def _health_check(self):
+        pool = get_pool(find_soffice())
+        if pool is None:
+            self.stdout.write(self.style.WARNING('Listener pool unavailable (no soffice, no uno module or PREVIEW_POOL_SIZE=0); subprocess fallback in use'))
+            return
+        for listener in pool.listeners:
+            if not listener.healthy():
+                try:
+                    listener.restart()
+                except PoolUnavailable as exc:
+                    self.stdout.write(self.style.ERROR(str(exc)))
+        for name, healthy, conversions, rss in pool.health():
+            style = self.style.SUCCESS if healthy else self.style.ERROR
+            self.stdout.write(style('%s healthy=%s conversions=%d rss=%s' % (
+                name, healthy, conversions, '%.0fMB' % (rss / 1048576.0) if rss else 'n/a')))
+        pool.close()
+
+    def _loop(self, wid):
+        try:
+            while not self.stop.is_set():
+                job = claim_next_job(wid, max_per_host=self.max_per_host)
+                if job is None:
+                    if self.once:
+                        return
+                    self.stop.wait(self.poll_interval)
+                    continue
+                started = time.time()
+                ok = run_job(job)
+                style = self.style.SUCCESS if ok else self.style.WARNING
+                self.stdout.write(style('[%s] %s job %s attachment %s %s in %.1fs' % (
+                    wid, job.kind, job.pk, job.attachment_id or 'project/%s' % job.project_attachment_id, 'done' if ok else 'failed', time.time() - started)))
+        finally:
+            connections.close_all()
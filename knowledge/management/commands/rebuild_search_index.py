@@ -0,0 +1,26 @@
+"""rebuild_search_index
+
+Management command to (re)build the knowledge search token index, e.g. after
+first deploying search or changing the tokenizer.
+"""
+from django.core.management.base import BaseCommand
+from knowledge.models import KnowledgeItem
+from knowledge.search import index_item
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search token index for knowledge items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rows fetched per database round trip')
+
+    def handle(self, *args, **options):
+        chunk_size = options.get('chunk_size') or 500
+        qs = KnowledgeItem.objects.only('id', 'title', 'body', 'tags').order_by('id')
+        items = tokens = 0
+        for item in qs.iterator(chunk_size=chunk_size):
+            tokens += index_item(item)
+            items += 1
+            if items % chunk_size == 0:
+                self.stdout.write('Indexed %d items' % items)
+        self.stdout.write(self.style.SUCCESS('Indexed %d items (%d tokens)' % (items, tokens)))
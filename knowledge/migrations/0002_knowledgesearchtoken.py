@@ -0,0 +1,34 @@
+# Generated by Django 3.2.20 on 2026-10-17 21:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgeSearchToken',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=32)),
+                ('weight', models.PositiveIntegerField(default=1)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_tokens', to='knowledge.knowledgeitem')),
+            ],
+            options={
+                'db_table': 'knowledge_search_tokens',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='knowledgesearchtoken',
+            index=models.Index(fields=['token', 'item'], name='knowledge_token_item_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='knowledgesearchtoken',
+            unique_together={('item', 'token')},
+        ),
+    ]
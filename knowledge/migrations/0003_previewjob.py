@@ -0,0 +1,42 @@
+# Generated by Django 3.2.20 on 2026-10-17 21:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0002_knowledgesearchtoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreviewJob',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', '等待中'), ('running', '转换中'), ('done', '已完成'), ('failed', '失败')], default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('host', models.CharField(blank=True, max_length=128)),
+                ('locked_by', models.CharField(blank=True, max_length=128)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('attachment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='preview_jobs', to='knowledge.knowledgeattachment')),
+            ],
+            options={
+                'db_table': 'knowledge_preview_jobs',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='previewjob',
+            index=models.Index(fields=['status', 'run_after'], name='knowledge_pjob_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='previewjob',
+            index=models.Index(fields=['attachment', 'status'], name='knowledge_pjob_att_idx'),
+        ),
+    ]
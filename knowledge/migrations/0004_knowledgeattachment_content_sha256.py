@@ -0,0 +1,18 @@
+# Generated by Django 3.2.20 on 2026-10-17 21:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0003_previewjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgeattachment',
+            name='content_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.20 on 2026-10-17 22:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0004_knowledgeattachment_content_sha256'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KnowledgeTag',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=64, unique=True)),
+            ],
+            options={
+                'db_table': 'knowledge_tags',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='knowledgeitem',
+            name='tag_set',
+            field=models.ManyToManyField(blank=True, db_table='knowledge_item_tags', related_name='items', to='knowledge.KnowledgeTag'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+import re
+
+from django.db import migrations
+
+# Frozen copy of knowledge.tags.parse_tags, so later changes there do not alter this migration.
+_SPLIT_RE = re.compile(r'[,，;；、\n]+')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def _parse_tags(text):
+    names = (_SPACE_RE.sub(' ', part.strip()).lower()[:64] for part in _SPLIT_RE.split(text or ''))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def backfill_tags(apps, schema_editor):
+    KnowledgeItem = apps.get_model('knowledge', 'KnowledgeItem')
+    KnowledgeTag = apps.get_model('knowledge', 'KnowledgeTag')
+    Link = KnowledgeItem.tag_set.through
+
+    item_tags = {}
+    for item_id, tags in KnowledgeItem.objects.exclude(tags='').values_list('id', 'tags').iterator():
+        names = _parse_tags(tags)
+        if names:
+            item_tags[item_id] = names
+    all_names = {name for names in item_tags.values() for name in names}
+    KnowledgeTag.objects.bulk_create([KnowledgeTag(name=name) for name in sorted(all_names)],
+                                  batch_size=500, ignore_conflicts=True)
+    tag_ids = dict(KnowledgeTag.objects.values_list('name', 'id'))
+    Link.objects.bulk_create(
+        [
+            Link(knowledgeitem_id=item_id, knowledgetag_id=tag_ids[name])
+            for item_id, names in item_tags.items()
+            for name in names
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0005_knowledgetag'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_tags, migrations.RunPython.noop),
+    ]
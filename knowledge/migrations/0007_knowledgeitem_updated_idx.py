@@ -0,0 +1,17 @@
+# Generated by Django 3.2.20 on 2026-10-17 22:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0006_backfill_knowledge_tags'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='knowledgeitem',
+            index=models.Index(fields=['-updated_at', 'id'], name='knowledge_item_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.20 on 2026-10-17 22:12
+
+import attachments.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0007_knowledgeitem_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='knowledgeattachment',
+            name='file',
+            field=models.FileField(max_length=255, storage=attachments.storage.ContentAddressedStorage(), upload_to='knowledge/%Y/%m/%d/'),
+        ),
+    ]
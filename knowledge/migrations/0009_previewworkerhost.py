@@ -0,0 +1,23 @@
+# Generated by Django 3.2.20 on 2026-10-17 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0008_alter_knowledgeattachment_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PreviewWorkerHost',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('host', models.CharField(max_length=128, unique=True)),
+            ],
+            options={
+                'db_table': 'knowledge_preview_hosts',
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.20 on 2026-10-17 22:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attachments', '0009_filepurge'),
+        ('knowledge', '0009_previewworkerhost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='previewjob',
+            name='kind',
+            field=models.CharField(choices=[('preview', 'PDF 预览'), ('thumbnail', '缩略图')], default='preview', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='previewjob',
+            name='project_attachment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='preview_jobs', to='attachments.attachment'),
+        ),
+        migrations.AlterField(
+            model_name='previewjob',
+            name='attachment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='preview_jobs', to='knowledge.knowledgeattachment'),
+        ),
+        migrations.AddIndex(
+            model_name='previewjob',
+            index=models.Index(fields=['project_attachment', 'status'], name='knowledge_pjob_patt_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.20 on 2026-10-17 23:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('knowledge', '0010_previewjob_kind'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='previewjob',
+            name='kind',
+            field=models.CharField(choices=[('preview', 'PDF 预览'), ('html', 'HTML 预览'), ('thumbnail', '缩略图')], default='preview', max_length=20),
+        ),
+    ]
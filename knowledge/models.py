@@ -1,8 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from pathlib import Path
 from django.conf import settings
 from django.utils import timezone
 
+from attachments.storage import blob_storage
+
 
 class KnowledgeItem(models.Model):
     VISIBILITY_PRIVATE = 'private'
@@ -22,29 +24,55 @@ class KnowledgeItem(models.Model):
     department = models.CharField(max_length=128, blank=True, null=True)
     visibility = models.CharField(max_length=20, choices=VISIBILITY_CHOICES, default=VISIBILITY_PRIVATE)
     tags = models.CharField(max_length=255, blank=True)
+    # normalized form of ``tags``, kept in sync on save (see knowledge.tags)
+    tag_set = models.ManyToManyField('KnowledgeTag', related_name='items', blank=True, db_table='knowledge_item_tags')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'knowledge_items'
         ordering = ['-updated_at']
+        indexes = [
+            # keyset pagination of the knowledge list
+            models.Index(fields=['-updated_at', 'id'], name='knowledge_item_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} ({self.owner})"
 
 
+class KnowledgeTag(models.Model):
+    id = models.AutoField(primary_key=True)
+    # normalized (trimmed, lower-cased) tag text; unique, so tag filters are an indexed equality join
+    name = models.CharField(max_length=64, unique=True)
+
+    class Meta:
+        db_table = 'knowledge_tags'
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+
 class KnowledgeAttachment(models.Model):
     id = models.AutoField(primary_key=True)
     item = models.ForeignKey(KnowledgeItem, related_name='attachments', on_delete=models.CASCADE)
-    file = models.FileField(upload_to='knowledge/%Y/%m/%d/')
+    file = models.FileField(upload_to='knowledge/%Y/%m/%d/', storage=blob_storage, max_length=255)
     filename = models.CharField(max_length=255, blank=True)
     uploaded_at = models.DateTimeField(default=timezone.now)
+    # SHA-256 of the file content; keys the preview cache. Filled lazily by the preview worker.
+    content_sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+
+    def save(self, *args, **kwargs):
+        # the stored blob stays locked against purging until its reference is counted
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     @property
     def file_basename(self) -> str:
         if not self.file:
             return ''
-        return Path(self.file.name).name
+        return self.filename or Path(self.file.name).name
 
     @property
     def file_extension(self) -> str:
@@ -57,3 +85,92 @@ class KnowledgeAttachment(models.Model):
 
     def __str__(self):
         return self.filename or str(self.file)
+
+
+class KnowledgeSearchToken(models.Model):
+    """Inverted index row: one distinct token of one item with its field-weighted score."""
+    id = models.AutoField(primary_key=True)
+    item = models.ForeignKey(KnowledgeItem, related_name='search_tokens', on_delete=models.CASCADE)
+    token = models.CharField(max_length=32)
+    weight = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        db_table = 'knowledge_search_tokens'
+        unique_together = [('item', 'token')]
+        indexes = [
+            models.Index(fields=['token', 'item'], name='knowledge_token_item_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.token} -> {self.item_id}"
+
+
+class PreviewJob(models.Model):
+    """Queued preview work for one attachment, run by the preview_worker command.
+
+    ``kind`` says what to build: the Office -> PDF conversion or the fast
+    HTML preview of a knowledge attachment, or the first-page thumbnail of a
+    knowledge or project (``project_attachment``) attachment.
+    """
+    KIND_PREVIEW = 'preview'
+    KIND_HTML = 'html'
+    KIND_THUMBNAIL = 'thumbnail'
+    KIND_CHOICES = [
+        (KIND_PREVIEW, 'PDF 预览'),
+        (KIND_HTML, 'HTML 预览'),
+        (KIND_THUMBNAIL, '缩略图'),
+    ]
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, '等待中'),
+        (STATUS_RUNNING, '转换中'),
+        (STATUS_DONE, '已完成'),
+        (STATUS_FAILED, '失败'),
+    ]
+
+    id = models.AutoField(primary_key=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=KIND_PREVIEW)
+    attachment = models.ForeignKey(KnowledgeAttachment, related_name='preview_jobs', on_delete=models.CASCADE,
+                                   null=True, blank=True)
+    project_attachment = models.ForeignKey('attachments.Attachment', related_name='preview_jobs',
+                                           on_delete=models.CASCADE, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    host = models.CharField(max_length=128, blank=True)
+    locked_by = models.CharField(max_length=128, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'knowledge_preview_jobs'
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='knowledge_pjob_status_idx'),
+            models.Index(fields=['attachment', 'status'], name='knowledge_pjob_att_idx'),
+            models.Index(fields=['project_attachment', 'status'], name='knowledge_pjob_patt_idx'),
+        ]
+
+    @property
+    def target(self):
+        """The attachment this job works on."""
+        return self.attachment if self.attachment_id else self.project_attachment
+
+    def __str__(self):
+        return f"{self.kind} #{self.attachment_id or self.project_attachment_id} ({self.status})"
+
+
+class PreviewWorkerHost(models.Model):
+    """One row per worker host; locked while a worker checks the host's cap and claims a job."""
+    id = models.AutoField(primary_key=True)
+    host = models.CharField(max_length=128, unique=True)
+
+    class Meta:
+        db_table = 'knowledge_preview_hosts'
+
+    def __str__(self):
+        return self.host
@@ -0,0 +1,180 @@
+"""Content-addressed cache of generated previews.
+
+Entries are keyed by the SHA-256 of the source document plus
+``CONVERTER_VERSION``, so identical uploads share one preview and changing the
+conversion pipeline invalidates old output. Total size is kept under
+``PREVIEW_CACHE_MAX_BYTES`` by evicting least recently used entries (entry
+atime is refreshed on use; mtime stays the write time, so HTTP validators of
+a cached file do not change); an evicted preview is simply rebuilt by the
+preview worker the next time someone opens it.
+
+Stores do not scan the cache: each process adds what it stores to the total
+seen by its last scan and only evicts when that estimate passes the budget.
+The preview worker also evicts periodically, which accounts for entries
+written by other processes.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Bump when the conversion output changes so stale entries are not reused.
+CONVERTER_VERSION = 'soffice-pdf-2'
+# Earlier versions whose output only needs post-processing (see preview_pdf), not a new conversion.
+REUSABLE_VERSIONS = ('soffice-pdf-1',)
+# Refresh an entry's atime at most this often, to avoid a metadata write per hit.
+TOUCH_INTERVAL = 3600
+# Evict down to this fraction of the budget so eviction does not run on every store.
+LOW_WATER_RATIO = 0.9
+
+_evict_lock = threading.Lock()
+# bytes in the cache at this process's last scan plus what it stored since (None: not scanned yet)
+_estimated_total = None
+
+
+def cache_root():
+    return str(getattr(settings, 'PREVIEW_CACHE_ROOT', os.path.join(str(settings.MEDIA_ROOT), 'preview_cache')))
+
+
+def max_bytes():
+    return getattr(settings, 'PREVIEW_CACHE_MAX_BYTES', 5 * 1024 ** 3)
+
+
+def cache_key(content_sha256, version=CONVERTER_VERSION):
+    return hashlib.sha256(('%s:%s' % (content_sha256, version)).encode('ascii')).hexdigest()
+
+
+def entry_path(content_sha256, suffix='.pdf', version=CONVERTER_VERSION):
+    key = cache_key(content_sha256, version)
+    return os.path.join(cache_root(), key[:2], key + suffix)
+
+
+def find_reusable(content_sha256):
+    """Path of a preview made by an earlier ``REUSABLE_VERSIONS`` pipeline, or None."""
+    for version in REUSABLE_VERSIONS:
+        path = entry_path(content_sha256, version=version)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def publish_atomically(src, dest, move=True):
+    """Put ``src`` at ``dest`` so readers never observe a partially written file.
+
+    The file is first moved/copied next to ``dest`` (same filesystem) and then
+    renamed over it; concurrent writers simply replace each other's complete output.
+    """
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp = '%s.%s.tmp' % (dest, uuid.uuid4().hex)
+    try:
+        if move:
+            shutil.move(src, tmp)
+        else:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+    return dest
+
+
+def lookup(content_sha256, suffix='.pdf'):
+    """Return the cached path for ``content_sha256`` or None, marking it recently used."""
+    if not content_sha256:
+        return None
+    path = entry_path(content_sha256, suffix)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    now = time.time()
+    # set explicitly: noatime/relatime mounts do not keep atime current on reads
+    if now - st.st_atime > TOUCH_INTERVAL:
+        try:
+            os.utime(path, (now, st.st_mtime))
+        except OSError:
+            pass
+    return path
+
+
+def store(content_sha256, src, suffix='.pdf', move=True):
+    """Publish ``src`` as the cache entry for ``content_sha256`` and enforce the budget."""
+    dest = publish_atomically(src, entry_path(content_sha256, suffix), move=move)
+    try:
+        _account(os.path.getsize(dest))
+    except OSError:
+        pass  # evicted or replaced already
+    return dest
+
+
+def _account(size):
+    """Add ``size`` stored bytes to the running total; evict once it passes the budget."""
+    global _estimated_total
+    limit = max_bytes()
+    if not limit:
+        return
+    with _evict_lock:
+        if _estimated_total is not None:
+            _estimated_total += size
+            if _estimated_total <= limit:
+                return
+    enforce_budget(limit)
+
+
+def iter_entries():
+    """Yield ``(path, size, last_used)`` for every cache entry."""
+    root = cache_root()
+    try:
+        buckets = list(os.scandir(root))
+    except FileNotFoundError:
+        return
+    for bucket in buckets:
+        if not bucket.is_dir():
+            continue
+        for entry in os.scandir(bucket.path):
+            if entry.name.endswith('.tmp') or not entry.is_file():
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            yield entry.path, st.st_size, max(st.st_atime, st.st_mtime)
+
+
+def enforce_budget(limit=None):
+    """Evict least recently used entries until the cache fits its budget. Returns bytes freed."""
+    global _estimated_total
+    limit = max_bytes() if limit is None else limit
+    if not limit:
+        return 0
+    with _evict_lock:
+        entries = list(iter_entries())
+        total = sum(size for _path, size, _last_used in entries)
+        if total <= limit:
+            _estimated_total = total
+            return 0
+        target = int(limit * LOW_WATER_RATIO)
+        freed = 0
+        for path, size, _last_used in sorted(entries, key=lambda e: e[2]):
+            if total - freed <= target:
+                break
+            try:
+                os.remove(path)
+                freed += size
+            except FileNotFoundError:
+                pass
+            except OSError:
+                logger.warning('Could not evict preview cache entry %s', path, exc_info=True)
+        _estimated_total = total - freed
+        logger.info('Preview cache evicted %.1f MB', freed / 1048576.0)
+        return freed
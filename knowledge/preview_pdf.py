@@ -0,0 +1,196 @@
+"""Post-processing of converted preview PDFs for quick display in the browser.
+
+``soffice`` output is neither linearized nor size-conscious: a 300-slide deck
+arrives as one large PDF the viewer must download before page one shows. Each
+converted preview is therefore
+
+* cut to ``PREVIEW_MAX_PAGES`` pages (a banner links to the full document),
+* rewritten with images downsampled to ``PREVIEW_IMAGE_DPI`` (Ghostscript),
+* linearized ("fast web view") so page one renders from the first bytes (qpdf,
+  or Ghostscript's ``-dFastWebView``).
+
+Every tool is optional; PyMuPDF covers page trimming and compression when the
+command line tools are missing, and with nothing installed the PDF is kept as
+converted. Steps that fail fall back to the previous output.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+
+from django.conf import settings
+
+from . import preview_cache
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:  # optional
+    fitz = None
+
+logger = logging.getLogger(__name__)
+
+META_SUFFIX = '.meta.json'
+TOOL_TIMEOUT = 120
+
+
+def max_pages():
+    return getattr(settings, 'PREVIEW_MAX_PAGES', 30)
+
+
+def image_dpi():
+    return getattr(settings, 'PREVIEW_IMAGE_DPI', 150)
+
+
+def _run(cmd):
+    try:
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True, timeout=TOOL_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        logger.warning('%s failed', cmd[0], exc_info=True)
+        return None
+    if proc.returncode not in (0, 3):  # qpdf exits 3 on warnings with usable output
+        logger.warning('%s exit=%s: %s', cmd[0], proc.returncode, proc.stderr[:500])
+        return None
+    return proc.stdout
+
+
+def count_pages(path):
+    """Number of pages in the PDF at ``path``, or None if no tool can tell."""
+    if fitz is not None:
+        try:
+            with fitz.open(path) as doc:
+                return doc.page_count
+        except Exception:
+            logger.warning('PyMuPDF could not open %s', path, exc_info=True)
+    qpdf = shutil.which('qpdf')
+    if qpdf:
+        out = _run([qpdf, '--show-npages', path])
+        if out and out.strip().isdigit():
+            return int(out.strip())
+    pdfinfo = shutil.which('pdfinfo')
+    if pdfinfo:
+        match = re.search(r'^Pages:\s+(\d+)', _run([pdfinfo, path]) or '', re.M)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def _ghostscript(src, dest, last_page):
+    gs = shutil.which('gs') or shutil.which('gswin64c')
+    if not gs:
+        return False
+    dpi = image_dpi()
+    cmd = [
+        gs, '-q', '-dNOPAUSE', '-dBATCH', '-dSAFER', '-sDEVICE=pdfwrite',
+        '-dPDFSETTINGS=/ebook', '-dDetectDuplicateImages=true', '-dCompressFonts=true',
+        '-dDownsampleColorImages=true', '-dColorImageResolution=%d' % dpi,
+        '-dDownsampleGrayImages=true', '-dGrayImageResolution=%d' % dpi,
+        '-dDownsampleMonoImages=true', '-dMonoImageResolution=%d' % (dpi * 2),
+        '-dFastWebView=true',
+    ]
+    if last_page:
+        cmd += ['-dFirstPage=1', '-dLastPage=%d' % last_page]
+    cmd += ['-sOutputFile=' + dest, src]
+    return _run(cmd) is not None and os.path.exists(dest)
+
+
+def _qpdf_linearize(src, dest, last_page):
+    qpdf = shutil.which('qpdf')
+    if not qpdf:
+        return False
+    cmd = [qpdf, '--linearize', '--object-streams=generate', '--compress-streams=y', src]
+    if last_page:
+        cmd += ['--pages', src, '1-%d' % last_page, '--']
+    cmd.append(dest)
+    return _run(cmd) is not None and os.path.exists(dest)
+
+
+def _pymupdf_rewrite(src, dest, last_page):
+    if fitz is None:
+        return False
+    try:
+        with fitz.open(src) as doc:
+            if last_page:
+                doc.select(range(last_page))
+            try:
+                doc.save(dest, garbage=3, deflate=True, linear=True)
+            except (ValueError, RuntimeError):
+                # recent PyMuPDF releases dropped linearization
+                doc.save(dest, garbage=3, deflate=True)
+    except Exception:
+        logger.warning('PyMuPDF could not rewrite %s', src, exc_info=True)
+        return False
+    return os.path.exists(dest)
+
+
+def optimize(src, workdir):
+    """Return ``(path, pages, total_pages)`` for the web-ready version of the PDF at ``src``.
+
+    ``pages`` is the number of pages kept and ``total_pages`` the number in
+    the converted document (None when unknown, in which case nothing is cut).
+    """
+    total = count_pages(src)
+    budget = max_pages()
+    last_page = budget if budget and total and total > budget else None
+    current = src
+    trimmed = False
+    shrunk = os.path.join(workdir, 'preview-gs.pdf')
+    if _ghostscript(current, shrunk, last_page):
+        current, trimmed = shrunk, bool(last_page)
+    linear = os.path.join(workdir, 'preview-linear.pdf')
+    if _qpdf_linearize(current, linear, None if trimmed else last_page):
+        current, trimmed = linear, bool(last_page)
+    elif current == src:
+        rewritten = os.path.join(workdir, 'preview-fitz.pdf')
+        if _pymupdf_rewrite(current, rewritten, last_page):
+            current, trimmed = rewritten, bool(last_page)
+    pages = last_page if trimmed else total
+    logger.info('Preview %s: %s of %s pages, %d -> %d bytes',
+                src, pages, total, os.path.getsize(src), os.path.getsize(current))
+    return current, pages, total
+
+
+def store_preview(content_sha256, src, workdir):
+    """Optimize ``src`` and publish it, with its page counts, in the preview cache.
+
+    The counts are stored first, so a preview that can be found has them;
+    ``lookup_preview`` treats a preview whose counts were evicted as missing.
+    """
+    path, pages, total = optimize(src, workdir)
+    meta = os.path.join(workdir, 'preview' + META_SUFFIX)
+    with open(meta, 'w') as fh:
+        json.dump({'pages': pages, 'total_pages': total}, fh)
+    preview_cache.store(content_sha256, meta, suffix=META_SUFFIX)
+    dest = preview_cache.store(content_sha256, path)
+    if path != src and os.path.exists(src):
+        os.remove(src)
+    return dest
+
+
+def lookup_preview(content_sha256):
+    """Cached preview PDF of ``content_sha256``, or None when it or its page counts are missing.
+
+    The counts are a separate cache entry; without them a cut preview would
+    show no banner, so the preview is rebuilt instead.
+    """
+    if not preview_cache.lookup(content_sha256, suffix=META_SUFFIX):
+        return None
+    return preview_cache.lookup(content_sha256)
+
+
+def preview_info(content_sha256):
+    """``{'pages': n, 'total_pages': m}`` for a cached preview, or None if not recorded."""
+    path = preview_cache.lookup(content_sha256, suffix=META_SUFFIX)
+    if not path:
+        return None
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def is_truncated(info):
+    return bool(info and info.get('pages') and info.get('total_pages') and info['pages'] < info['total_pages'])
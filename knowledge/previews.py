@@ -0,0 +1,194 @@
+"""Office -> PDF preview conversion using LibreOffice (soffice)."""
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from app.utils import ensure_content_sha256
+
+from . import preview_cache
+from .preview_pdf import lookup_preview, store_preview
+from .soffice_pool import ConversionTimeout, get_pool
+
+logger = logging.getLogger(__name__)
+
+OFFICE_EXTS = {'.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx'}
+# Previews used to be written next to the upload; such files are adopted into the cache.
+LEGACY_PREVIEW_SUFFIX = '.preview.pdf'
+
+
+def is_office_file(name):
+    return os.path.splitext(name or '')[1].lower() in OFFICE_EXTS
+
+
+def legacy_preview_path(fpath):
+    return fpath + LEGACY_PREVIEW_SUFFIX
+
+
+def find_preview(attachment):
+    """Return a servable preview path for ``attachment``, or None if it still has to be built."""
+    cached = lookup_preview(attachment.content_sha256)
+    if cached:
+        return cached
+    try:
+        legacy = legacy_preview_path(attachment.file.path)
+    except Exception:
+        return None
+    return legacy if os.path.exists(legacy) else None
+
+
+_soffice_path = None
+
+
+def find_soffice():
+    """Locate soffice once per process; a miss is retried on the next call."""
+    global _soffice_path
+    if _soffice_path is None:
+        _soffice_path = _locate_soffice()
+    return _soffice_path
+
+
+def _locate_soffice():
+    # Try PATH first, then common install locations
+    soffice = shutil.which('soffice')
+    if soffice:
+        return soffice
+    # common Windows path
+    win_path = r"C:\Program Files\LibreOffice\program\soffice.exe"
+    if os.path.exists(win_path):
+        return win_path
+    # specific older install folder (user-provided)
+    win_path_v5 = r"C:\Program Files\LibreOffice 5\program\soffice.exe"
+    if os.path.exists(win_path_v5):
+        return win_path_v5
+
+    win_path_x86 = r"C:\Program Files (x86)\LibreOffice\program\soffice.exe"
+    if os.path.exists(win_path_x86):
+        return win_path_x86
+    # common unix path
+    if os.path.exists('/usr/bin/soffice'):
+        return '/usr/bin/soffice'
+    # try to find any LibreOffice* folder under Program Files
+    try:
+        pf = os.environ.get('ProgramFiles', r'C:\Program Files')
+        for name in os.listdir(pf):
+            if name.lower().startswith('libreoffice'):
+                candidate = os.path.join(pf, name, 'program', 'soffice.exe')
+                if os.path.exists(candidate):
+                    return candidate
+    except Exception:
+        pass
+    return None
+
+
+def generate_preview(attachment, timeout=60):
+    """Make sure the preview cache holds a PDF preview of ``attachment``.
+
+    Identical documents are converted only once: the cache is keyed by the
+    content hash. Returns the cached preview path, or None on failure.
+    """
+    try:
+        fpath = attachment.file.path
+    except Exception:
+        logger.debug('Attachment has no file path')
+        return None
+    if not os.path.exists(fpath):
+        logger.debug('Attachment file not found: %s', fpath)
+        return None
+
+    if not is_office_file(fpath):
+        logger.debug('Not an office file: %s', fpath)
+        return None
+
+    content_hash = ensure_content_sha256(attachment)
+    cached = lookup_preview(content_hash)
+    if cached:
+        return cached
+    legacy = legacy_preview_path(fpath)
+    if not os.path.exists(legacy):
+        legacy = preview_cache.find_reusable(content_hash)
+    soffice = None
+    if not legacy:
+        soffice = find_soffice()
+        if not soffice:
+            logger.warning('soffice not found; cannot convert %s', fpath)
+            return None
+
+    # create temporary output dir to avoid clashes
+    outdir = tempfile.mkdtemp(prefix='soffice-out-')
+    try:
+        if soffice is None:
+            dest = store_preview(content_hash, legacy, outdir)
+            logger.info('Adopted legacy preview %s as %s', legacy, dest)
+            return dest
+        try:
+            src = _convert_pooled(soffice, fpath, outdir, timeout)
+        except ConversionTimeout:
+            # the document hangs LibreOffice; a subprocess would only hang for another full timeout
+            logger.warning('Pooled conversion of %s timed out', fpath)
+            return None
+        if src is None:
+            src = _convert_subprocess(soffice, fpath, outdir, timeout)
+        if src is None:
+            return None
+        # page budget, image recompression and linearization for a fast first page
+        dest = store_preview(content_hash, src, outdir)
+        logger.info('Created preview: %s', dest)
+        return dest
+    finally:
+        try:
+            shutil.rmtree(outdir)
+        except Exception:
+            pass
+
+
+def _convert_pooled(soffice, fpath, outdir, timeout):
+    """Convert on a warm listener; None means "use the subprocess path instead".
+
+    Raises ``ConversionTimeout`` when the document hung the listener.
+    """
+    pool = get_pool(soffice)
+    if pool is None:
+        return None
+    out = os.path.join(outdir, os.path.splitext(os.path.basename(fpath))[0] + '.pdf')
+    start = time.time()
+    try:
+        pool.convert(fpath, out, timeout=timeout)
+    except ConversionTimeout:
+        raise
+    except Exception:
+        logger.warning('Pooled conversion failed for %s; falling back to soffice subprocess', fpath, exc_info=True)
+        return None
+    logger.info('Pooled conversion of %s took %.2fs', fpath, time.time() - start)
+    return out if os.path.exists(out) else None
+
+
+def _convert_subprocess(soffice, fpath, outdir, timeout):
+    base = os.path.splitext(os.path.basename(fpath))[0]
+    # a private profile per call: with the shared default one, a concurrent
+    # soffice hands its document to the running instance and exits without output
+    profile_dir = tempfile.mkdtemp(prefix='soffice-profile-')
+    profile_url = 'file:///' + profile_dir.replace(os.sep, '/').lstrip('/')
+    cmd = [soffice, '--headless', '-env:UserInstallation=%s' % profile_url,
+           '--convert-to', 'pdf', '--outdir', outdir, fpath]
+    logger.info('Running soffice for %s, cmd=%s', fpath, cmd)
+    start = time.time()
+    try:
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.exception('soffice timed out for %s', fpath)
+        return None
+    finally:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+    duration = time.time() - start
+    logger.info('soffice exit=%s duration=%.1fs stdout=%s stderr=%s', proc.returncode, duration, proc.stdout[:1000], proc.stderr[:1000])
+    if proc.returncode != 0:
+        logger.warning('soffice failed for %s', fpath)
+        return None
+    src = os.path.join(outdir, base + '.pdf')
+    if not os.path.exists(src):
+        logger.warning('soffice did not produce expected output: %s', src)
+        return None
+    return src
@@ -0,0 +1,202 @@
+"""Token index backing knowledge item search.
+
+Chinese text has no word boundaries, so CJK runs are indexed as overlapping
+character bigrams (plus unigrams so one-character queries still match).
+Latin text and digits are indexed as lower-cased words together with their
+prefixes from ``MIN_PREFIX_LENGTH`` characters on, so ``proj`` finds
+``project`` (a match inside a word, ``ject``, does not). Each item keeps one
+``KnowledgeSearchToken`` row per distinct token, weighted by the field it came
+from, so a query becomes an indexed ``token IN (...)`` lookup instead of a
+``LIKE '%...%'`` scan over ``knowledge_items``.
+
+Text extracted from attachments (``attachments.extraction``) is indexed the
+same way per file content; an item also matches when one of its attachments
+contains every query token.
+"""
+import re
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Sum, Value, When
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from attachments.models import ExtractedText, ExtractedTextToken
+
+from .models import KnowledgeAttachment, KnowledgeSearchToken
+
+MAX_TOKEN_LENGTH = 32
+# Cap on how often one token may be counted per field, so long repetitive
+# bodies do not drown out title matches.
+MAX_TOKEN_REPEAT = 10
+# shortest Latin word prefix that is indexed (and so can be searched for)
+MIN_PREFIX_LENGTH = 2
+# only the best-ranked matches are listed; the list says so when there are more
+SEARCH_RESULT_LIMIT = 200
+# attachment text ranks like body text
+ATTACHMENT_TEXT_WEIGHT = 1
+FIELD_WEIGHTS = (
+    ('title', 8),
+    ('tags', 4),
+    ('body', 1),
+)
+
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_CJK_RE = re.compile('[%s]' % _CJK)
+_SEGMENT_RE = re.compile('[%s]+|[0-9a-z]+' % _CJK)
+
+
+def _segments(text):
+    return _SEGMENT_RE.findall((text or '').lower())
+
+
+def _bigrams(segment):
+    return [segment[i:i + 2] for i in range(len(segment) - 1)]
+
+
+def index_tokens(text):
+    """Return every token (with repeats) that should be indexed for ``text``."""
+    tokens = []
+    for seg in _segments(text):
+        if _CJK_RE.match(seg):
+            tokens.extend(seg)
+            tokens.extend(_bigrams(seg))
+        else:
+            word = seg[:MAX_TOKEN_LENGTH]
+            tokens.extend(word[:end] for end in range(MIN_PREFIX_LENGTH, len(word)))
+            tokens.append(word)
+    return tokens
+
+
+def query_tokens(text):
+    """Return the distinct tokens a search for ``text`` must match."""
+    tokens = []
+    for seg in _segments(text):
+        if _CJK_RE.match(seg) and len(seg) > 1:
+            tokens.extend(_bigrams(seg))
+        else:
+            tokens.append(seg[:MAX_TOKEN_LENGTH])
+    return list(dict.fromkeys(tokens))
+
+
+def item_token_weights(item):
+    weights = Counter()
+    for field, weight in FIELD_WEIGHTS:
+        counts = Counter(index_tokens(getattr(item, field, '')))
+        for token, count in counts.items():
+            weights[token] += min(count, MAX_TOKEN_REPEAT) * weight
+    return weights
+
+
+def index_item(item):
+    """Replace the index rows of ``item`` with tokens from its current text."""
+    rows = [
+        KnowledgeSearchToken(item_id=item.pk, token=token, weight=weight)
+        for token, weight in item_token_weights(item).items()
+    ]
+    with transaction.atomic():
+        KnowledgeSearchToken.objects.filter(item_id=item.pk).delete()
+        KnowledgeSearchToken.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
+
+
+def _attachment_scores(queryset, terms, limit):
+    """``{item_id: score}`` for items in ``queryset`` with an attachment containing every term."""
+    attachments = KnowledgeAttachment.objects.filter(item__in=queryset.values('pk')).exclude(content_sha256='')
+    texts = (
+        ExtractedTextToken.objects
+        .filter(token__in=terms, text__content_sha256__in=attachments.values('content_sha256'))
+        .values('text_id')
+        .annotate(score=Sum('weight'), hits=Count('token'))
+        .filter(hits__gte=len(terms))
+        .order_by('-score')[:limit]
+    )
+    text_scores = {row['text_id']: row['score'] for row in texts}
+    if not text_scores:
+        return {}
+    sha_scores = {
+        sha: text_scores[text_id]
+        for text_id, sha in ExtractedText.objects.filter(pk__in=list(text_scores)).values_list('id', 'content_sha256')
+    }
+    scores = {}
+    for item_id, sha in attachments.filter(content_sha256__in=list(sha_scores)).values_list('item_id', 'content_sha256'):
+        scores[item_id] = max(scores.get(item_id, 0), sha_scores[sha] * ATTACHMENT_TEXT_WEIGHT)
+    return scores
+
+
+def rank_item_ids(queryset, query, limit=SEARCH_RESULT_LIMIT):
+    """Return ``[(item_id, score), ...]`` for items in ``queryset`` matching every query token."""
+    terms = query_tokens(query)
+    if not terms:
+        return []
+    matches = (
+        KnowledgeSearchToken.objects
+        .filter(token__in=terms, item__in=queryset.values('pk'))
+        .values('item_id')
+        .annotate(score=Sum('weight'), hits=Count('token'))
+        .filter(hits__gte=len(terms))
+        .order_by('-score', 'item_id')[:limit]
+    )
+    scores = Counter({row['item_id']: row['score'] for row in matches})
+    scores.update(_attachment_scores(queryset, terms, limit))
+    return sorted(scores.items(), key=lambda pair: (-pair[1], pair[0]))[:limit]
+
+
+def search_items(queryset, query, limit=SEARCH_RESULT_LIMIT):
+    """Restrict ``queryset`` to items matching ``query``, ordered by relevance.
+
+    Returns ``(queryset, capped)``; ``capped`` is True when more than ``limit``
+    items matched and only the best ``limit`` are kept.
+    """
+    ranked = rank_item_ids(queryset, query, limit=limit + 1)
+    capped = len(ranked) > limit
+    ranked = ranked[:limit]
+    if not ranked:
+        # keep the annotation so callers can still order/paginate on it
+        return queryset.annotate(search_rank=Value(0, output_field=IntegerField())).none(), False
+    order = Case(
+        *[When(pk=item_id, then=position) for position, (item_id, _score) in enumerate(ranked)],
+        output_field=IntegerField(),
+    )
+    matches = queryset.filter(pk__in=[item_id for item_id, _score in ranked]).annotate(search_rank=order)
+    return matches.order_by('search_rank'), capped
+
+
+def _highlight_terms(query):
+    terms = []
+    for seg in _segments(query):
+        terms.append(seg)
+        if _CJK_RE.match(seg) and len(seg) > 2:
+            terms.extend(_bigrams(seg))
+    # longest first so whole phrases win over their bigrams
+    return sorted(set(terms), key=len, reverse=True)
+
+
+def highlight(text, query, width=None):
+    """Return HTML-escaped ``text`` with query matches wrapped in ``<mark>``.
+
+    When ``width`` is given, only a window of about that many characters
+    around the first match is kept.
+    """
+    text = text or ''
+    terms = _highlight_terms(query)
+    if not terms:
+        return escape(text[:width] if width else text)
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    if width:
+        first = pattern.search(text)
+        start = max(0, first.start() - width // 3) if first else 0
+        end = min(len(text), start + width)
+        fragment = text[start:end]
+        prefix = '…' if start > 0 else ''
+        suffix = '…' if end < len(text) else ''
+    else:
+        fragment, prefix, suffix = text, '', ''
+    parts = []
+    pos = 0
+    for match in pattern.finditer(fragment):
+        parts.append(escape(fragment[pos:match.start()]))
+        parts.append('<mark>%s</mark>' % escape(match.group(0)))
+        pos = match.end()
+    parts.append(escape(fragment[pos:]))
+    return mark_safe(prefix + ''.join(parts) + suffix)
@@ -0,0 +1,38 @@
+"""Keep derived knowledge data in step with item changes."""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from attachments.signals import file_post_delete, file_post_save, file_pre_save
+
+from .models import KnowledgeAttachment, KnowledgeItem
+from .search import index_item
+from .tags import SCOPE_FIELDS, invalidate_facets, parse_tags, sync_item_tags
+
+
+@receiver(pre_save, sender=KnowledgeItem, dispatch_uid='knowledge_item_scope')
+def remember_scope(sender, instance, raw=False, **kwargs):
+    # a tagged item changing visibility, department or owner moves its tag counts
+    instance._previous_scope = None
+    if not raw and instance.pk is not None:
+        instance._previous_scope = KnowledgeItem.objects.filter(pk=instance.pk).values_list(*SCOPE_FIELDS).first()
+
+
+@receiver(post_save, sender=KnowledgeItem, dispatch_uid='knowledge_index_item')
+def reindex_item(sender, instance, raw=False, **kwargs):
+    # Deleting an item removes its tokens through the FK cascade.
+    if raw:
+        return
+    index_item(instance)
+    sync_item_tags(instance, getattr(instance, '_previous_scope', None))
+
+
+@receiver(post_delete, sender=KnowledgeItem, dispatch_uid='knowledge_item_deleted')
+def item_deleted(sender, instance, **kwargs):
+    if parse_tags(instance.tags):
+        invalidate_facets()
+
+
+# Stored files are reference counted across project and knowledge attachments.
+pre_save.connect(file_pre_save, sender=KnowledgeAttachment, dispatch_uid='knowledge_attachment_file_pre_save')
+post_save.connect(file_post_save, sender=KnowledgeAttachment, dispatch_uid='knowledge_attachment_file_post_save')
+post_delete.connect(file_post_delete, sender=KnowledgeAttachment, dispatch_uid='knowledge_attachment_file_post_delete')
@@ -0,0 +1,308 @@
+"""Pool of warm headless LibreOffice listeners for preview conversion.
+
+Starting ``soffice`` dominates the cost of a one-off ``--convert-to`` call, so
+long-running processes (the preview worker) keep a few listeners alive and
+send documents to them over UNO. Each listener is recycled after
+``PREVIEW_POOL_MAX_CONVERSIONS`` documents or when its resident memory passes
+``PREVIEW_POOL_MAX_RSS_MB``, and is health-checked before use.
+
+The pool needs LibreOffice's Python bridge (``import uno``, shipped as
+python3-uno / LibreOffice's bundled Python). When it is unavailable
+``get_pool()`` returns ``None`` and callers fall back to the subprocess path.
+"""
+import atexit
+import logging
+import multiprocessing.util
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+except Exception:  # pragma: no cover - depends on the LibreOffice install
+    uno = None
+    PropertyValue = None
+
+logger = logging.getLogger(__name__)
+
+PDF_FILTERS = {
+    '.doc': 'writer_pdf_Export',
+    '.docx': 'writer_pdf_Export',
+    '.xls': 'calc_pdf_Export',
+    '.xlsx': 'calc_pdf_Export',
+    '.ppt': 'impress_pdf_Export',
+    '.pptx': 'impress_pdf_Export',
+}
+
+
+class PoolUnavailable(Exception):
+    """Raised when no healthy listener could serve a conversion."""
+
+
+class ConversionTimeout(Exception):
+    """The document did not convert in time; its listener was killed and restarted."""
+
+
+def _props(**values):
+    result = []
+    for name, value in values.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        result.append(prop)
+    return tuple(result)
+
+
+def _rss_bytes(pid):
+    """Resident memory of ``pid`` and its children, or None when unknown."""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            proc = psutil.Process(pid)
+            return sum(p.memory_info().rss for p in [proc] + proc.children(recursive=True))
+        except Exception:
+            return None
+    # Linux fallback: the soffice launcher execs soffice.bin as a child
+    total = 0
+    pending = [pid]
+    seen = set()
+    while pending:
+        current = pending.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        try:
+            with open('/proc/%d/status' % current) as fh:
+                for line in fh:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            task_dir = '/proc/%d/task' % current
+            for tid in os.listdir(task_dir):
+                with open(os.path.join(task_dir, tid, 'children')) as fh:
+                    pending.extend(int(child) for child in fh.read().split())
+        except (OSError, ValueError):
+            if current == pid:
+                return None
+    return total
+
+
+class _Listener:
+    """One headless soffice process accepting UNO connections on a named pipe."""
+
+    def __init__(self, soffice, name):
+        self.soffice = soffice
+        self.name = name
+        self.profile_dir = tempfile.mkdtemp(prefix='soffice-pool-')
+        self.proc = None
+        self.desktop = None
+        self.conversions = 0
+
+    @property
+    def connect_string(self):
+        return 'pipe,name=%s;urp;StarOffice.ComponentContext' % self.name
+
+    def start(self, timeout=30):
+        profile_url = 'file:///' + self.profile_dir.replace(os.sep, '/').lstrip('/')
+        cmd = [
+            self.soffice, '--headless', '--invisible', '--nologo', '--norestore', '--nodefault',
+            '--nolockcheck', '--accept=%s' % self.connect_string,
+            '-env:UserInstallation=%s' % profile_url,
+        ]
+        # own process group, so kill() also reaches the soffice.bin child
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                     start_new_session=os.name == 'posix')
+        self.conversions = 0
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.proc.poll() is not None:
+                break
+            try:
+                self._connect()
+                logger.info('soffice listener %s ready (pid=%s)', self.name, self.proc.pid)
+                return
+            except Exception:
+                time.sleep(0.25)
+        self.stop()
+        raise PoolUnavailable('soffice listener %s did not start' % self.name)
+
+    def _connect(self):
+        local_ctx = uno.getComponentContext()
+        resolver = local_ctx.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local_ctx)
+        ctx = resolver.resolve('uno:%s' % self.connect_string)
+        self.desktop = ctx.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', ctx)
+
+    def healthy(self):
+        if self.proc is None or self.proc.poll() is not None:
+            return False
+        try:
+            self._connect()
+            return True
+        except Exception:
+            return False
+
+    def rss_bytes(self):
+        return _rss_bytes(self.proc.pid) if self.proc else None
+
+    def convert(self, src, dest, filter_name):
+        doc = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(os.path.abspath(src)), '_blank', 0,
+            _props(Hidden=True, ReadOnly=True),
+        )
+        if doc is None:
+            raise RuntimeError('LibreOffice could not open %s' % src)
+        try:
+            doc.storeToURL(uno.systemPathToFileUrl(os.path.abspath(dest)), _props(FilterName=filter_name))
+        finally:
+            doc.close(True)
+        self.conversions += 1
+
+    def stop(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.proc is not None:
+            try:
+                self.proc.wait(timeout=5)
+            except Exception:
+                self.kill()
+            self.proc = None
+
+    def kill(self):
+        """Kill the process without talking to it (a hung soffice does not answer UNO calls)."""
+        self.desktop = None
+        if self.proc is None:
+            return
+        try:
+            if os.name == 'posix':
+                os.killpg(self.proc.pid, signal.SIGKILL)
+            else:
+                self.proc.kill()
+        except OSError:
+            pass  # already gone
+        try:
+            self.proc.wait(timeout=5)
+        except Exception:
+            pass
+        self.proc = None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def close(self):
+        self.stop()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+
+class ConverterPool:
+    def __init__(self, soffice, size=2, max_conversions=200, max_rss_mb=1024):
+        self.soffice = soffice
+        self.size = size
+        self.max_conversions = max_conversions
+        self.max_rss = max_rss_mb * 1024 * 1024 if max_rss_mb else None
+        self.listeners = [_Listener(soffice, 'hhg-preview-%d-%d' % (os.getpid(), n)) for n in range(size)]
+        self.idle = queue.Queue()
+        for listener in self.listeners:
+            self.idle.put(listener)
+
+    def _needs_recycle(self, listener):
+        if self.max_conversions and listener.conversions >= self.max_conversions:
+            return True
+        if self.max_rss:
+            rss = listener.rss_bytes()
+            if rss is not None and rss > self.max_rss:
+                logger.info('Recycling soffice listener %s at %.0f MB', listener.name, rss / 1048576.0)
+                return True
+        return False
+
+    def convert(self, src, dest, timeout=60):
+        """Convert ``src`` to a PDF at ``dest`` on a pooled listener."""
+        filter_name = PDF_FILTERS.get(os.path.splitext(src)[1].lower())
+        if not filter_name:
+            raise ValueError('unsupported file type: %s' % src)
+        try:
+            listener = self.idle.get(timeout=timeout)
+        except queue.Empty:
+            raise PoolUnavailable('no idle soffice listener')
+        try:
+            if not listener.healthy():
+                listener.restart()
+            done = threading.Event()
+            errors = []
+
+            def work():
+                try:
+                    listener.convert(src, dest, filter_name)
+                except Exception as exc:
+                    errors.append(exc)
+                finally:
+                    done.set()
+
+            threading.Thread(target=work, daemon=True).start()
+            if not done.wait(timeout):
+                # a hung document: kill the listener (its UNO calls in ``work`` then
+                # fail) and start a fresh one before it goes back to the idle queue
+                logger.warning('soffice listener %s timed out on %s', listener.name, src)
+                listener.kill()
+                try:
+                    listener.start()
+                except PoolUnavailable:
+                    logger.warning('soffice listener %s did not restart', listener.name, exc_info=True)
+                raise ConversionTimeout('conversion of %s timed out after %ss' % (src, timeout))
+            if errors:
+                raise errors[0]
+            if self._needs_recycle(listener):
+                listener.restart()
+            return dest
+        finally:
+            self.idle.put(listener)
+
+    def health(self):
+        """Return ``[(name, healthy, conversions, rss_bytes), ...]`` for every listener."""
+        return [
+            (listener.name, listener.healthy(), listener.conversions, listener.rss_bytes())
+            for listener in self.listeners
+        ]
+
+    def close(self):
+        for listener in self.listeners:
+            listener.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(soffice):
+    """Return the process-wide pool, or None when pooling is disabled or unsupported."""
+    global _pool
+    size = getattr(settings, 'PREVIEW_POOL_SIZE', 0)
+    if uno is None or not size or not soffice:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConverterPool(
+                soffice,
+                size=size,
+                max_conversions=getattr(settings, 'PREVIEW_POOL_MAX_CONVERSIONS', 200),
+                max_rss_mb=getattr(settings, 'PREVIEW_POOL_MAX_RSS_MB', 1024),
+            )
+            atexit.register(_pool.close)
+            # pool worker processes (generate_previews --jobs) skip atexit handlers
+            multiprocessing.util.Finalize(None, _pool.close, exitpriority=10)
+        return _pool
@@ -0,0 +1,116 @@
+"""Normalized tags of knowledge items and per-scope facet counts.
+
+Users still type tags as one comma separated string (``KnowledgeItem.tags``);
+on save the string is split into ``KnowledgeTag`` rows linked through
+``KnowledgeItem.tag_set``, so filtering by tag is an exact indexed join.
+
+Facet counts are cached per visibility scope. Visibility values are disjoint,
+so what a user sees is the sum of three independently cached parts: public
+items, items of their department and their own private items. A change that
+can alter a count (an item's tag set, or the scope of a tagged item) bumps a
+generation number in the shared cache, which retires every cached count; edits
+that touch neither leave the counts alone.
+"""
+import hashlib
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from .models import KnowledgeItem, KnowledgeTag
+
+MAX_TAG_LENGTH = 64
+FACET_LIMIT = 30
+GENERATION_KEY = 'knowledge:tag-facets:gen'
+SCOPE_KEY = 'knowledge:tag-facets:%s:%s'
+SCOPE_FIELDS = ('visibility', 'department', 'owner_id')
+
+_SPLIT_RE = re.compile(r'[,，;；、\n]+')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_tag(text):
+    return _SPACE_RE.sub(' ', (text or '').strip()).lower()[:MAX_TAG_LENGTH]
+
+
+def parse_tags(text):
+    """Split a tag string into distinct normalized names, keeping their order."""
+    names = (normalize_tag(part) for part in _SPLIT_RE.split(text or ''))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def facet_scope(item):
+    """The fields that decide which facet counts ``item`` is part of."""
+    return tuple(getattr(item, field) for field in SCOPE_FIELDS)
+
+
+def sync_item_tags(item, previous_scope=None):
+    """Point ``item.tag_set`` at the tags named in ``item.tags``.
+
+    ``previous_scope`` is ``facet_scope`` of the item before this save (None
+    for a new item); cached counts are retired only when they can change.
+    """
+    names = parse_tags(item.tags)
+    with transaction.atomic():
+        changed = set(item.tag_set.values_list('name', flat=True)) != set(names)
+        if changed:
+            existing = set(KnowledgeTag.objects.filter(name__in=names).values_list('name', flat=True))
+            KnowledgeTag.objects.bulk_create(
+                [KnowledgeTag(name=name) for name in names if name not in existing],
+                ignore_conflicts=True,
+            )
+            item.tag_set.set(KnowledgeTag.objects.filter(name__in=names))
+    moved = bool(names) and previous_scope is not None and tuple(previous_scope) != facet_scope(item)
+    if changed or moved:
+        invalidate_facets()
+
+
+def _generation():
+    gen = cache.get(GENERATION_KEY)
+    if gen is None:
+        gen = 1
+        cache.add(GENERATION_KEY, gen, None)
+    return gen
+
+
+def invalidate_facets():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def _scope_counts(scope, items):
+    key = SCOPE_KEY % (_generation(), scope)
+    counts = cache.get(key)
+    if counts is None:
+        Link = KnowledgeItem.tag_set.through
+        counts = dict(
+            Link.objects
+            .filter(knowledgeitem__in=items.values('pk'))
+            .values_list('knowledgetag__name')
+            .annotate(n=Count('knowledgeitem'))
+        )
+        cache.set(key, counts, getattr(settings, 'KNOWLEDGE_TAG_FACET_TIMEOUT', 600))
+    return counts
+
+
+def tag_facets(identity, limit=FACET_LIMIT):
+    """Return ``[(tag name, item count), ...]`` over the items ``identity`` may see."""
+    items = KnowledgeItem.objects.all()
+    totals = Counter(_scope_counts('public', items.filter(visibility=KnowledgeItem.VISIBILITY_PUBLIC)))
+    if identity.department_name:
+        # hashed so arbitrary department names are safe in cache keys
+        digest = hashlib.md5(identity.department_name.encode('utf-8')).hexdigest()
+        totals.update(_scope_counts(
+            'department:%s' % digest,
+            items.filter(visibility=KnowledgeItem.VISIBILITY_DEPT, department=identity.department_name),
+        ))
+    totals.update(_scope_counts(
+        'private:%s' % identity.user_id,
+        items.filter(visibility=KnowledgeItem.VISIBILITY_PRIVATE, owner_id=identity.user_id),
+    ))
+    return sorted(totals.items(), key=lambda pair: (-pair[1], pair[0]))[:limit]
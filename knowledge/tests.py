@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import zipfile
+from io import BytesIO
+
+from django.test import SimpleTestCase
+
+from . import preview_cache
+from .html_preview import Unsupported, _check_members
+from .models import KnowledgeAttachment
+from .preview_pdf import META_SUFFIX, lookup_preview
+from .search import highlight, index_tokens, query_tokens
+from .thumbnails import THUMB_SUFFIX, cached_thumbnail
+
+
+class TokenizerTests(SimpleTestCase):
+    def test_latin_words_are_indexed_with_prefixes(self):
+        self.assertEqual(index_tokens('Project'), ['pr', 'pro', 'proj', 'proje', 'projec', 'project'])
+
+    def test_prefix_query_matches_indexed_word(self):
+        self.assertTrue(set(query_tokens('PROJ')) <= set(index_tokens('project plan')))
+
+    def test_single_letters_are_not_prefixes(self):
+        self.assertEqual(index_tokens('a b'), ['a', 'b'])
+
+    def test_cjk_runs_are_unigrams_and_bigrams(self):
+        self.assertEqual(index_tokens('知识库'), ['知', '识', '库', '知识', '识库'])
+        self.assertEqual(query_tokens('知识库'), ['知识', '识库'])
+
+    def test_highlight_marks_prefix_inside_word(self):
+        self.assertEqual(str(highlight('Project <x>', 'proj')), '<mark>Proj</mark>ect &lt;x&gt;')
+
+
+class PreviewCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        override = self.settings(PREVIEW_CACHE_ROOT=self.root, PREVIEW_CACHE_MAX_BYTES=0)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_lookup_marks_use_without_changing_mtime(self):
+        src = os.path.join(self.root, 'src.pdf')
+        with open(src, 'wb') as fh:
+            fh.write(b'%PDF')
+        path = preview_cache.store('a' * 64, src)
+        os.utime(path, (1000, 1000))
+        self.assertEqual(preview_cache.lookup('a' * 64), path)
+        st = os.stat(path)
+        self.assertEqual(st.st_mtime, 1000)
+        self.assertGreater(st.st_atime, 1000)
+
+    def test_cached_thumbnail_takes_hash_from_blob_name(self):
+        src = os.path.join(self.root, 'page.png')
+        with open(src, 'wb') as fh:
+            fh.write(b'png')
+        path = preview_cache.store('b' * 64, src, suffix=THUMB_SUFFIX)
+        blob = KnowledgeAttachment(file='blobs/bb/bb/%s.pdf' % ('b' * 64))
+        self.assertEqual(cached_thumbnail(blob), path)
+        # a file outside the blob store is never hashed in the request
+        self.assertIsNone(cached_thumbnail(KnowledgeAttachment(file='knowledge/2020/01/01/a.pdf')))
+
+    def test_preview_without_page_counts_is_a_miss(self):
+        src = os.path.join(self.root, 'src.pdf')
+        with open(src, 'wb') as fh:
+            fh.write(b'%PDF')
+        path = preview_cache.store('c' * 64, src)
+        self.assertIsNone(lookup_preview('c' * 64))
+        with open(src, 'w') as fh:
+            fh.write('{"pages": 30, "total_pages": 80}')
+        preview_cache.store('c' * 64, src, suffix=META_SUFFIX)
+        self.assertEqual(lookup_preview('c' * 64), path)
+
+
+class HtmlPreviewMemberTests(SimpleTestCase):
+    def _zip(self, *names):
+        buf = BytesIO()
+        with zipfile.ZipFile(buf, 'w') as zf:
+            for name in names:
+                zf.writestr(name, '')
+        return zipfile.ZipFile(buf)
+
+    def test_cell_comments_are_allowed(self):
+        zf = self._zip('xl/workbook.xml', 'xl/drawings/vmlDrawing1.vml', 'xl/drawings/_rels/vmlDrawing1.vml.rels')
+        _check_members(zf, ('xl/charts/', 'xl/drawings/', 'xl/embeddings/'))
+
+    def test_drawings_are_rejected(self):
+        zf = self._zip('xl/workbook.xml', 'xl/drawings/drawing1.xml')
+        with self.assertRaises(Unsupported):
+            _check_members(zf, ('xl/charts/', 'xl/drawings/', 'xl/embeddings/'))
@@ -0,0 +1,144 @@
+"""First-page thumbnails of PDF and Office attachments.
+
+List and detail pages show a small PNG of the first page and load the full
+document only on click. Thumbnails live in the preview cache next to the PDF
+previews (same content-hash key, ``.thumb.png`` suffix), so identical files
+share one thumbnail and the cache budget covers both.
+
+Thumbnails are rendered by the preview worker (``PreviewJob`` of kind
+``thumbnail``), never in a request: views serve ``cached_thumbnail`` and, on a
+miss, queue a job and answer with ``PENDING_SVG``. Pages are rasterised
+in-process with PyMuPDF when it is installed, otherwise with poppler's
+``pdftoppm``. Office files are thumbnailed from their PDF preview, so they get
+a thumbnail once the preview worker has converted them.
+"""
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from app.utils import ensure_content_sha256
+from attachments.storage import sha256_from_name
+
+from . import preview_cache
+from .previews import find_preview, is_office_file
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:  # optional; fall back to pdftoppm
+    fitz = None
+
+logger = logging.getLogger(__name__)
+
+THUMB_SUFFIX = '.thumb.png'
+DOCUMENT_EXTS = {'.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx'}
+# shown while the worker renders the real thumbnail
+PENDING_SVG = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="240" height="180" viewBox="0 0 240 180">'
+    '<rect width="240" height="180" fill="#f3f4f6"/>'
+    '<text x="120" y="96" font-family="sans-serif" font-size="14" fill="#9ca3af" text-anchor="middle">'
+    '缩略图生成中…</text></svg>'
+)
+
+
+def thumbnail_width():
+    return getattr(settings, 'THUMBNAIL_WIDTH', 240)
+
+
+def is_document(name):
+    return os.path.splitext(name or '')[1].lower() in DOCUMENT_EXTS
+
+
+def _render_pymupdf(pdf_path, dest, width):
+    doc = fitz.open(pdf_path)
+    try:
+        page = doc[0]
+        zoom = width / float(page.rect.width or width)
+        page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False).save(dest)
+    finally:
+        doc.close()
+    return dest
+
+
+def _render_pdftoppm(pdf_path, dest, width, timeout=30):
+    pdftoppm = shutil.which('pdftoppm')
+    if not pdftoppm:
+        return None
+    base = os.path.splitext(dest)[0]
+    cmd = [pdftoppm, '-png', '-f', '1', '-l', '1', '-singlefile',
+           '-scale-to-x', str(width), '-scale-to-y', '-1', pdf_path, base]
+    try:
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.warning('pdftoppm timed out for %s', pdf_path)
+        return None
+    if proc.returncode != 0:
+        logger.warning('pdftoppm failed for %s: %s', pdf_path, proc.stderr[:500])
+        return None
+    out = base + '.png'
+    return out if os.path.exists(out) else None
+
+
+def render_thumbnail(content_sha256, pdf_path):
+    """Rasterise page one of ``pdf_path`` into the cache entry for ``content_sha256``."""
+    outdir = tempfile.mkdtemp(prefix='thumb-')
+    try:
+        out = os.path.join(outdir, 'page.png')
+        try:
+            if fitz is not None:
+                out = _render_pymupdf(pdf_path, out, thumbnail_width())
+            else:
+                out = _render_pdftoppm(pdf_path, out, thumbnail_width())
+        except Exception:
+            logger.warning('Could not render thumbnail of %s', pdf_path, exc_info=True)
+            return None
+        if not out:
+            return None
+        return preview_cache.store(content_sha256, out, suffix=THUMB_SUFFIX)
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+
+
+def cached_thumbnail(attachment):
+    """Return the cached thumbnail path of ``attachment`` or None, without hashing or rendering.
+
+    The content hash comes from the row or from the blob name; files with
+    neither are hashed by the worker.
+    """
+    content_hash = attachment.content_sha256 or sha256_from_name(attachment.file.name)
+    return preview_cache.lookup(content_hash, THUMB_SUFFIX) if content_hash else None
+
+
+def pending_thumbnail_response():
+    response = HttpResponse(PENDING_SVG, content_type='image/svg+xml')
+    # the real thumbnail will be served at the same URL
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def thumbnail_for(attachment):
+    """Return the thumbnail path of a PDF/Office ``attachment``, rendering it if needed.
+
+    Hashes and rasterises, so it runs in the preview worker and backfills.
+    Works for any model with ``file`` and ``content_sha256`` fields. Returns
+    None when the file is not a document or, for Office files, when the PDF
+    preview has not been generated yet.
+    """
+    try:
+        fpath = attachment.file.path
+    except Exception:
+        return None
+    if not is_document(fpath) or not os.path.exists(fpath):
+        return None
+    content_hash = ensure_content_sha256(attachment)
+    cached = preview_cache.lookup(content_hash, THUMB_SUFFIX)
+    if cached:
+        return cached
+    pdf_path = find_preview(attachment) if is_office_file(fpath) else fpath
+    if not pdf_path:
+        return None
+    return render_thumbnail(content_hash, pdf_path)
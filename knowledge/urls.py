@@ -7,4 +7,5 @@ urlpatterns = [
     path('<int:pk>/', views.view_item, name='knowledge_detail'),
     path('<int:pk>/delete/', views.delete_item, name='knowledge_delete'),
     path('<int:pk>/attachment/<int:aid>/', views.attachment_serve, name='knowledge_attachment_serve'),
+    path('<int:pk>/attachment/<int:aid>/thumbnail/', views.attachment_thumbnail, name='knowledge_attachment_thumbnail'),
 ]
@@ -1,27 +1,38 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.urls import reverse
-from django.db.models import Q, Count, OuterRef, Subquery
+from django.db import transaction
+from django.db.models import Q, OuterRef, Subquery
 from projects.models import Department
 from app.models import UserProfile
 
-from .models import KnowledgeItem, KnowledgeAttachment
+from .models import KnowledgeItem, KnowledgeAttachment, PreviewJob
 from .forms import KnowledgeItemForm
+from .search import SEARCH_RESULT_LIMIT, highlight, search_items
+from .tags import normalize_tag, tag_facets
+from .jobs import enqueue_job, enqueue_preview, enqueue_thumbnail
+from .previews import OFFICE_EXTS, find_preview, is_office_file
+from .preview_pdf import is_truncated, preview_info
+from .html_preview import cached_fast_preview
+from .thumbnails import cached_thumbnail, is_document, pending_thumbnail_response
+from app.fileserve import deliver_file
+from app.identity import get_identity
+from app.pagination import keyset_paginate, page_querystring
 from app.utils import build_base_context
 from django.conf import settings
-from app.models import AppUser
 from django.views.decorators.http import require_POST
 from django.views.decorators.clickjacking import xframe_options_exempt
 import os
-from django.http import FileResponse, Http404, HttpResponse
+from django.http import Http404, HttpResponse
+from django.utils.html import escape
 from attachments.models import Attachment as GenericAttachment
+from attachments.extraction import extract_after_upload
+from attachments.uploads import UploadError, claim_upload
 from django.views.decorators.clickjacking import xframe_options_exempt
-import shutil
-import subprocess
-import tempfile
-import time
-import logging
-import pathlib
+
+
+# newest first; id breaks ties so the keyset cursor is unique
+KNOWLEDGE_LIST_ORDERING = ('-updated_at', 'id')
 
 
 def _require_login(request):
@@ -30,39 +41,78 @@ def _require_login(request):
         return None, redirect('login')
     session_ctx = build_base_context(request)
     session_ctx['user_id'] = user_id
+    # department and permission flags, resolved once per request (see app.identity)
+    session_ctx['identity'] = get_identity(request)
     return session_ctx, None
 
 
-def visible_items_for_user(user_id):
+def visible_items_for_user(identity):
     q = Q(visibility=KnowledgeItem.VISIBILITY_PUBLIC)
-    # read department from UserProfile (projects.Department FK)
-    profile = UserProfile.objects.select_related('department').filter(user_id=user_id).first()
-    user_dept_name = None
-    if profile and profile.department:
-        user_dept_name = profile.department.name
-    if user_dept_name:
-        q |= Q(visibility=KnowledgeItem.VISIBILITY_DEPT, department=user_dept_name)
-    user = AppUser.objects.filter(pk=user_id).first()
-    if user:
-        q |= Q(visibility=KnowledgeItem.VISIBILITY_PRIVATE, owner=user)
+    if identity.department_name:
+        q |= Q(visibility=KnowledgeItem.VISIBILITY_DEPT, department=identity.department_name)
+    q |= Q(visibility=KnowledgeItem.VISIBILITY_PRIVATE, owner_id=identity.user_id)
     return KnowledgeItem.objects.filter(q)
 
 
+def can_view_item(item, identity):
+    if item.owner_id == identity.user_id or item.visibility == KnowledgeItem.VISIBILITY_PUBLIC:
+        return True
+    if item.visibility == KnowledgeItem.VISIBILITY_DEPT:
+        return bool(identity.department_name) and identity.department_name == item.department
+    return False
+
+
 def list_items(request):
     session_ctx, redirect_response = _require_login(request)
     if redirect_response:
         return redirect_response
     q = request.GET.get('q')
-    # annotate attachment counts and prefetch attachments to avoid N+1 queries
-    # also annotate uploader's department name via a subquery on UserProfile -> Department
+    tag = normalize_tag(request.GET.get('tag'))
+    # only the columns the list template renders; the first two attachment ids
+    # are enough to choose between a direct download and a link to the detail page
+    attachments = KnowledgeAttachment.objects.filter(item=OuterRef('pk')).order_by('id')
+    attachment_ids = attachments.values('id')
+    # uploader's department name via a subquery on UserProfile -> Department
     profile_qs = UserProfile.objects.filter(user_id=OuterRef('owner_id')).values('department__name')[:1]
-    items = visible_items_for_user(session_ctx['user_id']).annotate(
-        attachments_count=Count('attachments'),
+    fields = ['id', 'title', 'visibility', 'updated_at', 'owner', 'owner__username', 'owner__display_name']
+    if q:
+        fields.append('body')  # for the search snippet
+    items = visible_items_for_user(session_ctx['identity']).select_related('owner').only(*fields).annotate(
+        first_attachment_id=Subquery(attachment_ids[:1]),
+        first_attachment_file=Subquery(attachments.values('file')[:1]),
+        second_attachment_id=Subquery(attachment_ids[1:2]),
         department_name=Subquery(profile_qs),
-    ).prefetch_related('attachments')
+    )
+    if tag:
+        # exact match on the normalized tag table (indexed join, no substring scan)
+        items = items.filter(tag_set__name=tag)
+    search_capped = False
     if q:
-        items = items.filter(Q(title__icontains=q) | Q(body__icontains=q) | Q(tags__icontains=q))
-    context = {**session_ctx, 'items': items}
+        # ranked lookup through the token index instead of LIKE scans
+        items, search_capped = search_items(items, q)
+        ordering = ('search_rank', 'id')
+    else:
+        ordering = KNOWLEDGE_LIST_ORDERING
+    page = keyset_paginate(
+        items, ordering,
+        after=request.GET.get('after'), before=request.GET.get('before'),
+        per_page=getattr(settings, 'KNOWLEDGE_PAGE_SIZE', 20),
+    )
+    if q:
+        for item in page:
+            item.title_highlight = highlight(item.title, q)
+            item.search_snippet = highlight(item.body, q, width=120)
+    context = {
+        **session_ctx,
+        'items': page,
+        'page': page,
+        'next_query': page_querystring(request.GET, after=page.next_cursor, before=None) if page.has_next else '',
+        'previous_query': page_querystring(request.GET, before=page.previous_cursor, after=None) if page.has_previous else '',
+        'tag': tag,
+        'tag_facets': tag_facets(session_ctx['identity']),
+        'search_capped': search_capped,
+        'search_limit': SEARCH_RESULT_LIMIT,
+    }
     return render(request, 'knowledge/list.html', context)
 
 
@@ -73,17 +123,9 @@ def view_item(request, pk):
         return redirect_response
     item = get_object_or_404(KnowledgeItem, pk=pk)
     # permission check
-    if item.visibility == KnowledgeItem.VISIBILITY_PRIVATE and item.owner_id != session_ctx['user_id']:
+    if not can_view_item(item, session_ctx['identity']):
         messages.error(request, '无权查看此条目')
         return redirect('knowledge_list')
-    if item.visibility == KnowledgeItem.VISIBILITY_DEPT:
-        profile = UserProfile.objects.select_related('department').filter(user_id=session_ctx['user_id']).first()
-        user_dept_name = None
-        if profile and profile.department:
-            user_dept_name = profile.department.name
-        if user_dept_name != item.department and item.owner_id != session_ctx['user_id']:
-            messages.error(request, '无权查看此条目')
-            return redirect('knowledge_list')
     context = {**session_ctx, 'item': item}
     return render(request, 'knowledge/detail.html', context)
 
@@ -99,20 +141,32 @@ def create_item(request):
             item.owner_id = session_ctx['user_id']
             # if department not set, try user's department
             if not item.department:
-                profile = UserProfile.objects.select_related('department').filter(user_id=session_ctx['user_id']).first()
-                if profile and profile.department:
-                    item.department = profile.department.name
+                item.department = session_ctx['identity'].department_name
             item.save()
-            # handle attachments
-            files = request.FILES.getlist('attachments')
-            for f in files:
+            # handle attachments: plain multipart files and files sent earlier in chunks
+            new_attachments = []
+            for f in request.FILES.getlist('attachments'):
                 att = KnowledgeAttachment(item=item, file=f, filename=f.name)
                 att.save()
-                # try to generate preview synchronously (will catch/log errors)
+                new_attachments.append(att)
+            for upload_id in request.POST.getlist('upload_ids'):
+                att = KnowledgeAttachment(item=item)
                 try:
-                    _maybe_generate_preview(att)
-                except Exception:
-                    logging.getLogger(__name__).exception('Failed to generate preview for %s', getattr(att, 'filename', None))
+                    # one transaction, so the blob stays locked until it is referenced
+                    with transaction.atomic():
+                        upload = claim_upload(upload_id, session_ctx['user_id'], att)
+                        att.filename = upload.filename
+                        att.save()
+                except UploadError as exc:
+                    messages.error(request, str(exc))
+                    continue
+                new_attachments.append(att)
+            for att in new_attachments:
+                # make the file's text searchable (large files: manage.py extract_text)
+                extract_after_upload(att)
+                # office previews are converted out of band by the preview_worker command
+                if is_office_file(att.file.name):
+                    enqueue_preview(att)
             messages.success(request, '知识条目已保存')
             return redirect('knowledge_list')
     else:
@@ -131,20 +185,45 @@ def attachment_serve(request, pk, aid):
     if redirect_response:
         return redirect_response
     item = get_object_or_404(KnowledgeItem, pk=pk)
-    # permission checks (reuse logic from view_item)
-    if item.visibility == KnowledgeItem.VISIBILITY_PRIVATE and item.owner_id != session_ctx['user_id']:
+    # permission checks (same rule as view_item)
+    if not can_view_item(item, session_ctx['identity']):
         messages.error(request, '无权查看此附件')
         return redirect('knowledge_list')
-    if item.visibility == KnowledgeItem.VISIBILITY_DEPT:
-        profile = UserProfile.objects.select_related('department').filter(user_id=session_ctx['user_id']).first()
-        user_dept_name = None
-        if profile and profile.department:
-            user_dept_name = profile.department.name
-        if user_dept_name != item.department and item.owner_id != session_ctx['user_id']:
-            messages.error(request, '无权查看此附件')
-            return redirect('knowledge_list')
     # fetch attachment
     attachment = get_object_or_404(KnowledgeAttachment, pk=aid, item=item)
+    return attachment_response(request, attachment, download=request.GET.get('download') == '1')
+
+
+def attachment_thumbnail(request, pk, aid):
+    """First-page thumbnail of a PDF/Office attachment.
+
+    A miss queues the worker job that renders it (for Office files, the
+    conversion) and answers with a placeholder; 404 once that job failed.
+    """
+    session_ctx, redirect_response = _require_login(request)
+    if redirect_response:
+        return redirect_response
+    item = get_object_or_404(KnowledgeItem.objects.only('id', 'owner_id', 'visibility', 'department'), pk=pk)
+    if not can_view_item(item, session_ctx['identity']):
+        raise Http404('No thumbnail')
+    attachment = get_object_or_404(KnowledgeAttachment, pk=aid, item=item)
+    if not is_document(attachment.file.name):
+        raise Http404('No thumbnail')
+    path = cached_thumbnail(attachment)
+    if path:
+        return deliver_file(request, path, filename=os.path.basename(path), content_type='image/png')
+    job = enqueue_preview(attachment) if is_office_file(attachment.file.name) else enqueue_thumbnail(attachment)
+    if job.status == PreviewJob.STATUS_FAILED:
+        raise Http404('No thumbnail')
+    return pending_thumbnail_response()
+
+
+def attachment_response(request, attachment, download=False):
+    """Deliver an attachment whose access has already been authorised.
+
+    Office files are shown through their PDF preview unless ``download`` asks
+    for the original.
+    """
     # ensure file exists
     try:
         fpath = attachment.file.path
@@ -152,124 +231,66 @@ def attachment_serve(request, pk, aid):
         raise Http404('File not found')
     if not os.path.exists(fpath):
         raise Http404('File not found')
+    filename = attachment.filename or os.path.basename(fpath)
     # if this is an office file and a preview PDF exists, serve the preview instead
     ext = os.path.splitext(fpath)[1].lower()
-    preview_path = fpath + '.preview.pdf'
-    office_exts = {'.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx'}
-    if ext in office_exts:
-        if os.path.exists(preview_path):
-            response = FileResponse(open(preview_path, 'rb'), as_attachment=False, filename=os.path.basename(preview_path))
+    fast_path, html_pending, job = None, False, None
+    if ext in OFFICE_EXTS and not download:
+        fast_path, html_pending = cached_fast_preview(attachment)
+    if html_pending:
+        # rendered by the preview worker, which queues the PDF conversion if it cannot
+        job = enqueue_job(attachment, PreviewJob.KIND_HTML)
+        if job.status == PreviewJob.STATUS_FAILED:
+            job = None
+    if fast_path:
+        # common docx/xlsx: HTML rendered natively in milliseconds, no LibreOffice round trip
+        response = deliver_file(request, fast_path, filename=filename + '.html',
+                                content_type='text/html; charset=utf-8')
+        response['Content-Security-Policy'] = "default-src 'none'; style-src 'unsafe-inline'"
+    elif ext in OFFICE_EXTS and not download:
+        preview_path = find_preview(attachment)
+        info = preview_info(attachment.content_sha256) if preview_path else None
+        if preview_path and is_truncated(info) and request.GET.get('pdf') != '1':
+            # long document: the preview holds only the first pages; say so above it
+            download_url = reverse('knowledge_attachment_serve', args=[attachment.item_id, attachment.id]) + '?download=1'
+            html = (
+                '<html><head><meta charset="utf-8"><title>文档预览</title></head>'
+                '<body style="margin:0; font-family: sans-serif; display:flex; flex-direction:column; height:100vh;">'
+                '<div style="padding:.5rem 1rem; background:#fff8e1; border-bottom:1px solid #f0d58c;">'
+                f'预览仅显示前 {info["pages"]} 页（共 {info["total_pages"]} 页），'
+                f'<a href="{escape(download_url)}" target="_top" download>下载完整文档 ({escape(filename)})</a>'
+                '</div>'
+                f'<iframe src="{escape(request.path)}?pdf=1" style="flex:1; border:0; width:100%;"></iframe>'
+                '</body></html>'
+            )
+            response = HttpResponse(html)
+            response['Cache-Control'] = 'private, no-cache'
+        elif preview_path:
+            response = deliver_file(request, preview_path, filename=filename + '.preview.pdf')
         else:
-            # Preview not ready yet — return a small HTML page (will render inside iframe)
+            # not converted yet, or evicted from the preview cache: (re)build it out of band
+            job = job or enqueue_preview(attachment)
+            download_url = reverse('knowledge_attachment_serve', args=[attachment.item_id, attachment.id]) + '?download=1'
+            if job.status == PreviewJob.STATUS_FAILED:
+                title, message = '无法预览', '该文件无法生成预览，请下载原始文件查看。'
+            else:
+                # Preview not ready yet — return a small HTML page (will render inside iframe)
+                title, message = '预览生成中…', '正在生成预览，请稍候或点击下面下载原始文件。'
             html = (
-                '<html><head><meta charset="utf-8"><title>预览生成中</title></head>'
+                f'<html><head><meta charset="utf-8"><title>{title}</title></head>'
                 '<body style="font-family: sans-serif; padding: 1rem;">'
-                '<h3>预览生成中…</h3>'
-                '<p>正在生成预览，请稍候或点击下面下载原始文件。</p>'
-                f'<p><a href="{attachment.file.url}" download>下载原始文件 ({attachment.filename or os.path.basename(fpath)})</a></p>'
+                f'<h3>{title}</h3>'
+                f'<p>{message}</p>'
+                f'<p><a href="{escape(download_url)}" target="_top" download>下载原始文件 ({escape(filename)})</a></p>'
                 '</body></html>'
             )
             response = HttpResponse(html)
+            response['Cache-Control'] = 'no-store'
     else:
-        response = FileResponse(open(fpath, 'rb'), as_attachment=False, filename=attachment.filename or os.path.basename(fpath))
+        response = deliver_file(request, fpath, filename=filename, as_attachment=download)
     return response
 
 
-def _find_soffice():
-    # Try PATH first, then common install locations
-    soffice = shutil.which('soffice')
-    if soffice:
-        return soffice
-    # common Windows path
-    win_path = r"C:\Program Files\LibreOffice\program\soffice.exe"
-    if os.path.exists(win_path):
-        return win_path
-    # specific older install folder (user-provided)
-    win_path_v5 = r"C:\Program Files\LibreOffice 5\program\soffice.exe"
-    if os.path.exists(win_path_v5):
-        return win_path_v5
-
-    win_path_x86 = r"C:\Program Files (x86)\LibreOffice\program\soffice.exe"
-    if os.path.exists(win_path_x86):
-        return win_path_x86
-    # common unix path
-    if os.path.exists('/usr/bin/soffice'):
-        return '/usr/bin/soffice'
-    # try to find any LibreOffice* folder under Program Files
-    try:
-        pf = os.environ.get('ProgramFiles', r'C:\Program Files')
-        for name in os.listdir(pf):
-            if name.lower().startswith('libreoffice'):
-                candidate = os.path.join(pf, name, 'program', 'soffice.exe')
-                if os.path.exists(candidate):
-                    return candidate
-    except Exception:
-        pass
-    return None
-
-
-def _maybe_generate_preview(attachment, timeout=60):
-    """Attempt to generate a PDF preview for an attachment using soffice.
-    Generated preview path: original_file_path + '.preview.pdf'
-    Returns path to preview on success, None on failure.
-    """
-    logger = logging.getLogger(__name__)
-    try:
-        fpath = attachment.file.path
-    except Exception:
-        logger.debug('Attachment has no file path')
-        return None
-    if not os.path.exists(fpath):
-        logger.debug('Attachment file not found: %s', fpath)
-        return None
-
-    ext = os.path.splitext(fpath)[1].lower()
-    office_exts = {'.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx'}
-    if ext not in office_exts:
-        logger.debug('Not an office file: %s', fpath)
-        return None
-
-    soffice = _find_soffice()
-    if not soffice:
-        logger.warning('soffice not found; cannot convert %s', fpath)
-        return None
-
-    # create temporary output dir to avoid clashes
-    outdir = tempfile.mkdtemp(prefix='soffice-out-')
-    base = os.path.splitext(os.path.basename(fpath))[0]
-    cmd = [soffice, '--headless', '--convert-to', 'pdf', '--outdir', outdir, fpath]
-    logger.info('Running soffice for %s, cmd=%s', fpath, cmd)
-    start = time.time()
-    try:
-        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, timeout=timeout)
-        duration = time.time() - start
-        logger.info('soffice exit=%s duration=%.1fs stdout=%s stderr=%s', proc.returncode, duration, proc.stdout[:1000], proc.stderr[:1000])
-        if proc.returncode != 0:
-            logger.warning('soffice failed for %s', fpath)
-            return None
-        src = os.path.join(outdir, base + '.pdf')
-        if not os.path.exists(src):
-            logger.warning('soffice did not produce expected output: %s', src)
-            return None
-        dest = fpath + '.preview.pdf'
-        # move/overwrite
-        try:
-            shutil.move(src, dest)
-        except Exception:
-            # fallback to copy
-            shutil.copyfile(src, dest)
-        logger.info('Created preview: %s', dest)
-        return dest
-    except subprocess.TimeoutExpired:
-        logger.exception('soffice timed out for %s', fpath)
-        return None
-    finally:
-        try:
-            shutil.rmtree(outdir)
-        except Exception:
-            pass
-
-
 @require_POST
 def delete_item(request, pk):
     session_ctx, redirect_response = _require_login(request)
@@ -280,12 +301,7 @@ def delete_item(request, pk):
     if item.owner_id != session_ctx['user_id']:
         messages.error(request, '无权删除此条目')
         return redirect('knowledge_list')
-    # delete attachments first (FileFields will be removed by model delete, but remove files if needed)
-    for att in item.attachments.all():
-        try:
-            att.file.delete(save=False)
-        except Exception:
-            pass
+    # attachment rows cascade; their files are released by attachments.signals
     item.delete()
     messages.success(request, '条目已删除')
     return redirect('knowledge_list')
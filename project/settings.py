@@ -73,6 +73,38 @@ DATABASES = {
 
 AUTH_PASSWORD_VALIDATORS = []
 
+# 缓存：必须是所有 Web 进程共享的后端，否则某个进程中的失效（权限变更等）其他进程看不到。
+# 默认使用数据库缓存表（部署时执行 python manage.py createcachetable）；
+# 若有 Memcached，可改为 'django.core.cache.backends.memcached.PyMemcacheCache'（需安装 pymemcache）并设置 LOCATION。
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+        'OPTIONS': {
+            # 默认 300 条，超过后会随机清掉三分之一；按用户缓存的身份和分面计数需要更多
+            'MAX_ENTRIES': 100000,
+        },
+    }
+}
+
+# 用户身份（部门、权限标志）缓存时长（秒）；资料、部门或权限组变更时会主动失效
+IDENTITY_CACHE_TIMEOUT = 300
+
+# 知识库标签分面计数缓存时长（秒）；条目或标签变更时整体失效
+KNOWLEDGE_TAG_FACET_TIMEOUT = 600
+# 知识库列表每页条数（游标分页）
+KNOWLEDGE_PAGE_SIZE = 20
+# 项目列表每页条数（游标分页）
+PROJECT_PAGE_SIZE = 20
+# 项目详情页任务表每页条数（游标分页，后续页按需加载）
+PROJECT_TASK_PAGE_SIZE = 50
+# 任务列表每页条数（游标分页）
+TASK_PAGE_SIZE = 50
+# 批量导入（CSV/XLSX）每批校验并写入的行数
+IMPORT_BATCH_SIZE = 1000
+# 导出（CSV/XLSX）每次查询读取的行数，按游标分批读取并边读边写
+EXPORT_CHUNK_SIZE = 2000
+
 LANGUAGE_CODE = 'zh-hans'
 TIME_ZONE = 'Asia/Shanghai'
 USE_I18N = True
@@ -85,6 +117,47 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# 文件下载方式：'python'（开发环境，由 Django 直接输出）、'nginx'（X-Accel-Redirect）或 'apache'（X-Sendfile）。
+# 使用 nginx 时需配置一个 internal location，将 FILE_DELIVERY_INTERNAL_PREFIX 映射到 MEDIA_ROOT。
+FILE_DELIVERY_BACKEND = 'python'
+FILE_DELIVERY_INTERNAL_PREFIX = '/protected-media/'
+SIGNED_FILE_URL_MAX_AGE = 3600       # 签名链接（iframe 预览等）的有效期（秒）
+
+# Office 预览转换队列（manage.py preview_worker）
+PREVIEW_WORKER_MAX_PER_HOST = 2      # 每台主机同时运行的转换数上限
+PREVIEW_JOB_MAX_ATTEMPTS = 5         # 失败重试次数上限
+PREVIEW_JOB_RETRY_BASE_SECONDS = 30  # 重试退避基数（按 2^n 递增）
+PREVIEW_JOB_LEASE_SECONDS = 600      # 超过该时长仍为 running 的任务视为崩溃并重新排队
+
+# 常驻 LibreOffice 转换进程池（需要 LibreOffice 的 Python UNO 桥接；不可用时回退为逐个启动 soffice）
+PREVIEW_POOL_SIZE = 2                # 每个 worker 进程内的常驻 soffice 数量，0 表示禁用
+PREVIEW_POOL_MAX_CONVERSIONS = 200   # 单个进程转换多少个文档后重启
+PREVIEW_POOL_MAX_RSS_MB = 1024       # 单个进程常驻内存超过该值后重启
+
+# 预览缓存：按源文件内容哈希存放，超出容量时按最近最少使用淘汰，被淘汰的预览在下次访问时重新生成
+PREVIEW_CACHE_ROOT = MEDIA_ROOT / 'preview_cache'
+PREVIEW_CACHE_MAX_BYTES = 5 * 1024 ** 3
+# 预览 PDF 后处理（需 Ghostscript 和/或 qpdf，缺失时可用 PyMuPDF）：截取前若干页、压缩图片并线性化以便首页尽快显示
+PREVIEW_MAX_PAGES = 30               # 预览最多包含的页数（超出时页面顶部提示并提供完整文档下载），0 表示不截取
+PREVIEW_IMAGE_DPI = 150              # 预览中图片的最高分辨率
+# 常见 docx/xlsx 直接生成 HTML 预览（不经 LibreOffice），含图片、图表的文档仍转换为 PDF
+PREVIEW_HTML_MAX_ROWS = 1000         # 每个工作表最多显示的行数
+PREVIEW_HTML_MAX_COLS = 50           # 最多显示的列数（工作表与 Word 表格）
+PREVIEW_HTML_MAX_BLOCKS = 3000       # Word 文档最多显示的段落/表格数
+PREVIEW_HTML_MAX_SOURCE_BYTES = 20 * 1024 ** 2  # 超过该大小的文件直接走 PDF 预览
+# 首页缩略图宽度（像素），缓存在预览缓存目录中
+THUMBNAIL_WIDTH = 240
+
+# 附件全文提取（manage.py extract_text），提取结果按内容哈希去重存储
+TEXT_EXTRACT_MAX_CHARS = 1000000               # 单个文件最多提取的字符数
+TEXT_EXTRACT_INLINE_MAX_BYTES = 2 * 1024 ** 2  # 不超过该大小的文件在上传时立即提取
+
+# 分片断点续传上传（static/js/chunked_upload.js），未完成的分片暂存在 MEDIA_ROOT 下以便完成后直接移动
+CHUNKED_UPLOAD_DIR = MEDIA_ROOT / '.uploads'
+CHUNKED_UPLOAD_MAX_BYTES = 2 * 1024 ** 3      # 单个文件上限
+CHUNKED_UPLOAD_CHUNK_BYTES = 8 * 1024 ** 2    # 每个分片大小
+CHUNKED_UPLOAD_EXPIRE_HOURS = 24              # 超过该时长未继续的上传由 expire_uploads 命令清理
+
 # Prefer the C driver (mysqlclient) when available. Fall back to PyMySQL only if
 # mysqlclient isn't installed. This avoids PyMySQL from masking mysqlclient when
 # both are present (which causes Django to see the wrong DB API version).
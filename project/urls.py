@@ -1,7 +1,5 @@
 from django.contrib import admin
 from django.urls import path, include
-from django.conf import settings
-from django.conf.urls.static import static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -10,4 +8,6 @@ urlpatterns = [
     path('tasks/', include('tasks.urls')),
     path('attachments/', include('attachments.urls')),
     path('knowledge/', include('knowledge.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+# Uploaded files are not exposed under MEDIA_URL: every download goes through a
+# view that checks permissions and then hands the transfer to app.fileserve.
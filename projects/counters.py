@@ -0,0 +1,87 @@
+"""Denormalized per-project counters: tasks, open tasks, attachments, last activity.
+
+Task and attachment signals (projects.signals) apply ``adjust`` deltas with
+``F()`` expressions inside the transaction that changes the row (``Task.save``
+and ``Attachment.save`` are atomic, deletes run in Django's delete
+transaction), so readers (project list, "unfinished tasks" check) never
+aggregate over tasks or attachments. ``Project.save`` leaves the counter
+columns alone unless ``update_fields`` names them, so saving an edited
+project cannot write back stale values. ``recompute`` rebuilds the columns
+from the source tables with one set-based UPDATE and is what ``manage.py
+reconcile_project_counters`` and bulk operations use.
+"""
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from attachments.models import Attachment
+from tasks.models import Task
+
+from .models import Project
+
+DONE_STATUS = 'done'
+
+
+def is_open(status):
+    return status != DONE_STATUS
+
+
+def adjust(project_id, tasks=0, open_tasks=0, attachments=0):
+    """Add the given deltas to ``project_id``'s counters and mark it active now."""
+    if not project_id:
+        return
+    changes = {'last_activity_at': timezone.now()}
+    if tasks:
+        changes['task_count'] = F('task_count') + tasks
+    if open_tasks:
+        changes['open_task_count'] = F('open_task_count') + open_tasks
+    if attachments:
+        changes['attachment_count'] = F('attachment_count') + attachments
+    Project.objects.filter(pk=project_id).update(**changes)
+
+
+def _count(queryset):
+    counted = queryset.order_by().values('project_id').annotate(n=Count('id')).values('n')
+    return Coalesce(Subquery(counted, output_field=IntegerField()), Value(0))
+
+
+def _latest(queryset, field):
+    latest = queryset.order_by().values('project_id').annotate(at=Max(field)).values('at')
+    return Coalesce(Subquery(latest), F('updated_at'))
+
+
+def actual_counts():
+    """Expressions computing each counter from the source tables (correlated on the outer project)."""
+    tasks = Task.objects.filter(project_id=OuterRef('pk'))
+    attachments = Attachment.objects.filter(project_id=OuterRef('pk'))
+    return {
+        'task_count': _count(tasks),
+        'open_task_count': _count(tasks.exclude(status=DONE_STATUS)),
+        'attachment_count': _count(attachments),
+        'last_activity_at': Greatest(
+            F('updated_at'), _latest(tasks, 'updated_at'), _latest(attachments, 'created_at'),
+        ),
+    }
+
+
+def recompute(project_ids=None):
+    """Rebuild the counters of ``project_ids`` (default: every project); returns rows updated."""
+    projects = Project.objects.all()
+    if project_ids is not None:
+        projects = projects.filter(pk__in=list(project_ids))
+    return projects.update(**actual_counts())
+
+
+def drifted(queryset=None):
+    """Projects whose stored task/attachment counters differ from the source tables."""
+    queryset = Project.objects.all() if queryset is None else queryset
+    expected = actual_counts()
+    return queryset.annotate(
+        expected_tasks=expected['task_count'],
+        expected_open_tasks=expected['open_task_count'],
+        expected_attachments=expected['attachment_count'],
+    ).filter(
+        ~Q(task_count=F('expected_tasks'))
+        | ~Q(open_task_count=F('expected_open_tasks'))
+        | ~Q(attachment_count=F('expected_attachments'))
+    )
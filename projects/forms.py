@@ -1,4 +1,5 @@
 from django import forms
+from django.db.models import Q
 
 from .models import Project, Department
 from app.models import AppUser
@@ -53,4 +54,43 @@ class ProjectForm(forms.ModelForm):
         self.fields['owner'].label_from_instance = (
             lambda obj: f"{obj.display_name or obj.username} ({obj.username})"
         )
-        self.fields['status'].widget = forms.Select(choices=self.STATUS_CHOICES)
\ No newline at end of file
+        self.fields['status'].widget = forms.Select(choices=self.STATUS_CHOICES)
+
+class ProjectFilterForm(forms.Form):
+    """GET filters of the project list; invalid values are ignored rather than reported."""
+
+    status = forms.ChoiceField(label='状态', required=False)
+    owner = forms.ModelChoiceField(label='负责人', queryset=AppUser.objects.none(), required=False, empty_label='全部负责人')
+    lead_department = forms.ChoiceField(label='牵头部门', required=False)
+    date_from = forms.DateField(label='起始日期', required=False, input_formats=['%Y-%m-%d'],
+                                widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(label='截止日期', required=False, input_formats=['%Y-%m-%d'],
+                              widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['status'].choices = [('', '全部状态')] + list(ProjectForm.STATUS_CHOICES)
+        # only people who own a project are worth offering
+        self.fields['owner'].queryset = (
+            AppUser.objects.filter(pk__in=Project.objects.values('owner_id')).order_by('display_name')
+        )
+        self.fields['owner'].label_from_instance = lambda obj: obj.display_name or obj.username
+        departments = Department.objects.filter(is_active=True).order_by('name').values_list('name', flat=True)
+        self.fields['lead_department'].choices = [('', '全部部门')] + [(name, name) for name in departments]
+
+    def filter(self, queryset):
+        """Apply the valid filters to a ``Project`` queryset."""
+        self.is_valid()
+        data = getattr(self, 'cleaned_data', {})
+        if data.get('status'):
+            queryset = queryset.filter(status=data['status'])
+        if data.get('owner'):
+            queryset = queryset.filter(owner=data['owner'])
+        if data.get('lead_department'):
+            queryset = queryset.filter(lead_department=data['lead_department'])
+        # date range: projects running at some point within it
+        if data.get('date_to'):
+            queryset = queryset.filter(start_date__lte=data['date_to'])
+        if data.get('date_from'):
+            queryset = queryset.filter(Q(end_date__isnull=True) | Q(end_date__gte=data['date_from']))
+        return queryset
@@ -0,0 +1,84 @@
+"""Bulk import of projects from CSV/XLSX (see ``app.bulk_import``)."""
+from app.bulk_import import BulkImporter, cell_text, parse_date
+from app.models import AppUser
+
+from .forms import ProjectForm
+from .models import Project
+
+STATUS_VALUES = {key: key for key, _label in ProjectForm.STATUS_CHOICES}
+STATUS_VALUES.update({label: key for key, label in ProjectForm.STATUS_CHOICES})
+
+
+class ProjectImporter(BulkImporter):
+    model = Project
+    columns = {
+        'code': ('项目编码', 'code'),
+        'name': ('项目名称', 'name'),
+        'lead_department': ('牵头部门', 'lead_department', 'department'),
+        'description': ('项目描述', 'description'),
+        'start_date': ('开始日期', 'start_date'),
+        'end_date': ('结束日期', 'end_date'),
+        'status': ('项目状态', 'status'),
+        'owner': ('负责人', 'owner'),
+    }
+    required = ('code', 'name', 'start_date')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._seen_codes = set()
+
+    def prepare_batch(self, records):
+        codes = {cell_text(record.get('code')) for record in records}
+        usernames = {cell_text(record.get('owner')) for record in records} - {''}
+        self._existing = set(Project.objects.filter(code__in=codes).values_list('code', flat=True))
+        self._users = dict(AppUser.objects.filter(username__in=usernames).values_list('username', 'id'))
+
+    def build(self, record, report, line):
+        errors = len(report.errors)
+        code = cell_text(record.get('code'))
+        name = cell_text(record.get('name'))
+        if not code:
+            report.add_error(line, '项目编码', '不能为空')
+        elif len(code) > 64:
+            report.add_error(line, '项目编码', '不能超过 64 个字符')
+        elif code in self._existing:
+            report.add_error(line, '项目编码', '项目编码 %s 已存在' % code)
+        elif code in self._seen_codes:
+            report.add_error(line, '项目编码', '项目编码 %s 在文件中重复' % code)
+        if not name:
+            report.add_error(line, '项目名称', '不能为空')
+        elif len(name) > 128:
+            report.add_error(line, '项目名称', '不能超过 128 个字符')
+        dates = {}
+        for field, label in (('start_date', '开始日期'), ('end_date', '结束日期')):
+            try:
+                dates[field] = parse_date(record.get(field))
+            except ValueError:
+                report.add_error(line, label, '日期格式应为 YYYY-MM-DD')
+        if 'start_date' in dates and dates['start_date'] is None:
+            report.add_error(line, '开始日期', '不能为空')
+        if dates.get('start_date') and dates.get('end_date') and dates['end_date'] < dates['start_date']:
+            report.add_error(line, '结束日期', '不能早于开始日期')
+        status = STATUS_VALUES.get(cell_text(record.get('status')) or 'ongoing')
+        if status is None:
+            report.add_error(line, '项目状态', '未知状态 %s' % cell_text(record.get('status')))
+        username = cell_text(record.get('owner'))
+        owner_id = self._users.get(username) if username else self.user_id
+        if not owner_id:
+            report.add_error(line, '负责人', '用户 %s 不存在' % username if username else '不能为空')
+        department = cell_text(record.get('lead_department'))
+        if len(department) > 128:
+            report.add_error(line, '牵头部门', '不能超过 128 个字符')
+        if len(report.errors) > errors:
+            return None
+        self._seen_codes.add(code)
+        return Project(
+            code=code,
+            name=name,
+            lead_department=department or None,
+            description=cell_text(record.get('description')),
+            start_date=dates['start_date'],
+            end_date=dates['end_date'],
+            status=status,
+            owner_id=owner_id,
+        )
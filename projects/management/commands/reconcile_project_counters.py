@@ -0,0 +1,54 @@
+"""reconcile_project_counters
+
+Management command to repair the denormalized counters on ``Project`` (task,
+open task and attachment counts, last activity) from the task and attachment
+tables. Only drifted projects are rewritten unless ``--all`` is given; run it
+after bulk SQL edits or from cron as a safety net.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from projects.counters import drifted, recompute
+from projects.models import Project
+
+
+class Command(BaseCommand):
+    help = 'Recompute project task/attachment counters that drifted from the source tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recompute every project, not just drifted ones')
+        parser.add_argument('--batch-size', type=int, default=500, help='Projects checked per query')
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted projects')
+
+    def handle(self, *args, **options):
+        batch_size = options.get('batch_size') or 500
+        started = time.time()
+        if options.get('all') and not options.get('dry_run'):
+            count = recompute()
+            self.stdout.write(self.style.SUCCESS('Recomputed %d project(s) in %.1fs' % (count, time.time() - started)))
+            return
+        fixed = 0
+        after_id = 0
+        while True:
+            ids = list(Project.objects.filter(pk__gt=after_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            after_id = ids[-1]
+            rows = drifted(Project.objects.filter(pk__in=ids)).values(
+                'pk', 'code', 'task_count', 'expected_tasks', 'open_task_count', 'expected_open_tasks',
+                'attachment_count', 'expected_attachments',
+            )
+            bad = []
+            for row in rows:
+                bad.append(row['pk'])
+                self.stdout.write(
+                    '%(code)s: tasks %(task_count)s->%(expected_tasks)s, open %(open_task_count)s->%(expected_open_tasks)s, '
+                    'attachments %(attachment_count)s->%(expected_attachments)s' % row
+                )
+            if bad and not options.get('dry_run'):
+                recompute(bad)
+            fixed += len(bad)
+        self.stdout.write(self.style.SUCCESS('%s %d drifted project(s) in %.1fs' % (
+            'Found' if options.get('dry_run') else 'Repaired', fixed, time.time() - started,
+        )))
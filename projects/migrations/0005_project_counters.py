@@ -0,0 +1,60 @@
+# Generated by Django 3.2.20 on 2026-10-17 22:20
+
+from django.db import migrations, models
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+
+def backfill_counters(apps, schema_editor):
+    # frozen copy of projects.counters.recompute
+    Project = apps.get_model('projects', 'Project')
+    Task = apps.get_model('tasks', 'Task')
+    Attachment = apps.get_model('attachments', 'Attachment')
+    tasks = Task.objects.filter(project_id=OuterRef('pk')).order_by().values('project_id')
+    attachments = Attachment.objects.filter(project_id=OuterRef('pk')).order_by().values('project_id')
+
+    def count(queryset):
+        return Coalesce(Subquery(queryset.annotate(n=Count('id')).values('n'), output_field=IntegerField()), Value(0))
+
+    def latest(queryset, field):
+        return Coalesce(Subquery(queryset.annotate(at=Max(field)).values('at')), F('updated_at'))
+
+    Project.objects.update(
+        task_count=count(tasks),
+        open_task_count=count(tasks.exclude(status='done')),
+        attachment_count=count(attachments),
+        last_activity_at=Greatest(F('updated_at'), latest(tasks, 'updated_at'), latest(attachments, 'created_at')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0004_project_list_indexes'),
+        ('tasks', '0001_initial'),
+        ('attachments', '0009_filepurge'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='attachment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='open_task_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='task_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
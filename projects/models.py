@@ -41,6 +41,24 @@ class Project(models.Model):
     lead_department = models.CharField(max_length=128, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized counters kept by projects.counters in the same transaction as the
+    # task/attachment change; manage.py reconcile_project_counters repairs drift.
+    task_count = models.IntegerField(default=0)
+    open_task_count = models.IntegerField(default=0)
+    attachment_count = models.IntegerField(default=0)
+    last_activity_at = models.DateTimeField(null=True, blank=True)
+
+    COUNTER_FIELDS = ('task_count', 'open_task_count', 'attachment_count', 'last_activity_at')
+
+    def save(self, *args, **kwargs):
+        # the counters on an edited instance may be stale; only projects.counters
+        # writes them, so updates leave them out unless update_fields names them
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.code} - {self.name}"
@@ -54,4 +72,12 @@ class Project(models.Model):
         return self.STATUS_STYLES.get(self.status, 'status-badge--default')
 
     class Meta:
-        db_table = 'projects'
\ No newline at end of file
+        db_table = 'projects'
+        # back the sortable columns and common filters of the project list (keyset pagination)
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='project_updated_idx'),
+            models.Index(fields=['name', 'id'], name='project_name_idx'),
+            models.Index(fields=['start_date', 'id'], name='project_start_idx'),
+            models.Index(fields=['status', 'updated_at', 'id'], name='project_status_updated_idx'),
+            models.Index(fields=['lead_department', 'updated_at', 'id'], name='project_dept_updated_idx'),
+        ]
\ No newline at end of file
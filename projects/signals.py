@@ -0,0 +1,51 @@
+"""Keep the counters on Project (projects.counters) in step with tasks and attachments."""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from attachments.models import Attachment
+from tasks.models import Task
+
+from .counters import adjust, is_open
+
+
+@receiver(pre_save, sender=Task, dispatch_uid='project_counters_task_pre_save')
+def task_pre_save(sender, instance, raw=False, **kwargs):
+    instance._counted_as = None
+    if instance.pk and not raw:
+        instance._counted_as = Task.objects.filter(pk=instance.pk).values_list('project_id', 'status').first()
+
+
+@receiver(post_save, sender=Task, dispatch_uid='project_counters_task_saved')
+def task_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_counted_as', None)
+    instance._counted_as = None
+    now_open = int(is_open(instance.status))
+    if created or previous is None:
+        adjust(instance.project_id, tasks=1, open_tasks=now_open)
+        return
+    old_project_id, old_status = previous
+    was_open = int(is_open(old_status))
+    if old_project_id != instance.project_id:
+        adjust(old_project_id, tasks=-1, open_tasks=-was_open)
+        adjust(instance.project_id, tasks=1, open_tasks=now_open)
+    else:
+        adjust(instance.project_id, open_tasks=now_open - was_open)
+
+
+@receiver(post_delete, sender=Task, dispatch_uid='project_counters_task_deleted')
+def task_deleted(sender, instance, **kwargs):
+    # a no-op when the project itself is being deleted
+    adjust(instance.project_id, tasks=-1, open_tasks=-int(is_open(instance.status)))
+
+
+@receiver(post_save, sender=Attachment, dispatch_uid='project_counters_attachment_saved')
+def attachment_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        adjust(instance.project_id, attachments=1)
+
+
+@receiver(post_delete, sender=Attachment, dispatch_uid='project_counters_attachment_deleted')
+def attachment_deleted(sender, instance, **kwargs):
+    adjust(instance.project_id, attachments=-1)
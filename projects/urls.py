@@ -4,6 +4,8 @@ from . import views
 urlpatterns = [
     path('', views.project_list, name='project_list'),
     path('create/', views.project_create, name='project_create'),
+    path('import/', views.project_import, name='project_import'),
+    path('export/', views.project_export, name='project_export'),
     path('<int:pk>/', views.project_detail, name='project_detail'),
     path('<int:pk>/edit/', views.project_update, name='project_update'),
     path('<int:pk>/delete/', views.project_delete, name='project_delete'),
@@ -5,12 +5,17 @@ from django.urls import reverse
 from urllib.parse import quote
 
 from .models import Project
-from .forms import ProjectForm
+from .forms import ProjectFilterForm, ProjectForm
+from .importers import ProjectImporter
+from app.bulk_import import ImportFileError, template_response
+from app.export import chunk_size, export_format, export_response
 from app.models import AppUser
+from app.pagination import keyset_iterate, keyset_paginate, page_querystring
 from app.utils import build_base_context
+from tasks.forms import ProjectTaskFilterForm, TaskBulkForm
 from tasks.models import Task
-from django.db.models import Exists, OuterRef, Count, Q
-from attachments.models import Attachment
+from tasks.permissions import visible_tasks
+from django.conf import settings
 
 
 def _require_login(request):
@@ -22,39 +27,130 @@ def _require_login(request):
     return session_ctx, None
 
 
+# ?sort= values -> keyset ordering; each ends with id so the key is unique
+PROJECT_LIST_SORTS = {
+    'updated': ('updated_at', 'id'),
+    'code': ('code', 'id'),
+    'name': ('name', 'id'),
+    'start': ('start_date', 'id'),
+}
+PROJECT_LIST_DEFAULT_SORT = '-updated'
+
+
+def _project_list_ordering(sort):
+    key = sort.lstrip('-')
+    if key not in PROJECT_LIST_SORTS:
+        sort, key = PROJECT_LIST_DEFAULT_SORT, PROJECT_LIST_DEFAULT_SORT.lstrip('-')
+    if sort.startswith('-'):
+        return sort, tuple('-' + field for field in PROJECT_LIST_SORTS[key])
+    return sort, PROJECT_LIST_SORTS[key]
+
+
 def project_list(request):
     session_ctx, redirect_response = _require_login(request)
     if redirect_response:
         return redirect_response
-    # Annotate each project with a boolean indicating whether it has attachments.
-    attachment_qs = Attachment.objects.filter(project=OuterRef('pk'))
-    projects = (
-        Project.objects.select_related('owner')
-        .annotate(
-            has_attachments=Exists(attachment_qs),
-            open_tasks=Count('task', filter=~Q(task__status='done'))
-        )
-        .order_by('-updated_at')
+    filter_form = ProjectFilterForm(request.GET)
+    sort, ordering = _project_list_ordering(request.GET.get('sort') or PROJECT_LIST_DEFAULT_SORT)
+    projects = filter_form.filter(Project.objects.select_related('owner'))
+    page = keyset_paginate(
+        projects, ordering,
+        after=request.GET.get('after'), before=request.GET.get('before'),
+        per_page=getattr(settings, 'PROJECT_PAGE_SIZE', 20),
     )
-    context = {**session_ctx, 'projects': projects}
+    # header links: clicking the active column flips its direction; a new sort starts on page one
+    sort_queries = {
+        key: page_querystring(request.GET, sort=('-' + key if sort == key else key), after=None, before=None)
+        for key in PROJECT_LIST_SORTS
+    }
+    context = {
+        **session_ctx,
+        'projects': page,
+        'page': page,
+        'filter_form': filter_form,
+        'sort': sort,
+        'sort_queries': sort_queries,
+        'next_query': page_querystring(request.GET, after=page.next_cursor, before=None) if page.has_next else '',
+        'previous_query': page_querystring(request.GET, before=page.previous_cursor, after=None) if page.has_previous else '',
+    }
     return render(request, 'projects/list.html', context)
 
 
+PROJECT_EXPORT_COLUMNS = (
+    ('id', 'ID'),
+    ('code', '项目编码'),
+    ('name', '项目名称'),
+    ('owner__username', '负责人'),
+    ('lead_department', '牵头部门'),
+    ('status', '项目状态'),
+    ('start_date', '开始日期'),
+    ('end_date', '结束日期'),
+    ('task_count', '任务数'),
+    ('open_task_count', '未完成任务数'),
+    ('attachment_count', '附件数'),
+    ('last_activity_at', '最近动态'),
+    ('updated_at', '更新时间'),
+)
+
+
+def _project_export_row(row):
+    row['status'] = Project.STATUS_LABELS.get(row['status'], row['status'])
+    return [row[field] for field, _label in PROJECT_EXPORT_COLUMNS]
+
+
+def project_export(request):
+    """The project list, with the same filters and sort, as a streamed CSV/XLSX file."""
+    session_ctx, redirect_response = _require_login(request)
+    if redirect_response:
+        return redirect_response
+    filter_form = ProjectFilterForm(request.GET)
+    _sort, ordering = _project_list_ordering(request.GET.get('sort') or PROJECT_LIST_DEFAULT_SORT)
+    projects = filter_form.filter(Project.objects.values(*(field for field, _label in PROJECT_EXPORT_COLUMNS)))
+    rows = (_project_export_row(row) for row in keyset_iterate(projects, ordering, chunk_size()))
+    header = [label for _field, label in PROJECT_EXPORT_COLUMNS]
+    return export_response(export_format(request), 'projects', header, rows, sheet_name='项目')
+
+
 def project_detail(request, pk):
     session_ctx, redirect_response = _require_login(request)
     if redirect_response:
         return redirect_response
     project = get_object_or_404(Project.objects.select_related('owner'), pk=pk)
-    tasks = Task.objects.filter(project=project).select_related('assignee').order_by('-updated_at')
-    current_path = request.get_full_path()
-    create_task_url = f"{reverse('project_task_create', args=[project.id])}?next={quote(current_path)}"
+    filter_form = ProjectTaskFilterForm(request.GET, project=project)
+    project_tasks = visible_tasks(session_ctx, Task.objects.filter(project=project))
+    tasks = filter_form.filter(project_tasks.select_related('assignee'))
+    page = keyset_paginate(
+        tasks, ('-updated_at', '-id'),
+        after=request.GET.get('after'), before=request.GET.get('before'),
+        per_page=getattr(settings, 'PROJECT_TASK_PAGE_SIZE', 50),
+    )
+    # task links return to the filtered table, not to a later page fragment
+    base_query = page_querystring(request.GET, after=None, before=None, partial=None)
+    current_path = request.path + ('?' + base_query if base_query else '')
+    next_query = page_querystring(request.GET, after=page.next_cursor, before=None) if page.has_next else ''
     context = {
         **session_ctx,
         'project': project,
-        'tasks': tasks,
+        'tasks': page,
+        'page': page,
         'current_path': current_path,
-        'create_task_url': create_task_url,
+        'next_query': next_query,
+        'previous_query': page_querystring(request.GET, before=page.previous_cursor, after=None) if page.has_previous else '',
     }
+    if request.GET.get('partial'):
+        # later pages are fetched by the "load more" button and appended to the table
+        response = render(request, 'projects/_task_rows.html', context)
+        response['X-Next-Page'] = '?' + page_querystring(request.GET, after=page.next_cursor) if page.has_next else ''
+        return response
+    context.update({
+        'filter_form': filter_form,
+        'summary': Task.summary(project_tasks),
+        'create_task_url': f"{reverse('project_task_create', args=[project.id])}?next={quote(current_path)}",
+        'more_query': page_querystring(request.GET, after=page.next_cursor, partial=1) if page.has_next else '',
+        # "all matching" bulk actions apply the detail filters within this project
+        'bulk_form': TaskBulkForm(initial={'filter_query': page_querystring(
+            request.GET, after=None, before=None, partial=None, project=project.id)}),
+    })
     return render(request, 'projects/detail.html', context)
 
 
@@ -95,8 +191,8 @@ def project_update(request, pk):
             # Prevent marking project as completed if it still has unfinished tasks
             new_status = form.cleaned_data.get('status')
             if new_status == 'completed':
-                unfinished_exists = Task.objects.filter(project=project).exclude(status='done').exists()
-                if unfinished_exists:
+                # denormalized counter (projects.counters); no query over the task table
+                if project.open_task_count > 0:
                     form.add_error('status', '项目下还有未完成的任务，无法转为“已完成”')
                     # fall through to render form with error
                 else:
@@ -127,3 +223,36 @@ def project_delete(request, pk):
         return redirect('project_list')
     messages.error(request, '非法请求')
     return redirect('project_list')
+
+
+def project_import(request):
+    session_ctx, redirect_response = _require_login(request)
+    if redirect_response:
+        return redirect_response
+    if not session_ctx.get('can_manage_projects'):
+        messages.error(request, '没有权限导入项目')
+        return redirect('project_list')
+    importer = ProjectImporter(user_id=session_ctx['user_id'], partial=bool(request.POST.get('partial')))
+    if request.GET.get('template'):
+        return template_response(importer, 'projects-template.csv')
+    report = None
+    upload = request.FILES.get('file')
+    if request.method == 'POST':
+        if upload is None:
+            messages.error(request, '请选择要导入的文件')
+        else:
+            try:
+                report = importer.run(upload, upload.name)
+            except ImportFileError as exc:
+                messages.error(request, str(exc))
+            else:
+                if report.committed:
+                    messages.success(request, '已导入 %d 个项目' % report.created)
+    context = {
+        **session_ctx,
+        'title': '批量导入项目',
+        'columns': importer.header_names(),
+        'report': report,
+        'back_url': reverse('project_list'),
+    }
+    return render(request, 'import.html', context)
@@ -0,0 +1,183 @@
+/*
+ * Chunked, resumable uploads for forms marked with data-chunked-upload="<upload_start url>".
+ *
+ * On submit every selected file is sent in chunks to the upload endpoint; the
+ * form is then submitted with the resulting upload ids (hidden "upload_ids"
+ * inputs) instead of the file bodies. A dropped connection is retried from the
+ * last byte the server acknowledged, and upload ids are remembered in
+ * localStorage so choosing the same file again after a reload resumes it.
+ * Without JavaScript the form falls back to a plain multipart upload.
+ */
+(function () {
+    'use strict';
+
+    var MAX_RETRIES = 8;
+    var STORAGE_PREFIX = 'chunked-upload:';
+
+    function csrfToken(form) {
+        var input = form.querySelector('input[name="csrfmiddlewaretoken"]');
+        return input ? input.value : '';
+    }
+
+    function fileKey(file) {
+        return STORAGE_PREFIX + [file.name, file.size, file.lastModified].join(':');
+    }
+
+    function sleep(ms) {
+        return new Promise(function (resolve) { setTimeout(resolve, ms); });
+    }
+
+    function readJson(response) {
+        return response.json().catch(function () { return {}; }).then(function (data) {
+            data.httpStatus = response.status;
+            return data;
+        });
+    }
+
+    function startUpload(form, file) {
+        var body = new FormData();
+        body.append('filename', file.name);
+        body.append('size', file.size);
+        return fetch(form.dataset.chunkedUpload, {
+            method: 'POST',
+            body: body,
+            credentials: 'same-origin',
+            headers: {'X-CSRFToken': csrfToken(form)}
+        }).then(readJson).then(function (data) {
+            if (data.httpStatus !== 201) {
+                throw new Error(data.error || '无法开始上传');
+            }
+            return data;
+        });
+    }
+
+    function uploadStatus(form, id) {
+        return fetch(form.dataset.chunkedUpload + id + '/', {credentials: 'same-origin'}).then(readJson);
+    }
+
+    function resumeOrStart(form, file) {
+        var saved = window.localStorage && localStorage.getItem(fileKey(file));
+        if (!saved) {
+            return startUpload(form, file);
+        }
+        return uploadStatus(form, saved).then(function (data) {
+            return data.httpStatus === 200 && data.size === file.size ? data : startUpload(form, file);
+        });
+    }
+
+    function sendChunks(form, file, upload, onProgress) {
+        var retries = 0;
+        function next(received) {
+            onProgress(received, file.size);
+            if (received >= file.size) {
+                return Promise.resolve(upload.id);
+            }
+            var end = Math.min(received + upload.chunk_size, file.size);
+            return fetch(form.dataset.chunkedUpload + upload.id + '/?offset=' + received, {
+                method: 'PUT',
+                body: file.slice(received, end),
+                credentials: 'same-origin',
+                headers: {'X-CSRFToken': csrfToken(form), 'Content-Type': 'application/octet-stream'}
+            }).then(readJson).then(function (data) {
+                if (data.httpStatus === 200 || data.httpStatus === 409) {
+                    retries = 0;
+                    return next(data.received);
+                }
+                throw new Error(data.error || '上传失败');
+            }, function () {
+                // network error: wait, ask the server what arrived, continue from there
+                if (++retries > MAX_RETRIES) {
+                    throw new Error('网络中断，请稍后重试');
+                }
+                return sleep(Math.min(1000 * Math.pow(2, retries), 30000)).then(function () {
+                    return uploadStatus(form, upload.id);
+                }).then(function (data) {
+                    return next(data.httpStatus === 200 ? data.received : received);
+                }, function () {
+                    return next(received);
+                });
+            });
+        }
+        return next(upload.received || 0);
+    }
+
+    function uploadFile(form, file, onProgress) {
+        return resumeOrStart(form, file).then(function (upload) {
+            if (window.localStorage) {
+                localStorage.setItem(fileKey(file), upload.id);
+            }
+            return sendChunks(form, file, upload, onProgress);
+        }).then(function (id) {
+            if (window.localStorage) {
+                localStorage.removeItem(fileKey(file));
+            }
+            return id;
+        });
+    }
+
+    function attach(form) {
+        var status = document.createElement('div');
+        status.className = 'secondary-text upload-progress';
+        form.appendChild(status);
+        // files already uploaded by an earlier, partly failed submit
+        var completed = {};
+
+        form.addEventListener('submit', function (event) {
+            var inputs = Array.prototype.filter.call(
+                form.querySelectorAll('input[type="file"]'),
+                function (input) { return input.files && input.files.length; }
+            );
+            if (!inputs.length || !window.fetch) {
+                return;
+            }
+            event.preventDefault();
+            var button = form.querySelector('[type="submit"]');
+            if (button) {
+                button.disabled = true;
+            }
+            var files = [];
+            inputs.forEach(function (input) {
+                Array.prototype.push.apply(files, input.files);
+            });
+            var chain = Promise.resolve();
+            files.forEach(function (file, index) {
+                chain = chain.then(function () {
+                    if (completed[fileKey(file)]) {
+                        return null;
+                    }
+                    return uploadFile(form, file, function (done, total) {
+                        var percent = total ? Math.floor(done * 100 / total) : 100;
+                        status.textContent = '正在上传 ' + file.name + '（' + (index + 1) + '/' + files.length + '）：' + percent + '%';
+                    });
+                }).then(function (id) {
+                    if (id === null) {
+                        return;
+                    }
+                    completed[fileKey(file)] = id;
+                    var hidden = document.createElement('input');
+                    hidden.type = 'hidden';
+                    hidden.name = 'upload_ids';
+                    hidden.value = id;
+                    form.appendChild(hidden);
+                });
+            });
+            chain.then(function () {
+                inputs.forEach(function (input) {
+                    input.removeAttribute('name');
+                    input.required = false;
+                });
+                status.textContent = '上传完成，正在保存…';
+                form.submit();
+            }, function (error) {
+                status.textContent = error.message + '（重新提交可从中断处继续）';
+                if (button) {
+                    button.disabled = false;
+                }
+            });
+        });
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        Array.prototype.forEach.call(document.querySelectorAll('form[data-chunked-upload]'), attach);
+    });
+})();
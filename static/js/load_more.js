@@ -0,0 +1,49 @@
+/*
+ * "Load more" links for paginated tables: a link marked with
+ * data-load-more="<url of the next page's rows>" and data-target="<tbody id>"
+ * fetches the rows and appends them instead of navigating. The response's
+ * X-Next-Page header holds the url of the page after it (empty on the last
+ * page, which removes the link). Without JavaScript the link's href opens
+ * the next page normally.
+ */
+(function () {
+    'use strict';
+
+    function loadMore(link) {
+        var target = document.getElementById(link.getAttribute('data-target'));
+        if (!target || link.getAttribute('aria-busy') === 'true') {
+            return;
+        }
+        link.setAttribute('aria-busy', 'true');
+        fetch(link.getAttribute('data-load-more'), {
+            credentials: 'same-origin',
+            headers: { 'X-Requested-With': 'XMLHttpRequest' }
+        }).then(function (response) {
+            if (!response.ok) {
+                throw new Error('HTTP ' + response.status);
+            }
+            var next = response.headers.get('X-Next-Page');
+            return response.text().then(function (html) {
+                target.insertAdjacentHTML('beforeend', html);
+                if (next) {
+                    link.setAttribute('data-load-more', next);
+                    link.removeAttribute('aria-busy');
+                } else {
+                    link.parentNode.removeChild(link);
+                }
+            });
+        }).catch(function () {
+            // fall back to a plain page load
+            window.location.href = link.href;
+        });
+    }
+
+    document.addEventListener('click', function (event) {
+        var link = event.target.closest ? event.target.closest('[data-load-more]') : null;
+        if (!link) {
+            return;
+        }
+        event.preventDefault();
+        loadMore(link);
+    });
+}());
@@ -0,0 +1,60 @@
+"""Set-based bulk operations on tasks (the bulk action bar of the task list and project detail).
+
+Each action is one ``UPDATE`` over the selected queryset (deletes are
+``DELETE`` statements over batches of ids), not a save per task. Such statements send no model signals, so the project
+counters (``projects.counters``) are rebuilt afterwards with one
+``recompute`` over the projects involved, in the same transaction.
+"""
+from django.db import connections, transaction
+from django.utils import timezone
+
+from projects import counters
+
+# ids per DELETE statement, to stay within the database's parameter limits
+DELETE_BATCH_SIZE = 500
+
+
+def editable_tasks(tasks, session_ctx):
+    """Restrict ``tasks`` to those the user may edit: all with the edit/manage permission, else their own."""
+    if session_ctx.get('can_manage_tasks') or session_ctx.get('can_edit_all_tasks'):
+        return tasks
+    return tasks.filter(assignee_id=session_ctx['user_id'])
+
+
+def apply_changes(tasks, changes):
+    """Apply ``changes`` (field -> value) to every task in ``tasks``; returns how many changed."""
+    with transaction.atomic():
+        project_ids = list(tasks.order_by().values_list('project_id', flat=True).distinct())
+        # update() skips auto_now, so the modification time is set explicitly
+        count = tasks.update(updated_at=timezone.now(), **changes)
+        if count:
+            counters.recompute(project_ids)
+    return count
+
+
+def delete_tasks(tasks):
+    """Delete every task in ``tasks`` with plain ``DELETE`` statements; returns how many were deleted.
+
+    QuerySet.delete() would load every row to send the per-row counter
+    signals that ``recompute`` replaces; nothing references tasks, so no
+    cascade is needed.
+    """
+    model = tasks.model
+    connection = connections[tasks.db]
+    table = connection.ops.quote_name(model._meta.db_table)
+    pk_column = connection.ops.quote_name(model._meta.pk.column)
+    count = 0
+    with transaction.atomic(using=tasks.db):
+        rows = list(tasks.select_for_update().order_by().values_list('pk', 'project_id'))
+        ids = [pk for pk, _project_id in rows]
+        with connection.cursor() as cursor:
+            for start in range(0, len(ids), DELETE_BATCH_SIZE):
+                batch = ids[start:start + DELETE_BATCH_SIZE]
+                cursor.execute(
+                    'DELETE FROM %s WHERE %s IN (%s)' % (table, pk_column, ', '.join(['%s'] * len(batch))),
+                    batch,
+                )
+                count += cursor.rowcount
+        if count:
+            counters.recompute({project_id for _pk, project_id in rows})
+    return count
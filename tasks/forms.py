@@ -52,3 +52,131 @@ class TaskForm(forms.ModelForm):
             field.widget.attrs.setdefault('autocomplete', 'off')
             if field_name in placeholders:
                 field.widget.attrs.setdefault('placeholder', placeholders[field_name])
+
+
+class ProjectTaskFilterForm(forms.Form):
+    """GET filters of the task table on the project detail page; invalid values are ignored."""
+
+    status = forms.ChoiceField(label='状态', required=False)
+    assignee = forms.ModelChoiceField(label='负责人', queryset=AppUser.objects.none(), required=False,
+                                      empty_label='全部负责人')
+
+    def __init__(self, *args, project=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['status'].choices = [('', '全部状态')] + list(TaskForm.STATUS_CHOICES)
+        # only people assigned in this project are worth offering
+        assigned = Task.objects.filter(project=project).exclude(assignee=None).values('assignee_id')
+        self.fields['assignee'].queryset = AppUser.objects.filter(pk__in=assigned).order_by('display_name')
+        self.fields['assignee'].label_from_instance = lambda obj: obj.display_name or obj.username
+
+    def filter(self, queryset):
+        """Apply the valid filters to a ``Task`` queryset."""
+        self.is_valid()
+        data = getattr(self, 'cleaned_data', {})
+        if data.get('status'):
+            queryset = queryset.filter(status=data['status'])
+        if data.get('assignee'):
+            queryset = queryset.filter(assignee=data['assignee'])
+        return queryset
+
+
+class TaskFilterForm(forms.Form):
+    """GET filters of the task list (and its export); invalid values are ignored rather than reported."""
+
+    NOT_DONE = 'not_done'
+
+    project = forms.IntegerField(required=False, widget=forms.HiddenInput)
+    status = forms.ChoiceField(label='状态', required=False)
+    assignee = forms.ModelChoiceField(label='负责人', queryset=AppUser.objects.none(), required=False,
+                                      empty_label='全部负责人')
+    priority = forms.TypedChoiceField(label='优先级', required=False, coerce=int, empty_value=None)
+    due_from = forms.DateField(label='截止日期起', required=False, input_formats=['%Y-%m-%d'],
+                               widget=forms.DateInput(attrs={'type': 'date'}))
+    due_to = forms.DateField(label='截止日期止', required=False, input_formats=['%Y-%m-%d'],
+                             widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['status'].choices = (
+            [('', '全部状态'), (self.NOT_DONE, '未完成')] + list(TaskForm.STATUS_CHOICES)
+        )
+        self.fields['priority'].choices = [('', '全部优先级')] + list(TaskForm.PRIORITY_CHOICES)
+        self.fields['assignee'].queryset = AppUser.objects.order_by('display_name')
+        self.fields['assignee'].label_from_instance = lambda obj: obj.display_name or obj.username
+
+    def filter(self, queryset):
+        """Apply the valid filters to a ``Task`` queryset."""
+        self.is_valid()
+        data = getattr(self, 'cleaned_data', {})
+        if data.get('project'):
+            queryset = queryset.filter(project_id=data['project'])
+        if data.get('status') == self.NOT_DONE:
+            queryset = queryset.exclude(status='done')
+        elif data.get('status'):
+            queryset = queryset.filter(status=data['status'])
+        if data.get('assignee'):
+            queryset = queryset.filter(assignee=data['assignee'])
+        if data.get('priority') is not None:
+            queryset = queryset.filter(priority=data['priority'])
+        if data.get('due_from'):
+            queryset = queryset.filter(due_date__gte=data['due_from'])
+        if data.get('due_to'):
+            queryset = queryset.filter(due_date__lte=data['due_to'])
+        return queryset
+
+
+class TaskBulkForm(forms.Form):
+    """One bulk action over selected tasks (``ids``) or every task matching ``filter_query``."""
+
+    ACTION_CHOICES = [
+        ('status', '修改状态'),
+        ('assignee', '修改负责人'),
+        ('priority', '修改优先级'),
+        ('due_date', '修改截止日期'),
+        ('delete', '删除'),
+    ]
+    SCOPE_SELECTED = 'selected'
+    SCOPE_FILTER = 'filter'
+
+    action = forms.ChoiceField(label='批量操作', choices=ACTION_CHOICES)
+    scope = forms.ChoiceField(choices=[(SCOPE_SELECTED, '选中的任务'), (SCOPE_FILTER, '符合筛选条件的全部任务')],
+                              initial=SCOPE_SELECTED, widget=forms.RadioSelect)
+    filter_query = forms.CharField(required=False, widget=forms.HiddenInput)
+    status = forms.ChoiceField(label='状态', choices=[('', '选择状态')] + TaskForm.STATUS_CHOICES, required=False)
+    assignee = forms.ModelChoiceField(label='负责人', queryset=AppUser.objects.none(), required=False,
+                                      empty_label='选择负责人')
+    priority = forms.TypedChoiceField(label='优先级', choices=[('', '选择优先级')] + TaskForm.PRIORITY_CHOICES,
+                                      required=False, coerce=int, empty_value=None)
+    due_date = forms.DateField(label='截止日期', required=False, input_formats=['%Y-%m-%d'],
+                               widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def __init__(self, *args, **kwargs):
+        # shares field names with the filter form on the same page; keep element ids apart
+        kwargs.setdefault('auto_id', 'bulk_%s')
+        super().__init__(*args, **kwargs)
+        self.fields['assignee'].queryset = AppUser.objects.order_by('display_name')
+        self.fields['assignee'].label_from_instance = lambda obj: obj.display_name or obj.username
+
+    def clean(self):
+        cleaned = super().clean()
+        action = cleaned.get('action')
+        # the row checkboxes: any number of ``ids`` values
+        getlist = getattr(self.data, 'getlist', None)
+        raw_ids = getlist('ids') if getlist else self.data.get('ids', [])
+        cleaned['ids'] = [int(value) for value in raw_ids if str(value).isdigit()]
+        if cleaned.get('scope') == self.SCOPE_SELECTED and not cleaned['ids']:
+            raise forms.ValidationError('请先勾选任务')
+        required = {'status': '请选择状态', 'assignee': '请选择负责人', 'priority': '请选择优先级'}
+        if action in required and cleaned.get(action) in (None, ''):
+            self.add_error(action, required[action])
+        # an empty due date clears it
+        return cleaned
+
+    def changes(self):
+        """Field -> new value for an update action (None for ``delete``)."""
+        action = self.cleaned_data['action']
+        if action == 'delete':
+            return None
+        if action == 'assignee':
+            return {'assignee': self.cleaned_data['assignee']}
+        return {action: self.cleaned_data[action]}
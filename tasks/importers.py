@@ -0,0 +1,84 @@
+"""Bulk import of tasks from CSV/XLSX (see ``app.bulk_import``)."""
+from collections import Counter
+
+from app.bulk_import import BulkImporter, cell_text, parse_date
+from app.models import AppUser
+from projects import counters
+from projects.models import Project
+
+from .forms import TaskForm
+from .models import Task
+
+STATUS_VALUES = {key: key for key, _label in TaskForm.STATUS_CHOICES}
+STATUS_VALUES.update({label: key for key, label in TaskForm.STATUS_CHOICES})
+PRIORITY_VALUES = {str(key): key for key, _label in TaskForm.PRIORITY_CHOICES}
+PRIORITY_VALUES.update({label: key for key, label in TaskForm.PRIORITY_CHOICES})
+PRIORITY_VALUES.update({label.split(' · ')[-1]: key for key, label in TaskForm.PRIORITY_CHOICES})
+
+
+class TaskImporter(BulkImporter):
+    model = Task
+    columns = {
+        'project': ('项目编码', 'project', 'project_code'),
+        'title': ('任务标题', 'title'),
+        'description': ('任务描述', 'description'),
+        'assignee': ('负责人', 'assignee'),
+        'priority': ('优先级', 'priority'),
+        'due_date': ('截止日期', 'due_date'),
+        'status': ('任务状态', 'status'),
+    }
+    required = ('project', 'title')
+
+    def prepare_batch(self, records):
+        codes = {cell_text(record.get('project')) for record in records} - {''}
+        usernames = {cell_text(record.get('assignee')) for record in records} - {''}
+        self._projects = dict(Project.objects.filter(code__in=codes).values_list('code', 'id'))
+        self._users = dict(AppUser.objects.filter(username__in=usernames).values_list('username', 'id'))
+
+    def build(self, record, report, line):
+        errors = len(report.errors)
+        code = cell_text(record.get('project'))
+        project_id = self._projects.get(code)
+        if not code:
+            report.add_error(line, '项目编码', '不能为空')
+        elif project_id is None:
+            report.add_error(line, '项目编码', '项目 %s 不存在' % code)
+        title = cell_text(record.get('title'))
+        if not title:
+            report.add_error(line, '任务标题', '不能为空')
+        elif len(title) > 128:
+            report.add_error(line, '任务标题', '不能超过 128 个字符')
+        username = cell_text(record.get('assignee'))
+        assignee_id = self._users.get(username)
+        if username and assignee_id is None:
+            report.add_error(line, '负责人', '用户 %s 不存在' % username)
+        priority_text = cell_text(record.get('priority'))
+        priority = PRIORITY_VALUES.get(priority_text, 0 if not priority_text else None)
+        if priority is None:
+            report.add_error(line, '优先级', '应为 1-5')
+        try:
+            due_date = parse_date(record.get('due_date'))
+        except ValueError:
+            report.add_error(line, '截止日期', '日期格式应为 YYYY-MM-DD')
+        status = STATUS_VALUES.get(cell_text(record.get('status')) or 'todo')
+        if status is None:
+            report.add_error(line, '任务状态', '未知状态 %s' % cell_text(record.get('status')))
+        if len(report.errors) > errors:
+            return None
+        return Task(
+            project_id=project_id,
+            title=title,
+            description=cell_text(record.get('description')),
+            assignee_id=assignee_id,
+            priority=priority,
+            due_date=due_date,
+            status=status,
+            created_by_id=self.user_id,
+        )
+
+    def finish(self, objects):
+        # bulk_create sends no signals: apply the project counter deltas per batch
+        tasks = Counter(task.project_id for task in objects)
+        open_tasks = Counter(task.project_id for task in objects if counters.is_open(task.status))
+        for project_id, count in tasks.items():
+            counters.adjust(project_id, tasks=count, open_tasks=open_tasks[project_id])
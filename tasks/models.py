@@ -1,4 +1,7 @@
-from django.db import models
+import datetime
+
+from django.db import models, transaction
+from django.db.models import Count, Q
 from app.models import AppUser
 from projects.models import Project
 
@@ -49,6 +52,36 @@ class Task(models.Model):
     def __str__(self):
         return f"[{self.project.code}] {self.title}"
 
+    def save(self, *args, **kwargs):
+        # project counters (projects.signals) are updated in the same transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def summary(cls, tasks):
+        """Per-status and per-priority counts of ``tasks`` (e.g. a project's), plus overdue open tasks, in one query."""
+        today = datetime.date.today()
+        aggregates = {'total': Count('id')}
+        for status in cls.STATUS_LABELS:
+            aggregates['status_' + status] = Count('id', filter=Q(status=status))
+        for priority in cls.PRIORITY_STYLES:
+            aggregates['priority_%d' % priority] = Count('id', filter=Q(priority=priority))
+        aggregates['overdue'] = Count('id', filter=Q(due_date__lt=today) & ~Q(status='done'))
+        row = tasks.aggregate(**aggregates)
+        return {
+            'total': row['total'],
+            'overdue': row['overdue'],
+            'by_status': [
+                {'key': status, 'label': label, 'css': cls.STATUS_STYLES[status], 'count': row['status_' + status]}
+                for status, label in cls.STATUS_LABELS.items()
+            ],
+            'by_priority': [
+                {'key': priority, 'label': cls.PRIORITY_LABELS.get(priority, '未设置'),
+                 'css': css, 'count': row['priority_%d' % priority]}
+                for priority, css in cls.PRIORITY_STYLES.items() if row['priority_%d' % priority]
+            ],
+        }
+
     @property
     def status_label(self) -> str:
         return self.STATUS_LABELS.get(self.status, self.status)
@@ -66,4 +99,17 @@ class Task(models.Model):
         return self.PRIORITY_STYLES.get(self.priority, 'priority-badge--0')
 
     class Meta:
-        db_table = 'tasks'
\ No newline at end of file
+        db_table = 'tasks'
+        # back the keyset-paginated task list/export (ordered by updated_at, id), its
+        # filters and permission scoping, and the project detail task table
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='task_updated_idx'),
+            models.Index(fields=['project', 'updated_at', 'id'], name='task_project_updated_idx'),
+            models.Index(fields=['project', 'status', 'updated_at', 'id'], name='task_project_status_idx'),
+            models.Index(fields=['project', 'assignee', 'updated_at', 'id'], name='task_project_assignee_idx'),
+            models.Index(fields=['assignee', 'updated_at', 'id'], name='task_assignee_updated_idx'),
+            models.Index(fields=['assignee', 'status', 'priority', 'due_date'], name='task_assignee_status_idx'),
+            models.Index(fields=['created_by', 'updated_at', 'id'], name='task_creator_updated_idx'),
+            models.Index(fields=['status', 'updated_at', 'id'], name='task_status_updated_idx'),
+            models.Index(fields=['due_date', 'id'], name='task_due_idx'),
+        ]
\ No newline at end of file
@@ -0,0 +1,19 @@
+"""Which tasks a user may see, as queryset filters shared by the task and project views."""
+from django.db.models import Q
+
+from projects.models import Project
+
+
+def visible_tasks(session_ctx, tasks_qs):
+    """Restrict ``tasks_qs`` to what the user may see, in SQL.
+
+    Without ``can_view_all_tasks`` a user sees the tasks assigned to or created
+    by them and every task of the projects they own.
+    """
+    if session_ctx.get('can_view_all_tasks'):
+        return tasks_qs
+    user_id = session_ctx['user_id']
+    return tasks_qs.filter(
+        Q(assignee_id=user_id) | Q(created_by_id=user_id)
+        | Q(project_id__in=Project.objects.filter(owner_id=user_id).values('id'))
+    )
@@ -0,0 +1,58 @@
+import datetime
+
+from django.db import connection
+from django.test import TestCase
+
+from app.models import AppUser
+from projects.models import Project
+
+from .bulk import apply_changes, delete_tasks
+from .models import Task
+
+
+class BulkCounterTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # app_users is not managed by migrations
+        with connection.schema_editor() as editor:
+            editor.create_model(AppUser)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        with connection.schema_editor() as editor:
+            editor.delete_model(AppUser)
+
+    def setUp(self):
+        today = datetime.date.today()
+        self.user = AppUser.objects.create(username='owner', password_hash='x', display_name='Owner')
+        self.project = Project.objects.create(name='P', code='P1', start_date=today, end_date=today, owner=self.user)
+        self.other = Project.objects.create(name='Q', code='Q1', start_date=today, end_date=today, owner=self.user)
+        for n in range(3):
+            Task.objects.create(title='t%d' % n, project=self.project, status='done' if n == 0 else 'todo')
+        Task.objects.create(title='kept', project=self.other)
+
+    def assertCounters(self, project, tasks, open_tasks):
+        project.refresh_from_db()
+        self.assertEqual((project.task_count, project.open_task_count), (tasks, open_tasks))
+
+    def test_signals_keep_counters(self):
+        self.assertCounters(self.project, 3, 2)
+        self.assertCounters(self.other, 1, 1)
+
+    def test_delete_tasks_recomputes_counters(self):
+        deleted = delete_tasks(Task.objects.filter(project=self.project, status='todo'))
+        self.assertEqual(deleted, 2)
+        self.assertEqual(Task.objects.filter(project=self.project).count(), 1)
+        self.assertCounters(self.project, 1, 0)
+        self.assertCounters(self.other, 1, 1)
+
+    def test_delete_tasks_of_nothing(self):
+        self.assertEqual(delete_tasks(Task.objects.none()), 0)
+        self.assertCounters(self.project, 3, 2)
+
+    def test_apply_changes_recomputes_counters(self):
+        changed = apply_changes(Task.objects.filter(project=self.project), {'status': 'done'})
+        self.assertEqual(changed, 3)
+        self.assertCounters(self.project, 3, 0)
@@ -4,6 +4,9 @@ from . import views
 urlpatterns = [
     path('', views.task_list, name='task_list'),
     path('create/', views.task_create, name='task_create'),
+    path('import/', views.task_import, name='task_import'),
+    path('export/', views.task_export, name='task_export'),
+    path('bulk/', views.task_bulk, name='task_bulk'),
     path('<int:pk>/', views.task_detail, name='task_detail'),
     path('<int:pk>/edit/', views.task_update, name='task_update'),
     path('<int:pk>/delete/', views.task_delete, name='task_delete'),
@@ -2,12 +2,19 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.urls import reverse
 from django import forms
+from django.conf import settings
 
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, QueryDict
+from django.views.decorators.http import require_POST
 
 from .models import Task
-from .forms import TaskForm
-from app.models import AppUser
+from .bulk import apply_changes, delete_tasks, editable_tasks
+from .forms import TaskBulkForm, TaskFilterForm, TaskForm
+from .importers import TaskImporter
+from .permissions import visible_tasks
+from app.bulk_import import ImportFileError, template_response
+from app.export import chunk_size, export_format, export_response
+from app.pagination import keyset_iterate, keyset_paginate, page_querystring
 from app.utils import build_base_context
 from projects.models import Project
 
@@ -21,32 +28,116 @@ def _require_login(request):
     return session_ctx, None
 
 
+# list rows never show the description; leave the TextField out of the query
+TASK_LIST_FIELDS = (
+    'id', 'title', 'status', 'priority', 'due_date', 'updated_at', 'project_id', 'assignee_id',
+    'project__code', 'project__name', 'assignee__display_name', 'assignee__username',
+)
+TASK_LIST_ORDERING = ('-updated_at', '-id')
+
+
+TASK_EXPORT_COLUMNS = (
+    ('id', 'ID'),
+    ('project__code', '项目编码'),
+    ('project__name', '项目名称'),
+    ('title', '任务标题'),
+    ('status', '任务状态'),
+    ('priority', '优先级'),
+    ('assignee__username', '负责人'),
+    ('due_date', '截止日期'),
+    ('created_at', '创建时间'),
+    ('updated_at', '更新时间'),
+)
+
+
+def _task_export_row(row):
+    row['status'] = Task.STATUS_LABELS.get(row['status'], row['status'])
+    return [row[field] for field, _label in TASK_EXPORT_COLUMNS]
+
+
 def task_list(request):
     session_ctx, redirect_response = _require_login(request)
     if redirect_response:
         return redirect_response
-    tasks_qs = Task.objects.select_related('project', 'assignee').all()
-    # Optional filters from querystring
-    project_id = request.GET.get('project')
-    status = request.GET.get('status')
-    if project_id:
-        tasks_qs = tasks_qs.filter(project_id=project_id)
-    if status == 'not_done':
-        tasks_qs = tasks_qs.exclude(status='done')
-    tasks = tasks_qs.order_by('-updated_at')
+    filter_form = TaskFilterForm(request.GET)
+    tasks = Task.objects.select_related('project', 'assignee').only(*TASK_LIST_FIELDS)
+    tasks = filter_form.filter(visible_tasks(session_ctx, tasks))
+    page = keyset_paginate(
+        tasks, TASK_LIST_ORDERING,
+        after=request.GET.get('after'), before=request.GET.get('before'),
+        per_page=getattr(settings, 'TASK_PAGE_SIZE', 50),
+    )
+    filter_project = None
+    if filter_form.cleaned_data.get('project'):
+        filter_project = Project.objects.filter(pk=filter_form.cleaned_data['project']).only('code', 'name').first()
     context = {
         **session_ctx,
-        'tasks': tasks,
-        'task_list_url': reverse('task_list'),
+        'tasks': page,
+        'page': page,
+        'filter_form': filter_form,
+        'filter_project': filter_project,
+        # actions return to the page being viewed, filters included
+        'task_list_url': request.get_full_path(),
+        'export_query': page_querystring(request.GET, after=None, before=None),
+        'next_query': page_querystring(request.GET, after=page.next_cursor, before=None) if page.has_next else '',
+        'previous_query': page_querystring(request.GET, before=page.previous_cursor, after=None) if page.has_previous else '',
+        'bulk_form': TaskBulkForm(initial={'filter_query': page_querystring(request.GET, after=None, before=None)}),
     }
     return render(request, 'tasks/list.html', context)
 
 
+def task_export(request):
+    session_ctx, redirect_response = _require_login(request)
+    if redirect_response:
+        return redirect_response
+    tasks = visible_tasks(session_ctx, Task.objects.values(*(field for field, _label in TASK_EXPORT_COLUMNS)))
+    tasks = TaskFilterForm(request.GET).filter(tasks)
+    rows = (_task_export_row(row) for row in keyset_iterate(tasks, TASK_LIST_ORDERING, chunk_size()))
+    header = [label for _field, label in TASK_EXPORT_COLUMNS]
+    return export_response(export_format(request), 'tasks', header, rows, sheet_name='任务')
+
+
+@require_POST
+def task_bulk(request):
+    """Apply one bulk action to the selected tasks, or to every task matching the list filters."""
+    session_ctx, redirect_response = _require_login(request)
+    if redirect_response:
+        return redirect_response
+    next_url = request.POST.get('next') or reverse('task_list')
+    form = TaskBulkForm(request.POST)
+    if not form.is_valid():
+        errors = [error for field_errors in form.errors.values() for error in field_errors]
+        messages.error(request, errors[0] if errors else '批量操作参数有误')
+        return HttpResponseRedirect(next_url)
+    action = form.cleaned_data['action']
+    if action == 'delete' and not session_ctx.get('can_manage_tasks'):
+        messages.error(request, '没有权限删除任务')
+        return HttpResponseRedirect(next_url)
+    tasks = visible_tasks(session_ctx, Task.objects.all())
+    if form.cleaned_data['scope'] == TaskBulkForm.SCOPE_FILTER:
+        tasks = TaskFilterForm(QueryDict(form.cleaned_data['filter_query'])).filter(tasks)
+        selected = tasks.count()
+    else:
+        # checked rows the user may not see are skipped too, not silently dropped
+        selected = Task.objects.filter(pk__in=form.cleaned_data['ids']).count()
+        tasks = tasks.filter(pk__in=form.cleaned_data['ids'])
+    tasks = editable_tasks(tasks, session_ctx)
+    if action == 'delete':
+        count = delete_tasks(tasks)
+        messages.success(request, '已删除 %d 个任务' % count)
+    else:
+        count = apply_changes(tasks, form.changes())
+        messages.success(request, '已更新 %d 个任务' % count)
+    if selected > count:
+        messages.warning(request, '%d 个任务没有修改权限，已跳过' % (selected - count))
+    return HttpResponseRedirect(next_url)
+
+
 def task_detail(request, pk):
     session_ctx, redirect_response = _require_login(request)
     if redirect_response:
         return redirect_response
-    task = get_object_or_404(Task.objects.select_related('project', 'assignee'), pk=pk)
+    task = get_object_or_404(visible_tasks(session_ctx, Task.objects.select_related('project', 'assignee')), pk=pk)
     return_url = request.GET.get('next') or reverse('task_list')
     context = {
         **session_ctx,
@@ -66,7 +157,7 @@ def task_create(request):
         form = TaskForm(request.POST)
         if form.is_valid():
             task = form.save(commit=False)
-            task.created_by = AppUser.objects.get(pk=session_ctx['user_id'])
+            task.created_by_id = session_ctx['user_id']
             task.save()
             messages.success(request, '任务创建成功')
             return HttpResponseRedirect(next_url)
@@ -94,7 +185,7 @@ def project_task_create(request, project_id):
         form = TaskForm(request.POST)
         if form.is_valid():
             task = form.save(commit=False)
-            task.created_by = AppUser.objects.get(pk=session_ctx['user_id'])
+            task.created_by_id = session_ctx['user_id']
             task.project = project
             task.save()
             messages.success(request, '任务创建成功')
@@ -122,7 +213,7 @@ def task_update(request, pk):
     session_ctx, redirect_response = _require_login(request)
     if redirect_response:
         return redirect_response
-    task = get_object_or_404(Task, pk=pk)
+    task = get_object_or_404(visible_tasks(session_ctx, Task.objects.all()), pk=pk)
     next_url = request.GET.get('next') or request.POST.get('next') or reverse('task_detail', args=[task.id])
     task_list_url = reverse('task_list')
     if request.method == 'POST':
@@ -149,7 +240,7 @@ def task_delete(request, pk):
     session_ctx, redirect_response = _require_login(request)
     if redirect_response:
         return redirect_response
-    task = get_object_or_404(Task, pk=pk)
+    task = get_object_or_404(visible_tasks(session_ctx, Task.objects.all()), pk=pk)
     next_url = request.POST.get('next') or request.GET.get('next') or reverse('task_list')
     if request.method == 'POST':
         task.delete()
@@ -157,3 +248,36 @@ def task_delete(request, pk):
         return HttpResponseRedirect(next_url)
     messages.error(request, '非法请求')
     return HttpResponseRedirect(next_url)
+
+
+def task_import(request):
+    session_ctx, redirect_response = _require_login(request)
+    if redirect_response:
+        return redirect_response
+    if not session_ctx.get('can_manage_tasks'):
+        messages.error(request, '没有权限导入任务')
+        return redirect('task_list')
+    importer = TaskImporter(user_id=session_ctx['user_id'], partial=bool(request.POST.get('partial')))
+    if request.GET.get('template'):
+        return template_response(importer, 'tasks-template.csv')
+    report = None
+    upload = request.FILES.get('file')
+    if request.method == 'POST':
+        if upload is None:
+            messages.error(request, '请选择要导入的文件')
+        else:
+            try:
+                report = importer.run(upload, upload.name)
+            except ImportFileError as exc:
+                messages.error(request, str(exc))
+            else:
+                if report.committed:
+                    messages.success(request, '已导入 %d 个任务' % report.created)
+    context = {
+        **session_ctx,
+        'title': '批量导入任务',
+        'columns': importer.header_names(),
+        'report': report,
+        'back_url': reverse('task_list'),
+    }
+    return render(request, 'import.html', context)